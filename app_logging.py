@@ -0,0 +1,187 @@
+# app_logging.py
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+ROOT_LOGGER = "minecraft_ai"
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+# 日志调用时的保留参数，其余关键字参数作为结构化字段
+_RESERVED_KWARGS = ("exc_info", "stack_info", "stacklevel", "extra")
+
+_listener = None
+_queue_handler = None
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """支持结构化字段的日志接口：logger.info("执行操作", action="w")
+
+    级别未启用时在取参数之前就返回，热路径上的debug日志只花一次级别判断。
+    """
+
+    def process(self, msg, kwargs):
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in _RESERVED_KWARGS}
+        if fields:
+            kwargs["extra"] = dict(kwargs.get("extra") or {}, fields=fields)
+        return msg, kwargs
+
+
+def get_logger(name):
+    """获取模块的日志对象，名称为minecraft_ai.<name>"""
+    return StructuredLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"), {})
+
+
+class RateLimitFilter(logging.Filter):
+    """限制重复日志：同一调用位置在interval秒内最多输出burst条，其余只计数，
+    窗口结束后的下一条日志附带被省略的条数；只限制INFO和WARNING，
+    DEBUG是主动打开的详细输出，ERROR不能丢
+
+    与指标一样不加锁，多线程同时记录时计数偶尔不准，对输出没有影响。
+    """
+
+    def __init__(self, interval=5.0, burst=5):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.windows = {}  # {(日志名, 行号): [窗口开始时间, 窗口内已输出条数, 被省略条数]}
+        self.suppressed_total = 0
+
+    def filter(self, record):
+        if self.interval <= 0 or not logging.INFO <= record.levelno < logging.ERROR:
+            return True
+        key = (record.name, record.lineno)
+        window = self.windows.get(key)
+        if window is None or record.created - window[0] >= self.interval:
+            if window is not None and window[2]:
+                record.suppressed = window[2]
+            self.windows[key] = [record.created, 1, 0]
+            return True
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        self.suppressed_total += 1
+        return False
+
+
+class StructuredFormatter(logging.Formatter):
+    """文本格式：时间 级别 模块: 消息 key=value ...；json_format=True时每条日志输出一行JSON"""
+
+    def __init__(self, json_format=False):
+        super().__init__()
+        self.json_format = json_format
+
+    def format(self, record):
+        message = record.getMessage()
+        fields = getattr(record, "fields", None) or {}
+        suppressed = getattr(record, "suppressed", 0)
+        name = record.name[len(ROOT_LOGGER) + 1:] if record.name.startswith(ROOT_LOGGER + ".") else record.name
+        if self.json_format:
+            entry = {"time": record.created, "level": record.levelname, "logger": name, "message": message}
+            entry.update(fields)
+            if suppressed:
+                entry["suppressed"] = suppressed
+            if record.exc_info:
+                entry["exception"] = self.formatException(record.exc_info)
+            return json.dumps(entry, ensure_ascii=False, default=str)
+
+        timestamp = time.strftime("%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}"
+        text = f"{timestamp} {record.levelname[0]} {name}: {message}"
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if suppressed:
+            text += f" (此前{suppressed}条重复日志已省略)"
+        if record.exc_info:
+            text += "\n" + self.formatException(record.exc_info)
+        return text
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """只把日志记录放入队列，格式化和写出都在后台线程中进行
+
+    标准QueueHandler会在调用线程中先格式化消息；这里推迟到后台线程，
+    代价是日志参数若是之后被修改的可变对象，输出的是修改后的值。
+    队列满时丢弃新日志并计数，不阻塞调用方。
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level="INFO", log_file=None, json_format=False, rate_limit_interval=5.0, rate_limit_burst=5,
+                  queue_size=10000):
+    """配置异步日志：调用线程只做级别判断、限流和入队，后台线程负责格式化并写到控制台（和文件）
+
+    Args:
+        level (str): 日志级别，每帧的日志为DEBUG，默认INFO下决策循环不产生控制台输出
+        log_file (str): 同时写入的日志文件（按10MB轮转），None表示只输出到控制台
+        json_format (bool): 是否每条日志输出一行JSON
+        rate_limit_interval (float): 重复日志限流的时间窗口(秒)，0表示不限流
+        rate_limit_burst (int): 每个窗口内同一位置最多输出的条数
+        queue_size (int): 日志队列长度
+    """
+    global _listener, _queue_handler
+    shutdown_logging()
+
+    formatter = StructuredFormatter(json_format)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=10 * 1024 * 1024, backupCount=3,
+                                                             encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(queue_size)
+    _queue_handler = _DeferredQueueHandler(log_queue)
+    _queue_handler.addFilter(RateLimitFilter(rate_limit_interval, rate_limit_burst))
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.handlers = [_queue_handler]
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers)
+    _listener.start()
+    return _listener
+
+
+def flush_logging():
+    """等待队列中已有的日志全部写出（例如在打印最终统计之前）"""
+    if _listener is not None and _listener._thread is not None:
+        _listener.queue.join()
+
+
+def shutdown_logging():
+    """写出剩余日志并停止后台线程"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+    if _queue_handler is not None:
+        logging.getLogger(ROOT_LOGGER).removeHandler(_queue_handler)
+        _queue_handler = None
+
+
+def get_logging_stats():
+    """日志队列丢弃数和限流省略数"""
+    if _queue_handler is None:
+        return {"dropped": 0, "suppressed": 0}
+    return {
+        "dropped": _queue_handler.dropped,
+        "suppressed": sum(f.suppressed_total for f in _queue_handler.filters if isinstance(f, RateLimitFilter))
+    }
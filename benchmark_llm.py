@@ -0,0 +1,106 @@
+# benchmark_llm.py
+import argparse
+import random
+import time
+
+from app_logging import LOG_LEVELS, setup_logging, shutdown_logging
+from llm_health import LatencyHistogram
+from local_ai import DeepSeekAI
+from ollama_stub import OllamaStub
+
+# 各客户端模式对应的DeepSeekAI参数
+CLIENT_MODES = {
+    "text": {"structured_output": False, "reuse_prefix": False},
+    "structured": {"structured_output": True, "reuse_prefix": False},
+    "structured+prefix": {"structured_output": True, "reuse_prefix": True},
+    "plan": {"structured_output": True, "reuse_prefix": True, "plan_mode": True},
+    "hedged": {"structured_output": True, "reuse_prefix": True},
+}
+
+
+def make_state(rng):
+    """生成一个规则层无法决定、必须交给LLM的随机游戏状态"""
+    ratios = {name: round(rng.random() * 0.3, 3) for name in ("grass", "tree", "sky", "dirt")}
+    return {
+        "description_cn": "环境不明确，建议缓慢探索",
+        "ratios": ratios,
+        "detected_items": {},
+        "detected_structures": {},
+        "health": 20
+    }
+
+
+def run_mode(mode, stub_urls, ticks, time_budget, seed):
+    """用指定客户端模式驱动get_action若干次，返回延迟和超时/兜底统计"""
+    options = dict(CLIENT_MODES[mode])
+    if mode == "hedged":
+        options["backends"] = [{"model": "deepseek-r1:8b", "api_base": url} for url in stub_urls]
+    else:
+        options["api_base"] = stub_urls[0]
+
+    rng = random.Random(seed)
+    histogram = LatencyHistogram(window=ticks)
+    ai = DeepSeekAI(model_name="deepseek-r1:8b", **options)
+    # 不使用磁盘上的学习数据，保证各模式之间可比
+    ai.learning_memory["success_actions"] = {}
+    ai.learning_memory["failure_actions"] = set()
+    for _ in range(ticks):
+        start_time = time.time()
+        ai.get_action(make_state(rng), time_budget=time_budget)
+        histogram.record(time.time() - start_time)
+    ai.close()
+
+    llm_calls = ai.plan_stats["llm_calls"]
+    return {
+        "mode": mode,
+        "ticks": ticks,
+        **histogram.summary(),
+        "llm_calls": llm_calls,
+        "timeout_rate": ai.llm_outcomes["timeout"] / llm_calls if llm_calls else 0.0,
+        "fallback_rate": ai.tier_stats["fallback"] / ticks,
+        "avg_prompt_tokens": ai.get_prefill_report()["avg_prompt_tokens"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="基于Ollama替身的LLM决策延迟压测")
+    parser.add_argument("--modes", default=",".join(CLIENT_MODES), help="逗号分隔的客户端模式")
+    parser.add_argument("--ticks", type=int, default=50, help="每种模式的决策次数")
+    parser.add_argument("--budget", type=float, default=1.0, help="每帧决策预算(秒)")
+    parser.add_argument("--latency", default="lognormal:0.3,0.6", help="替身首个token前的延迟分布")
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--think-tokens", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="ERROR", choices=LOG_LEVELS,
+                        help="日志级别，默认只输出错误，超时等警告不与结果表格交错")
+    args = parser.parse_args()
+    setup_logging(args.log_level)
+
+    # 两个独立的替身实例，hedged模式把它们当作两个后端
+    stubs = [
+        OllamaStub(latency=args.latency, token_delay=args.token_delay, think_tokens=args.think_tokens,
+                   error_rate=args.error_rate, hang_rate=args.hang_rate, drop_rate=args.drop_rate,
+                   hang_time=5.0, seed=args.seed + i)
+        for i in range(2)
+    ]
+    urls = [stub.start() for stub in stubs]
+
+    print(f"替身延迟: {args.latency}, 每token {args.token_delay * 1000:.0f}ms, 预算 {args.budget}s, 每种模式 {args.ticks} 次")
+    print(f"{'模式':<18}{'p50':>9}{'p95':>9}{'p99':>9}{'LLM调用':>8}{'超时率':>7}{'兜底率':>7}{'提示词tokens':>10}")
+    try:
+        for mode in args.modes.split(","):
+            result = run_mode(mode, urls, args.ticks, args.budget, args.seed)
+            print(f"{mode:<20}{result['p50'] * 1000:>7.0f}ms{result['p95'] * 1000:>7.0f}ms{result['p99'] * 1000:>7.0f}ms"
+                  f"{result['llm_calls']:>10}{result['timeout_rate']:>10.0%}{result['fallback_rate']:>10.0%}"
+                  f"{result['avg_prompt_tokens']:>16.1f}")
+    finally:
+        for stub in stubs:
+            stub.stop()
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# camera_controller.py
+import math
+import threading
+import time
+
+from app_logging import get_logger
+from input_scheduler import ActionHandle
+
+logger = get_logger("camera_controller")
+
+
+class CameraController:
+    """连续视角控制线程
+
+    决策层每帧可以随时更新目标角速度或追加转动角度（立即返回，不阻塞），
+    后台线程以固定的高频率发出小幅度的相对鼠标移动，实现平滑、精细的转向和瞄准。
+    """
+
+    def __init__(self, backend, rate_hz=250, pixels_per_degree=6.67, max_speed=360.0, fov=70.0):
+        """
+        Args:
+            backend: 输入后端（input_backend.InputBackend）
+            rate_hz (int): 发出鼠标移动的频率
+            pixels_per_degree (float): 每转动1度需要的鼠标移动量（Minecraft默认灵敏度约为6.67）
+            max_speed (float): 追加转动角度时的最大转速(度/秒)
+            fov (float): 游戏的垂直视野角度，用于把画面像素偏移换算为角度
+        """
+        self.backend = backend
+        self.interval = 1.0 / rate_hz
+        self.pixels_per_degree = pixels_per_degree
+        self.max_speed = max_speed
+        self.fov = fov
+
+        self.lock = threading.Condition()
+        self.velocity = (0.0, 0.0)  # 持续角速度(偏航, 俯仰)，度/秒
+        self.remaining = [0.0, 0.0]  # 尚未转完的角度(偏航, 俯仰)
+        self.carry = [0.0, 0.0]  # 不足1像素的移动量，累计到下一次
+        self.waiting_handles = []  # 等待转动完成的句柄
+        self.scheduled = []  # 到时间才开始的转动[(开始时间, 偏航, 俯仰, 句柄)]，按开始时间排序
+        self.running = True
+        self.stats = {"moves": 0, "ticks": 0}
+
+        self.thread = threading.Thread(target=self._run, name="CameraController", daemon=True)
+        self.thread.start()
+
+    def set_velocity(self, yaw_speed, pitch_speed=0.0):
+        """设置持续转动的角速度(度/秒)，正值为向右/向下，设为0停止"""
+        with self.lock:
+            self.velocity = (yaw_speed, pitch_speed)
+            self.lock.notify()
+
+    def turn(self, yaw, pitch=0.0, action=None, start_at=None):
+        """追加转动角度(度)，以不超过max_speed的速度平滑转完，返回转完时完成的句柄
+
+        给出start_at时到该时间才开始转动，与按键操作一样遵守操作间隔。
+        """
+        handle = ActionHandle(action or f"turn:{yaw:.1f},{pitch:.1f}")
+        with self.lock:
+            if start_at is not None and start_at > time.time():
+                self.scheduled.append((start_at, yaw, pitch, handle))
+                self.scheduled.sort(key=lambda item: item[0])
+            else:
+                self._start_turn(yaw, pitch, handle)
+            self.lock.notify()
+        return handle
+
+    def _start_turn(self, yaw, pitch, handle):
+        """调用方需持有lock"""
+        handle.started_at = time.time()
+        self.remaining[0] += yaw
+        self.remaining[1] += pitch
+        self.waiting_handles.append(handle)
+
+    def aim_at_pixel(self, x, y, frame_width, frame_height):
+        """把画面中(x, y)处的目标转到准星位置（例如分析器找到的树或怪物）"""
+        # 透视投影：像素偏移→角度
+        tan_v = math.tan(math.radians(self.fov) / 2)
+        tan_h = tan_v * frame_width / frame_height
+        yaw = math.degrees(math.atan((x - frame_width / 2) / (frame_width / 2) * tan_h))
+        pitch = math.degrees(math.atan((y - frame_height / 2) / (frame_height / 2) * tan_v))
+        with self.lock:
+            # 新目标替换尚未转完的旧目标
+            self.remaining = [yaw, pitch]
+        return self.turn(0.0, 0.0, action=f"aim:{x},{y}")
+
+    def stop(self):
+        """停止转动并丢弃尚未转完的角度"""
+        with self.lock:
+            self.velocity = (0.0, 0.0)
+            self.remaining = [0.0, 0.0]
+            handles, self.waiting_handles = self.waiting_handles, []
+            handles += [handle for _, _, _, handle in self.scheduled]
+            self.scheduled = []
+        for handle in handles:
+            handle._finish(ok=False)
+
+    def _idle(self):
+        return self.velocity == (0.0, 0.0) and not self.waiting_handles and \
+            abs(self.remaining[0]) < 1e-3 and abs(self.remaining[1]) < 1e-3
+
+    def _run(self):
+        last_tick = time.time()
+        while True:
+            with self.lock:
+                while self.running and self._idle():
+                    timeout = self.scheduled[0][0] - time.time() if self.scheduled else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self.lock.wait(timeout)
+                    last_tick = time.time()
+                if not self.running:
+                    return
+                now = time.time()
+                while self.scheduled and self.scheduled[0][0] <= now:
+                    _, yaw, pitch, handle = self.scheduled.pop(0)
+                    self._start_turn(yaw, pitch, handle)
+                dt = min(now - last_tick, 0.1)
+                last_tick = now
+
+                # 本次要转的角度 = 持续角速度部分 + 追加角度中不超过最大转速的部分
+                step = [self.velocity[0] * dt, self.velocity[1] * dt]
+                max_step = self.max_speed * dt
+                for axis in range(2):
+                    delta = max(-max_step, min(max_step, self.remaining[axis]))
+                    self.remaining[axis] -= delta
+                    step[axis] += delta
+
+                # 换算为整数像素，余数累计到下一次
+                pixels = []
+                for axis in range(2):
+                    exact = step[axis] * self.pixels_per_degree + self.carry[axis]
+                    whole = int(exact)
+                    self.carry[axis] = exact - whole
+                    pixels.append(whole)
+
+                finished = []
+                if abs(self.remaining[0]) < 1e-3 and abs(self.remaining[1]) < 1e-3:
+                    finished, self.waiting_handles = self.waiting_handles, []
+                self.stats["ticks"] += 1
+
+            if pixels[0] or pixels[1]:
+                try:
+                    self.backend.move_relative(pixels[0], pixels[1])
+                    self.backend.flush()
+                    self.stats["moves"] += 1
+                except Exception as e:
+                    logger.warning("视角移动失败：%s", e)
+            for handle in finished:
+                handle._finish()
+            time.sleep(self.interval)
+
+    def close(self):
+        self.stop()
+        with self.lock:
+            self.running = False
+            self.lock.notify()
+        self.thread.join(timeout=1)
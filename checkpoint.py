@@ -0,0 +1,137 @@
+# checkpoint.py
+import json
+import os
+import threading
+import time
+
+from app_logging import get_logger
+from metrics import registry
+
+logger = get_logger("checkpoint")
+
+
+class SessionCheckpointer:
+    """会话状态的定期增量检查点
+
+    各部分状态用register()登记，每部分单独一个JSON文件。后台线程按间隔收集和序列化，
+    内容与上次写出的相同时跳过，只重写发生变化的部分；写入时先写临时文件并fsync再替换，
+    进程在任何时刻崩溃都只会留下上一份完整的检查点。
+    收集和序列化不加锁，字典恰好在序列化期间被决策线程修改时重试；
+    写入耗时占间隔的比例超过max_duty时自动拉长下一次的间隔，写入开销有上限。
+    """
+
+    def __init__(self, directory="checkpoints", interval=30.0, max_duty=0.02, fsync=True):
+        """
+        Args:
+            directory (str): 检查点目录
+            interval (float): 检查点间隔(秒)
+            max_duty (float): 写入耗时占运行时间比例的上限
+            fsync (bool): 替换前是否把临时文件刷到磁盘（断电也不丢失）
+        """
+        self.directory = directory
+        self.interval = interval
+        self.max_duty = max_duty
+        self.fsync = fsync
+        self.sections = {}  # {名称: [收集函数, 文件路径, 上次写出的内容]}
+        self.lock = threading.Lock()  # 后台线程和close()不会同时写
+        self.next_interval = interval
+        self.stats = {"checkpoints": 0, "writes": 0, "unchanged": 0, "bytes": 0, "retries": 0, "errors": 0,
+                      "total_time": 0.0, "last_time": 0.0, "max_time": 0.0}
+        self.write_seconds = registry.histogram("checkpoint_seconds", "一次检查点（收集、序列化和写入）的耗时(秒)")
+        self.bytes_counter = registry.counter("checkpoint_bytes_total", "检查点写入的字节数")
+        os.makedirs(directory, exist_ok=True)
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="Checkpoint", daemon=True)
+        self.thread.start()
+
+    def register(self, name, collect, path=None):
+        """登记一部分状态
+
+        Args:
+            name (str): 名称，默认文件为<目录>/<名称>.json
+            collect: 无参数函数，返回可JSON序列化的当前状态
+            path (str): 指定文件路径（例如沿用已有的learning_data.json）
+        """
+        path = path or os.path.join(self.directory, f"{name}.json")
+        self.sections[name] = [collect, path, None]
+
+    def load(self, name, path=None):
+        """读取一部分状态的检查点，不存在或损坏时返回None"""
+        path = path or os.path.join(self.directory, f"{name}.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("读取检查点失败: %s", e, section=name, path=path)
+            return None
+
+    def _serialize(self, collect, attempts=3):
+        for attempt in range(attempts):
+            try:
+                return json.dumps(collect(), ensure_ascii=False, indent=2, default=str)
+            except RuntimeError:
+                # dictionary changed size during iteration：决策线程正在更新，稍后重试
+                if attempt == attempts - 1:
+                    raise
+                self.stats["retries"] += 1
+                time.sleep(0.001)
+
+    def _write(self, path, text):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def checkpoint(self):
+        """写出发生变化的部分，返回本次耗时(秒)"""
+        with self.lock:
+            start = time.perf_counter()
+            for name, section in list(self.sections.items()):
+                collect, path, last_text = section
+                try:
+                    text = self._serialize(collect)
+                    if text == last_text:
+                        self.stats["unchanged"] += 1
+                        continue
+                    self._write(path, text)
+                    section[2] = text
+                    size = len(text.encode("utf-8"))
+                    self.stats["writes"] += 1
+                    self.stats["bytes"] += size
+                    self.bytes_counter.inc(size)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logger.warning("写入检查点失败: %s", e, section=name, path=path)
+            elapsed = time.perf_counter() - start
+            self.stats["checkpoints"] += 1
+            self.stats["total_time"] += elapsed
+            self.stats["last_time"] = elapsed
+            self.stats["max_time"] = max(self.stats["max_time"], elapsed)
+            self.write_seconds.record(elapsed)
+            return elapsed
+
+    def _run(self):
+        while not self.stop_event.wait(self.next_interval):
+            elapsed = self.checkpoint()
+            # 写入变慢（学习表变大、磁盘繁忙）时拉长间隔，使写入耗时不超过运行时间的max_duty
+            self.next_interval = max(self.interval, elapsed / self.max_duty) if self.max_duty > 0 else self.interval
+            if self.next_interval > self.interval:
+                logger.debug("检查点写入较慢，延长间隔", elapsed=round(elapsed, 3),
+                             interval=round(self.next_interval, 1))
+
+    def get_report(self):
+        checkpoints = self.stats["checkpoints"]
+        return dict(self.stats, directory=self.directory, interval=self.next_interval,
+                    avg_time=self.stats["total_time"] / checkpoints if checkpoints else 0.0)
+
+    def close(self):
+        """停止后台线程并写出最后一次检查点"""
+        self.stop_event.set()
+        self.thread.join(timeout=5)
+        self.checkpoint()
@@ -0,0 +1,158 @@
+# decision_worker.py
+import asyncio
+import threading
+import time
+from concurrent.futures import CancelledError, TimeoutError
+
+from app_logging import get_logger
+
+logger = get_logger("decision_worker")
+
+
+class SpeculativeDecisionWorker:
+    """基于asyncio的推测式决策线程
+
+    当前动作执行期间（按键保持0.2~0.5秒、循环补齐到1秒），LLM原本处于空闲状态。
+    该线程在动作执行的同时，为预测的下一状态提前启动推理；
+    真实的动作后画面到达时，再验证推测结果是否仍然有效，有效则直接使用，否则丢弃。
+    """
+
+    def __init__(self, ai, ratio_tolerance=0.05):
+        self.ai = ai
+        self.ratio_tolerance = ratio_tolerance  # 各元素比例的最大允许差异
+        self.pending = None  # (预测状态, concurrent.futures.Future, 启动时间, 取消事件)
+        self.lock = threading.Lock()  # pending由执行阶段(speculate)和决策阶段(resolve)两个线程读写
+
+        # 统计信息
+        self.stats = {
+            "started": 0,      # 启动的推测次数
+            "hits": 0,         # 验证通过并采用
+            "mismatched": 0,   # 状态不一致被丢弃
+            "late": 0,         # 预算内未完成被丢弃
+            "cancelled": 0,    # 等待期间被取消（例如关闭时）
+            "errors": 0,       # 推理抛出异常
+            "empty": 0,        # 推理完成但没有可用动作
+            "saved_time": 0.0  # 推测与动作执行重叠节省的推理时间(秒)
+        }
+
+        # 在后台线程中运行独立的事件循环
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, name="SpeculativeDecisionWorker", daemon=True)
+        self.thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _infer(self, predicted_state, cancel_event):
+        """在线程池中执行阻塞的LLM请求，避免阻塞事件循环
+
+        取消asyncio的future不会停止线程池中已开始的请求，所以另外传入cancel_event，
+        丢弃推测时设置它，让_llm_decide断开与后端的连接，不再占用模型。
+        """
+        state_key = self.ai._get_state_key(predicted_state)
+        return await self.loop.run_in_executor(
+            None, self.ai._llm_decide, predicted_state, state_key, self.ai.inference_timeout(), cancel_event
+        )
+
+    def speculate(self, predicted_state):
+        """为预测的下一状态启动推理（立即返回，不阻塞动作执行）"""
+        # 规则或学习表就能决定的状态不需要推测，后端熔断期间也不推测
+        if not self.ai.model_loaded or not self.ai.needs_llm(predicted_state):
+            return
+        if not self.ai.llm_available():
+            return
+        cancel_event = threading.Event()
+        future = asyncio.run_coroutine_threadsafe(self._infer(predicted_state, cancel_event), self.loop)
+        with self.lock:
+            previous, self.pending = self.pending, (predicted_state, future, time.time(), cancel_event)
+        self._cancel(previous)
+        self.stats["started"] += 1
+
+    def resolve(self, actual_state, time_budget=None):
+        """真实状态到达后验证推测结果，有效则采用，否则回退到常规分层决策
+
+        Args:
+            actual_state (dict): 动作执行后真实分析得到的游戏状态
+            time_budget (float): 本帧剩余的决策预算(秒)
+
+        Returns:
+            str: 操作指令
+        """
+        start_time = time.time()
+        budget = self.ai.default_time_budget if time_budget is None else max(0.0, time_budget)
+
+        with self.lock:
+            pending, self.pending = self.pending, None
+        if pending is not None:
+            predicted_state, future, spec_start, cancel_event = pending
+
+            if not self._states_match(predicted_state, actual_state):
+                self._cancel(pending)
+                self.stats["mismatched"] += 1
+            else:
+                try:
+                    # 推测已经提前跑了一段时间，这里最多只等待本帧剩余预算
+                    actions = future.result(timeout=budget)
+                except Exception as e:
+                    self._cancel(pending)
+                    self._record_failure(e)
+                    budget = max(0.0, budget - (time.time() - start_time))
+                else:
+                    action = self.ai.start_plan(actual_state, actions)
+                    if action is not None:
+                        self.stats["hits"] += 1
+                        self.stats["saved_time"] += start_time - spec_start
+                        return self.ai.record_decision(actual_state, action, "speculative", budget, start_time)
+                    self.stats["empty"] += 1
+
+        return self.ai.get_action(actual_state, time_budget=budget)
+
+    def _record_failure(self, error):
+        """按原因统计未能采用的推测：预算内未完成、被取消、推理出错"""
+        if isinstance(error, TimeoutError):
+            self.stats["late"] += 1
+        elif isinstance(error, CancelledError):
+            self.stats["cancelled"] += 1
+        else:
+            logger.warning("推测推理出错: %s", error)
+            self.stats["errors"] += 1
+
+    def _states_match(self, predicted_state, actual_state):
+        """判断预测状态与真实状态是否足够接近，可以沿用推测结果"""
+        if predicted_state["description_cn"] != actual_state["description_cn"]:
+            return False
+        predicted_ratios = predicted_state["ratios"]
+        actual_ratios = actual_state["ratios"]
+        for name, ratio in actual_ratios.items():
+            if abs(predicted_ratios.get(name, 0) - ratio) > self.ratio_tolerance:
+                return False
+        return True
+
+    @staticmethod
+    def _cancel(pending):
+        if pending is not None:
+            pending[1].cancel()
+            pending[3].set()
+
+    def _discard_pending(self):
+        with self.lock:
+            pending, self.pending = self.pending, None
+        self._cancel(pending)
+
+    async def _cancel_tasks(self):
+        """取消并等待事件循环中剩余的推测任务，停止循环时不留下未结束的任务"""
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        """停止事件循环线程"""
+        self._discard_pending()
+        try:
+            asyncio.run_coroutine_threadsafe(self._cancel_tasks(), self.loop).result(timeout=1)
+        except Exception as e:
+            logger.warning("取消推测任务失败: %s", e)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=1)
@@ -0,0 +1,158 @@
+# frame_pacing.py
+import threading
+import time
+
+from llm_health import LatencyHistogram
+
+# 节奏预设：目标延迟(从截图到动作完成，秒)、决策频率范围(次/秒)、CPU预算(占用的核心数)、
+# 分析分辨率缩放范围、是否运行可选阶段（夜晚检测、画面显示）；fixed只统计不调整
+PACING_PRESETS = {
+    "fixed": {"target_latency": 1.5, "min_tick_rate": 1.0, "max_tick_rate": 1.0, "cpu_budget": 1.0,
+              "min_scale": 1.0, "max_scale": 1.0, "optional_stages": True, "adaptive": False},
+    "low-latency": {"target_latency": 0.8, "min_tick_rate": 1.0, "max_tick_rate": 10.0, "cpu_budget": 2.0,
+                    "min_scale": 0.5, "max_scale": 1.0, "optional_stages": True},
+    "balanced": {"target_latency": 1.2, "min_tick_rate": 0.5, "max_tick_rate": 4.0, "cpu_budget": 1.0,
+                 "min_scale": 0.5, "max_scale": 1.0, "optional_stages": True},
+    "power-saver": {"target_latency": 2.0, "min_tick_rate": 0.2, "max_tick_rate": 1.0, "cpu_budget": 0.25,
+                    "min_scale": 0.25, "max_scale": 0.5, "optional_stages": False},
+}
+
+# 主要占用CPU的阶段（执行阶段大部分时间在等待按键松开，推理在Ollama进程中）
+CPU_STAGES = ("capture", "analyze")
+# 可选阶段：延迟超标时按此顺序逐个关闭（夜晚检测在延迟路径上，先关），恢复时按相反顺序
+OPTIONAL_STAGES = ("night", "display")
+
+
+class FramePacer:
+    """自适应帧节奏控制
+
+    记录截图、分析、决策、执行各阶段的耗时（指数滑动平均）和每一帧从截图到动作完成的延迟，
+    定期调整决策频率、分析分辨率缩放和是否运行可选阶段，使延迟保持在目标以内、CPU占用不超过预算：
+    - 决策频率不超过最慢阶段的吞吐量，也不超过CPU预算允许的频率；
+      间隔不短于最小决策预算加LLM推理延迟中位数，避免截图越来越快、LLM永远来不及调用
+    - 延迟超标时先降低分析分辨率，已到下限再逐个关闭可选阶段；延迟明显低于目标时按相反顺序恢复
+    决策预算按目标延迟计算(decision_budget)，与截图间隔无关。
+    """
+
+    def __init__(self, preset="balanced", tick_rate=None, alpha=0.2, adjust_interval=2.0, inference_latency=None,
+                 min_decision_budget=0.3, **overrides):
+        """
+        Args:
+            preset (str): PACING_PRESETS中的预设名
+            tick_rate (float): 初始决策频率，默认为预设的频率下限
+            alpha (float): 阶段耗时滑动平均的权重
+            adjust_interval (float): 两次调整之间的最短间隔(秒)
+            inference_latency: 无参数函数，返回当前LLM推理延迟的中位数(秒)，未知时返回None
+            min_decision_budget (float): 调用LLM所需的最小剩余预算(秒)
+            overrides: 覆盖预设中的参数
+        """
+        if preset not in PACING_PRESETS:
+            raise ValueError(f"未知的节奏预设: {preset}")
+        self.preset = preset
+        self.config = dict(PACING_PRESETS[preset], **overrides)
+        self.alpha = alpha
+        self.adjust_interval = adjust_interval
+        self.inference_latency = inference_latency
+        self.min_decision_budget = min_decision_budget
+
+        self.tick_rate = tick_rate or self.config["min_tick_rate"]
+        if not self.config.get("adaptive", True):
+            self.config["min_tick_rate"] = self.config["max_tick_rate"] = self.tick_rate
+        self.analysis_scale = self.config["max_scale"]
+        self.disabled_stages = set() if self.config["optional_stages"] else set(OPTIONAL_STAGES)
+
+        self.lock = threading.Lock()
+        self.stage_costs = {}  # {阶段名: 滑动平均耗时(秒)}
+        self.latency_histogram = LatencyHistogram(window=100)
+        self.last_adjust = time.time()
+        self.stats = {"ticks": 0, "within_target": 0, "adjustments": 0}
+
+    @property
+    def tick_interval(self):
+        return 1.0 / self.tick_rate
+
+    def optional_enabled(self, name):
+        """可选阶段（night夜晚检测、display画面显示）当前是否运行"""
+        return name not in self.disabled_stages
+
+    def decision_budget(self, captured_at):
+        """本帧从截图起到目标延迟为止剩余的时间，作为分层决策的预算"""
+        return max(0.0, self.config["target_latency"] - (time.time() - captured_at))
+
+    def record_stage(self, name, seconds):
+        """记录一个阶段处理一项数据的耗时（由流水线各阶段线程调用）"""
+        with self.lock:
+            previous = self.stage_costs.get(name)
+            self.stage_costs[name] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+
+    def record_tick(self, latency):
+        """记录一帧从截图到动作完成的延迟，到调整间隔时重新计算节奏"""
+        self.latency_histogram.record(latency)
+        self.stats["ticks"] += 1
+        if latency <= self.config["target_latency"]:
+            self.stats["within_target"] += 1
+        if time.time() - self.last_adjust >= self.adjust_interval:
+            self.adjust()
+
+    def adjust(self):
+        """根据测得的阶段耗时和延迟调整决策频率、分析分辨率和可选阶段"""
+        config = self.config
+        with self.lock:
+            costs = dict(self.stage_costs)
+        self.last_adjust = time.time()
+        if not costs or not config.get("adaptive", True):
+            return
+
+        # 决策频率：流水线吞吐量受最慢阶段限制，留10%余量；CPU占用 = 每帧CPU耗时 × 频率
+        rate = config["max_tick_rate"]
+        bottleneck = max(costs.values())
+        if bottleneck > 0:
+            rate = min(rate, 0.9 / bottleneck)
+        cpu_per_tick = sum(costs.get(name, 0.0) for name in CPU_STAGES)
+        if cpu_per_tick > 0:
+            rate = min(rate, config["cpu_budget"] / cpu_per_tick)
+        # 决策阶段跳过LLM时耗时很短，只看阶段耗时会不断提高频率，所以按测得的推理延迟单独限制
+        inference = self.inference_latency() if self.inference_latency is not None else None
+        if inference is not None:
+            rate = min(rate, 1.0 / (self.min_decision_budget + inference))
+        rate = max(config["min_tick_rate"], rate)
+
+        # 分析分辨率和可选阶段：按p95延迟与目标比较
+        scale = self.analysis_scale
+        disabled = set(self.disabled_stages)
+        p95 = self.latency_histogram.percentile(95)
+        if p95 is not None:
+            if p95 > config["target_latency"]:
+                if scale > config["min_scale"]:
+                    scale = max(config["min_scale"], round(scale - 0.1, 2))
+                else:
+                    enabled = [name for name in OPTIONAL_STAGES if name not in disabled]
+                    if enabled:
+                        disabled.add(enabled[0])
+            elif p95 < 0.7 * config["target_latency"]:
+                if disabled and config["optional_stages"]:
+                    disabled.discard([name for name in OPTIONAL_STAGES if name in disabled][-1])
+                elif scale < config["max_scale"]:
+                    scale = min(config["max_scale"], round(scale + 0.1, 2))
+
+        if (round(rate, 2), scale, disabled) != (round(self.tick_rate, 2), self.analysis_scale, self.disabled_stages):
+            self.stats["adjustments"] += 1
+        self.tick_rate = rate
+        self.analysis_scale = scale
+        self.disabled_stages = disabled
+
+    def get_report(self):
+        """节奏控制效果：延迟分布、达标率和当前参数"""
+        ticks = self.stats["ticks"]
+        return {
+            "preset": self.preset,
+            "target_latency": self.config["target_latency"],
+            **self.latency_histogram.summary(),
+            "ticks": ticks,
+            "within_target_rate": self.stats["within_target"] / ticks if ticks else 0.0,
+            "adjustments": self.stats["adjustments"],
+            "tick_rate": self.tick_rate,
+            "analysis_scale": self.analysis_scale,
+            "optional_stages": [name for name in OPTIONAL_STAGES if name not in self.disabled_stages],
+            "stage_costs": dict(self.stage_costs)
+        }
@@ -2,6 +2,15 @@ import cv2
 import numpy as np
 import os
 import sys
+import time
+
+from app_logging import get_logger
+from metrics import registry
+
+logger = get_logger("game_analyzer")
+
+ANALYZE_SECONDS = registry.histogram("analyze_frame_seconds", "分析一帧画面的耗时(秒)")
+MENU_CHECK_SECONDS = registry.histogram("menu_check_seconds", "菜单检测的耗时(秒)")
 
 # 尝试导入PIL库（用于显示中文）
 try:
@@ -77,7 +86,7 @@ class GameStateAnalyzer:
         templates = {}
         if not os.path.exists(self.item_templates_path):
             os.makedirs(self.item_templates_path)
-            print(f"创建物品模板目录: {self.item_templates_path}")
+            logger.info("创建物品模板目录: %s", self.item_templates_path)
             return templates
         
         for filename in os.listdir(self.item_templates_path):
@@ -87,7 +96,7 @@ class GameStateAnalyzer:
                 template = cv2.imread(template_path, 0)
                 if template is not None:
                     templates[item_name] = template
-                    print(f"加载物品模板: {item_name}")
+                    logger.debug("加载物品模板: %s", item_name)
         return templates
 
     def _detect_items(self, frame):
@@ -129,8 +138,8 @@ class GameStateAnalyzer:
         # 简单转换为生命值（0-20）
         return int((health_pixels / total_pixels) * 20) if total_pixels > 0 else 20
 
-    def _detect_structures(self, frame):
-        """检测村庄和遗迹等结构"""
+    def _detect_structures(self, frame, area_scale=1.0):
+        """检测村庄和遗迹等结构（area_scale为画面缩小后的面积比例，用于换算建筑的最小面积）"""
         detected_structures = {}
         hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
         height, width = frame.shape[:2]
@@ -144,7 +153,7 @@ class GameStateAnalyzer:
         if roof_pixels > village_params["threshold"]:
             # 简单形状分析判断建筑轮廓
             contours, _ = cv2.findContours(roof_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            large_buildings = [c for c in contours if cv2.contourArea(c) > village_params["min_building_size"]]
+            large_buildings = [c for c in contours if cv2.contourArea(c) > village_params["min_building_size"] * area_scale]
             
             if len(large_buildings) > 2:
                 detected_structures["village"] = {
@@ -183,6 +192,10 @@ class GameStateAnalyzer:
 
     def is_menu_open(self, frame):
         """检测是否打开了ESC菜单"""
+        with MENU_CHECK_SECONDS.time():
+            return self._is_menu_open(frame)
+
+    def _is_menu_open(self, frame):
         # 菜单通常有特定的颜色和UI元素
         height, width = frame.shape[:2]
         
@@ -211,9 +224,18 @@ class GameStateAnalyzer:
         return is_menu
         return avg_brightness_top < 40 and edge_density < 0.15
 
-    def analyze_frame(self, frame):
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        height, width = frame.shape[:2]
+    def is_menu_open_fast(self, frame, stride=4):
+        """快速检测ESC菜单：隔stride个像素采样后再判断，用于菜单恢复时按截图频率轮询"""
+        return self.is_menu_open(frame[::stride, ::stride])
+
+    def analyze_frame(self, frame, scale=1.0):
+        """分析画面；scale<1时颜色比例和结构检测在缩小后的画面上进行（物品和生命值仍使用原始分辨率）"""
+        start = time.perf_counter()
+        small = frame
+        if scale < 1.0:
+            small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        height, width = small.shape[:2]
         total_pixels = height * width
 
         element_ratio = {}
@@ -225,7 +247,7 @@ class GameStateAnalyzer:
         # 生成中英文双语描述（确保至少有英文显示）
         # 检测物品和结构
         detected_items = self._detect_items(frame.copy())
-        detected_structures = self._detect_structures(frame.copy())
+        detected_structures = self._detect_structures(small.copy(), area_scale=min(1.0, scale) ** 2)
         
         state_description_cn = []
         state_description_en = []
@@ -260,7 +282,7 @@ class GameStateAnalyzer:
             state_description_cn.append("环境不明确，建议缓慢探索")
             state_description_en.append("Environment unclear, explore cautiously")
 
-        return {
+        game_state = {
             "description_cn": "; ".join(state_description_cn),
             "description_en": "; ".join(state_description_en),
             "ratios": element_ratio,
@@ -269,6 +291,8 @@ class GameStateAnalyzer:
             "detected_structures": detected_structures,
             "health": self._detect_health(frame)
         }
+        ANALYZE_SECONDS.record(time.perf_counter() - start)
+        return game_state
 
 # 获取中文字体（优先使用指定字体，否则使用PIL备用方案）
 def get_chinese_font():
@@ -277,7 +301,7 @@ def get_chinese_font():
     
     # 检查字体文件是否存在
     if os.path.exists(font_path):
-        print(f"使用自定义中文字体：{font_path}")
+        logger.info("使用自定义中文字体：%s", font_path)
         return font_path
     
     # 如果找不到指定字体，检查系统字体
@@ -289,16 +313,16 @@ def get_chinese_font():
     
     for path in system_font_paths:
         if os.path.exists(path):
-            print(f"使用系统中文字体：{path}")
+            logger.info("使用系统中文字体：%s", path)
             return path
     
     # 如果找不到任何中文字体，检查是否可以使用PIL库
     if PIL_AVAILABLE:
-        print("警告：未找到中文字体，将使用PIL默认字体（可能无法显示中文）")
+        logger.warning("未找到中文字体，将使用PIL默认字体（可能无法显示中文）")
         return None
     
     # 如果都不支持，使用默认字体（显示问号）
-    print("警告：未找到中文字体且PIL库不可用，中文将显示为问号")
+    logger.warning("未找到中文字体且PIL库不可用，中文将显示为问号")
     return cv2.FONT_HERSHEY_SIMPLEX
 
 # 使用PIL库在图像上绘制中文
@@ -2,13 +2,29 @@
 import os
 import subprocess
 import time
-print("加载game_controller模块...")  # 用于调试
+from camera_controller import CameraController
+from input_backend import create_input_backend
+from input_scheduler import InputScheduler, ActionHandle
+from metrics import registry
+from app_logging import get_logger
+
+logger = get_logger("game_controller")
+logger.debug("加载game_controller模块...")
 
 class GameController:
-    def __init__(self, back_to_game_mode=0):
-        print("初始化GameController类...")  # 用于调试
+    def __init__(self, back_to_game_mode=0, input_backend="auto"):
+        logger.debug("初始化GameController类...")
         # 设置回到游戏模式：0=点击方式，1=直接运行回到游戏exe文件
         self.back_to_game_mode = back_to_game_mode
+        # 输入后端：direct=SendInput批量提交，pyautogui=原有方式，recording=只记录事件不产生输入
+        if isinstance(input_backend, str):
+            input_backend = create_input_backend(input_backend)
+        self.input_backend = input_backend
+        # 输入调度线程：按键保持和鼠标移动在后台执行，调用方立即拿到可等待的句柄
+        self.scheduler = InputScheduler(self.input_backend)
+        # 视角控制线程：以固定高频率发出小幅鼠标移动，决策层可随时更新转向目标
+        self.camera = CameraController(self.input_backend)
+        self._start_at = None  # 当前操作的计划开始时间（由execute_action设置）
         # 操作映射：AI输出→键盘/鼠标动作
         self.action_map = {
             "w": lambda: self._press_key("w", 0.5),  # 前进
@@ -24,31 +40,33 @@ class GameController:
             "回到游戏": lambda: self._back_to_game(),  # 回到游戏(根据模式选择方式)
 
         }
+        # 需要在调用线程中同步执行的操作（内部有等待和画面识别）
+        self.blocking_actions = {"回到游戏"}
         self.min_action_interval = 0.5  # 操作间隔（秒）
         self.last_action_time = 0
+        # 指标：各操作的执行次数和无法识别的操作次数
+        self.action_counters = {
+            action: registry.counter("actions_total", "执行的操作次数", {"action": action})
+            for action in self.action_map
+        }
+        self.unknown_actions = registry.counter("unknown_actions_total", "无法识别而跳过的操作次数")
 
-    # 辅助方法：按住按键
+    # 辅助方法：按住按键（由调度线程松开，不阻塞调用方）
     def _press_key(self, key, duration):
-        import pyautogui
-        import time
-        pyautogui.keyDown(key)
-        time.sleep(duration)
-        pyautogui.keyUp(key)
+        return self.scheduler.hold_key(key, duration, start_at=self._start_at)
 
     # 辅助方法：鼠标点击
     def _click_mouse(self, button):
-        import pyautogui
-        pyautogui.click(button=button)
+        return self.scheduler.click(button, start_at=self._start_at)
 
-    # 辅助方法：点击特定位置
+    # 辅助方法：点击特定位置（同步等待点击完成）
     def _click_position(self, x, y):
-        import pyautogui
-        pyautogui.click(x, y)
+        self.scheduler.click("left", x, y).wait(timeout=1.0)
 
-    # 辅助方法：鼠标移动
+    # 辅助方法：鼠标移动（换算为角度交给视角控制线程平滑转动）
     def _move_mouse(self, x, y):
-        import pyautogui
-        pyautogui.moveRel(x, y, duration=0.2)
+        ppd = self.camera.pixels_per_degree
+        return self.camera.turn(x / ppd, y / ppd, start_at=self._start_at)
 
     # 统一入口方法，根据模式选择执行方式
     def _back_to_game(self):
@@ -57,83 +75,77 @@ class GameController:
         else:
             self._click_back_to_game()
             
+    # 辅助方法：启动回到游戏exe文件，立即返回进程对象（找不到文件时返回None）
+    def start_back_to_game_exe(self):
+        exe_dir = os.path.dirname(os.path.abspath(__file__))
+        exe_path = os.path.join(exe_dir, "mchd.exe")
+        if not os.path.exists(exe_path):
+            logger.error("找不到回到游戏exe文件，请确保mchd.exe文件存在于Minecraft目录下", path=exe_path)
+            return None
+        logger.info("启动回到游戏exe", path=exe_path)
+        return subprocess.Popen([exe_path],
+                                cwd=exe_dir,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                text=True)
+
     # 辅助方法：直接运行回到游戏exe文件
-    def _run_exe_back_to_game(self):
-        print("直接运行回到游戏exe文件...")
+    def _run_exe_back_to_game(self, timeout=13):
+        logger.info("直接运行回到游戏exe文件...")
         try:
-            # 确保在正确的工作目录
-            exe_dir = os.path.dirname(os.path.abspath(__file__))
-            os.chdir(exe_dir)
-            
-            # 直接运行exe文件
-            exe_path = os.path.join(exe_dir, "mchd.exe")
-            if not os.path.exists(exe_path):
-                print(f"错误: 找不到回到游戏exe文件: {exe_path}\n请确保mchd.exe文件存在于Minecraft目录下")
+            process = self.start_back_to_game_exe()
+            if process is None:
                 return
-            
-            print(f"启动回到游戏exe: {exe_path}")
-            process = subprocess.Popen([exe_path],
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE,
-                             text=True)
-            
-            # 增加等待时间至8秒，确保exe有足够时间执行
-            time.sleep(8)  # 进一步延长等待时间至8秒
-            
-            # 检查进程是否仍在运行
-            if process.poll() is None:
-                print("回到游戏exe进程仍在运行，继续等待...")
-                time.sleep(5)  # 再等待5秒
-                
-                # 再次检查，如果仍在运行则尝试终止
-                if process.poll() is None:
-                    print("回到游戏exe进程长时间运行，尝试终止...")
-                    process.terminate()
-                    try:
-                        process.wait(timeout=3)
-                    except subprocess.TimeoutExpired:
-                        process.kill()
-                    print("回到游戏exe进程已终止")
-            
-            # 获取输出和错误信息
-            stdout, stderr = process.communicate()
+
+            # exe退出后立即继续，最多等待timeout秒（原先固定等待8秒+5秒）
+            try:
+                stdout, stderr = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                logger.warning("回到游戏exe进程长时间运行，尝试终止...")
+                process.terminate()
+                try:
+                    stdout, stderr = process.communicate(timeout=3)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    stdout, stderr = process.communicate()
+                logger.warning("回到游戏exe进程已终止")
+
             if stdout:
-                print(f"回到游戏exe输出: {stdout}")
+                logger.debug("回到游戏exe输出: %s", stdout)
             if stderr:
-                print(f"回到游戏exe错误: {stderr}")
+                logger.warning("回到游戏exe错误: %s", stderr)
             
             # 检查退出码
             exit_code = process.returncode
             if exit_code == 0:
-                print("回到游戏exe执行成功")
+                logger.info("回到游戏exe执行成功")
             else:
-                print(f"回到游戏exe执行失败，退出码: {exit_code}")
+                logger.warning("回到游戏exe执行失败", exit_code=exit_code)
                 return
             
-            print("回到游戏操作完成")
+            logger.info("回到游戏操作完成")
         except Exception as e:
-            print(f"运行回到游戏exe时出错: {str(e)}")
+            logger.error("运行回到游戏exe时出错: %s", e)
     
     # 辅助方法：点击回到游戏按钮（原有逻辑）
-    def _click_back_to_game(self):
+    # game_region为已知的游戏窗口区域时直接使用，否则使用共享窗口跟踪器的区域
+    def _click_back_to_game(self, game_region=None):
         # 导入必要的模块
-        import win32gui
-        # 获取游戏窗口区域
-        from screen_capture import MinecraftScreenCapture
-        capture = MinecraftScreenCapture()
-        if not capture.game_region:
-            capture.find_game_window()
+        from window_tracker import get_shared_tracker
+        tracker = get_shared_tracker()
+        if game_region is None:
+            game_region = tracker.game_region
         
         # 确保窗口被激活
-        hwnd = win32gui.FindWindow(None, win32gui.GetWindowText(win32gui.GetForegroundWindow()))
-        win32gui.SetForegroundWindow(hwnd)
-        time.sleep(0.3)  # 等待窗口激活
+        if not tracker.focused:
+            tracker.activate()
+            time.sleep(0.3)  # 等待窗口激活
         
         # 计算回到游戏按钮的位置
-        window_top = capture.game_region["top"]
-        window_left = capture.game_region["left"]
-        window_width = capture.game_region["width"]
-        window_height = capture.game_region["height"]
+        window_top = game_region["top"]
+        window_left = game_region["left"]
+        window_width = game_region["width"]
+        window_height = game_region["height"]
         
         # 回到游戏按钮通常在菜单顶部中央
         # 垂直位置系数：0.25表示顶部1/4，可根据实际情况调整
@@ -141,31 +153,46 @@ class GameController:
         button_x = window_left + window_width // 2
         button_y = window_top + int(window_height * vertical_position_ratio)
         
-        print(f"点击回到游戏按钮位置：({button_x}, {button_y}) (垂直位置系数: {vertical_position_ratio})")
+        logger.info("点击回到游戏按钮", x=button_x, y=button_y, vertical_ratio=vertical_position_ratio)
         
         # 移动鼠标到按钮位置，然后点击
-        import pyautogui
-        pyautogui.moveTo(button_x, button_y, duration=0.5)  # 缓慢移动鼠标，便于观察
         self._click_position(button_x, button_y)
         time.sleep(0.5)  # 等待点击生效
 
 
-    # 执行操作的主方法
+    # 执行操作的主方法：立即返回ActionHandle，可调用handle.wait()等待按键松开
     def execute_action(self, action):
-        import time
-        current_time = time.time()
+        if action not in self.action_map:
+            logger.warning("无法识别的操作，跳过执行", action=action)
+            self.unknown_actions.inc()
+            return ActionHandle.completed(action, ok=False)
         
-        # 控制操作间隔，避免太频繁
-        if current_time - self.last_action_time < self.min_action_interval:
-            time.sleep(self.min_action_interval - (current_time - self.last_action_time))
-        
-        # 执行操作
-        if action in self.action_map:
-            print(f"执行操作：{action}")
+        logger.debug("执行操作", action=action)
+        self.action_counters[action].inc()
+        if action in self.blocking_actions:
             self.action_map[action]()
-            self.last_action_time = current_time
-        else:
-            print(f"无法识别的操作：{action}，跳过执行")
+            self.last_action_time = time.time()
+            return ActionHandle.completed(action)
+        
+        # 控制操作间隔，避免太频繁：不再在调用线程中sleep，而是让调度线程延后开始
+        start_at = max(time.time(), self.last_action_time + self.min_action_interval)
+        self._start_at = start_at
+        try:
+            handle = self.action_map[action]()
+        finally:
+            self._start_at = None
+        handle.action = action
+        self.last_action_time = start_at
+        return handle
+    
+    def get_input_stats(self):
+        """各操作从入队到松开按键的耗时统计"""
+        return self.scheduler.get_stats()
+    
+    def close(self):
+        """停止视角控制、松开所有按键并停止调度线程"""
+        self.camera.close()
+        self.scheduler.close()
 
 # 测试代码（单独运行时执行）
 if __name__ == "__main__":
@@ -174,5 +201,10 @@ if __name__ == "__main__":
     controller = GameController()
     test_actions = ["w", "左键点击", "空格"]
     for action in test_actions:
-        controller.execute_action(action)
-        time.sleep(1)  # 间隔1秒
\ No newline at end of file
+        controller.execute_action(action).wait()
+        time.sleep(1)  # 间隔1秒
+    print(f"操作耗时统计: {controller.get_input_stats()}")
+    # 非Windows系统上默认使用记录后端，打印记录到的事件
+    for event in getattr(controller.input_backend, "events", []):
+        print(event)
+    controller.close()
\ No newline at end of file
@@ -0,0 +1,330 @@
+# inference_broker.py
+import argparse
+import json
+import select
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from app_logging import LOG_LEVELS, get_logger, setup_logging, shutdown_logging
+from llm_health import LatencyHistogram
+
+logger = get_logger("inference_broker")
+
+
+class BrokerRequest:
+    """排队中的一次决策请求"""
+
+    def __init__(self, agent_id, body, deadline):
+        self.agent_id = agent_id
+        self.body = body
+        self.deadline = deadline
+        self.enqueued_at = time.time()
+        # 除stream外完全相同的请求视为同一个提示词，可以合并
+        self.key = json.dumps({k: v for k, v in body.items() if k != "stream"}, sort_keys=True, ensure_ascii=False)
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = []  # 合并到该请求上的其它请求
+
+    def finish(self, result=None, error=None):
+        for request in [self] + self.followers:
+            request.result = result
+            request.error = error
+            request.done.set()
+
+
+class InferenceBroker:
+    """多个机器人实例共享的本地推理代理
+
+    各实例把api_base指向代理即可（接口与Ollama的/api/generate兼容）。代理按实例分队列，
+    轮询调度保证公平，丢弃已过截止时间和客户端已断开的请求，合并相同的提示词，
+    并以最多batch_size个请求为一批并发发往Ollama。
+    """
+
+    def __init__(self, backend_url="http://localhost:11434", batch_size=4, max_queue_per_agent=8, default_timeout=60.0):
+        self.backend_url = backend_url
+        self.batch_size = batch_size
+        self.max_queue_per_agent = max_queue_per_agent
+        self.default_timeout = default_timeout
+
+        self.queues = OrderedDict()  # {实例ID: deque[BrokerRequest]}，按轮询顺序排列
+        self.pending = {}  # {合并键: 排队或执行中的请求}
+        self.inflight = 0
+        self.condition = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=batch_size, thread_name_prefix="BrokerBackend")
+        self.running = True
+
+        self.agent_latency = {}  # {实例ID: LatencyHistogram}
+        self.stats = {"requests": 0, "coalesced": 0, "expired": 0, "rejected": 0, "cancelled": 0, "errors": 0,
+                      "batches": 0}
+
+        self.dispatcher = threading.Thread(target=self._dispatch_loop, name="BrokerDispatcher", daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, agent_id, body, timeout=None):
+        """提交一次生成请求，返回BrokerRequest，调用方等待其done事件"""
+        timeout = self.default_timeout if timeout is None else timeout
+        request = BrokerRequest(agent_id, body, time.time() + timeout)
+        with self.condition:
+            self.stats["requests"] += 1
+            leader = self.pending.get(request.key)
+            if leader is not None:
+                # 相同提示词已在排队或执行中，直接复用其结果
+                leader.followers.append(request)
+                leader.deadline = max(leader.deadline, request.deadline)
+                self.stats["coalesced"] += 1
+                return request
+
+            queue = self.queues.setdefault(agent_id, deque())
+            if len(queue) >= self.max_queue_per_agent:
+                self.stats["rejected"] += 1
+                request.finish(error="该实例排队请求过多")
+                return request
+            queue.append(request)
+            self.pending[request.key] = request
+            self.condition.notify()
+        return request
+
+    def cancel(self, request):
+        """客户端已断开（对冲落败、推测结果被丢弃）：移除尚未发出的请求，已在执行中的只能等它完成
+
+        其它请求合并到该请求上时保留它，结果仍要交给它们。返回是否移除成功。
+        """
+        with self.condition:
+            if request.done.is_set():
+                return False
+            leader = self.pending.get(request.key)
+            if leader is not None and leader is not request:
+                if request not in leader.followers:
+                    return False
+                leader.followers.remove(request)
+            else:
+                queue = self.queues.get(request.agent_id)
+                if request.followers or not queue or request not in queue:
+                    return False
+                queue.remove(request)
+                if not queue:
+                    del self.queues[request.agent_id]
+                self.pending.pop(request.key, None)
+            self.stats["cancelled"] += 1
+        request.finish(error="客户端已断开")
+        return True
+
+    def _next_batch(self):
+        """轮询各实例的队列，每个实例每轮最多取一个请求，凑满一批或队列取空为止"""
+        batch = []
+        now = time.time()
+        while len(batch) < self.batch_size - self.inflight:
+            progressed = False
+            for agent_id in list(self.queues):
+                queue = self.queues[agent_id]
+                # 丢弃已过截止时间的请求
+                while queue and queue[0].deadline <= now:
+                    expired = queue.popleft()
+                    self.pending.pop(expired.key, None)
+                    self.stats["expired"] += 1
+                    expired.finish(error="请求已超过截止时间")
+                if not queue:
+                    del self.queues[agent_id]
+                    continue
+                batch.append(queue.popleft())
+                # 被服务过的实例移到队尾，保证公平
+                self.queues.move_to_end(agent_id)
+                progressed = True
+                if len(batch) >= self.batch_size - self.inflight:
+                    break
+            if not progressed:
+                break
+        return batch
+
+    def _dispatch_loop(self):
+        while self.running:
+            with self.condition:
+                batch = self._next_batch()
+                while self.running and not batch:
+                    self.condition.wait(timeout=0.5)
+                    batch = self._next_batch()
+                if not batch:
+                    break
+                self.inflight += len(batch)
+                self.stats["batches"] += 1
+            for request in batch:
+                self.executor.submit(self._forward, request)
+
+    def _forward(self, request):
+        """把请求发往Ollama，完成后唤醒该请求及所有合并的请求"""
+        try:
+            timeout = max(0.1, request.deadline - time.time())
+            body = dict(request.body, stream=False)
+            response = requests.post(f"{self.backend_url}/api/generate", json=body, timeout=timeout)
+            response.raise_for_status()
+            result, error = response.json(), None
+        except Exception as e:
+            result, error = None, str(e)
+        with self.condition:
+            self.pending.pop(request.key, None)
+            self.inflight -= 1
+            if error:
+                self.stats["errors"] += 1
+            finished_at = time.time()
+            for r in [request] + request.followers:
+                self.agent_latency.setdefault(r.agent_id, LatencyHistogram()).record(finished_at - r.enqueued_at)
+            self.condition.notify()
+        request.finish(result, error)
+
+    def get_stats(self):
+        """队列深度、各实例延迟分布和合并/过期等统计"""
+        with self.condition:
+            queue_depth = {agent_id: len(queue) for agent_id, queue in self.queues.items()}
+            agents = list(self.agent_latency.items())
+        return {
+            **self.stats,
+            "queue_depth": sum(queue_depth.values()),
+            "queue_depth_per_agent": queue_depth,
+            "inflight": self.inflight,
+            "agent_latency": {agent_id: histogram.summary() for agent_id, histogram in agents}
+        }
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.executor.shutdown(wait=False)
+
+
+class BrokerRequestHandler(BaseHTTPRequestHandler):
+    """Ollama兼容的HTTP接口：/api/tags、/api/generate，以及/broker/stats统计"""
+
+    protocol_version = "HTTP/1.1"
+    broker = None
+    heartbeat_interval = 0.1  # 流式请求等待期间发送空行的间隔(秒)
+
+    def log_message(self, format, *args):
+        pass  # 不在每个请求上打印日志
+
+    def _send_json(self, status, data, content_type="application/json"):
+        body = (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        line = (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8") if data is not None else b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def _client_disconnected(self):
+        """客户端是否已关闭连接：套接字可读但读不到数据即对端已关闭"""
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def do_GET(self):
+        if self.path == "/broker/stats":
+            self._send_json(200, self.broker.get_stats())
+        elif self.path == "/api/tags":
+            try:
+                response = requests.get(f"{self.broker.backend_url}/api/tags", timeout=5)
+                self._send_json(response.status_code, response.json())
+            except Exception as e:
+                self._send_json(502, {"error": str(e)})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        agent_id = self.headers.get("X-Agent-Id") or self.client_address[0]
+        deadline_header = self.headers.get("X-Deadline")
+        timeout = float(deadline_header) if deadline_header else None
+
+        request = self.broker.submit(agent_id, body, timeout)
+        stream = body.get("stream", True)
+        try:
+            if stream:
+                # 流式请求先返回响应头，等待期间定期发送空行：客户端借此检查取消并断开连接，
+                # 代理据此把已无人等待的请求移出队列
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+            while not request.done.wait(timeout=self.heartbeat_interval):
+                if time.time() > request.deadline + 1:
+                    break
+                if stream:
+                    self._write_chunk(None)
+                if self._client_disconnected():
+                    raise ConnectionResetError()
+        except (BrokenPipeError, ConnectionResetError):
+            self.broker.cancel(request)
+            self.close_connection = True
+            return
+
+        error = None
+        if not request.done.is_set() or request.error:
+            error = request.error or "推理超时"
+        if not stream:
+            if error:
+                self._send_json(504 if not request.done.is_set() or "截止时间" in error else 502, {"error": error})
+            else:
+                self._send_json(200, request.result)
+            return
+        # 流式请求以单个done=true的NDJSON块返回完整结果，出错时返回error块；
+        # 客户端读到done块后通常直接断开，流式响应后不保持连接
+        self.close_connection = True
+        try:
+            self._write_chunk({"error": error} if error else dict(request.result, done=True))
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def create_broker_server(host="127.0.0.1", port=11500, backend_url="http://localhost:11434", batch_size=4):
+    """创建推理代理和HTTP服务（未启动），返回(server, broker)，例如由编排进程在后台线程中运行"""
+    broker = InferenceBroker(backend_url=backend_url, batch_size=batch_size)
+    handler = type("Handler", (BrokerRequestHandler,), {"broker": broker})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server, broker
+
+
+def run_broker(host="127.0.0.1", port=11500, backend_url="http://localhost:11434", batch_size=4):
+    """启动推理代理HTTP服务（阻塞），返回前关闭调度线程"""
+    server, broker = create_broker_server(host, port, backend_url, batch_size)
+    logger.info("推理代理已启动", url=f"http://{host}:{port}", backend=backend_url, batch_size=batch_size)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("推理代理退出")
+    finally:
+        server.server_close()
+        broker.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多个机器人实例共享的本地推理代理")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--backend", default="http://localhost:11434", help="Ollama服务地址")
+    parser.add_argument("--batch-size", type=int, default=4, help="同时发往Ollama的最大请求数")
+    parser.add_argument("--log-level", default="INFO", choices=LOG_LEVELS, help="日志级别")
+    args = parser.parse_args()
+    setup_logging(args.log_level)
+    try:
+        run_broker(args.host, args.port, args.backend, args.batch_size)
+    finally:
+        shutdown_logging()
@@ -0,0 +1,301 @@
+# input_backend.py
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class InputBackend:
+    """输入后端接口：InputScheduler只通过这些方法发出键盘鼠标事件
+
+    后端可以先缓存事件，在flush()时一次性提交，调度线程每处理完一批到期事件调用一次flush()。
+    """
+
+    name = "base"
+
+    def key_down(self, key):
+        raise NotImplementedError
+
+    def key_up(self, key):
+        raise NotImplementedError
+
+    def click(self, button="left", x=None, y=None):
+        """点击鼠标，给出x、y时先移动到该屏幕坐标"""
+        raise NotImplementedError
+
+    def move_relative(self, dx, dy):
+        raise NotImplementedError
+
+    def move_to(self, x, y):
+        raise NotImplementedError
+
+    def flush(self):
+        """提交缓存的事件（不缓存的后端无需实现）"""
+
+    def close(self):
+        self.flush()
+
+
+class PyAutoGUIBackend(InputBackend):
+    """原有的pyautogui实现
+
+    pyautogui默认在每次调用后额外等待PAUSE(0.1秒)，这里默认关闭，且所有移动都不使用补间动画。
+    """
+
+    name = "pyautogui"
+
+    def __init__(self, pause=0.0):
+        import pyautogui
+        pyautogui.PAUSE = pause
+        self.pyautogui = pyautogui
+
+    def key_down(self, key):
+        self.pyautogui.keyDown(key)
+
+    def key_up(self, key):
+        self.pyautogui.keyUp(key)
+
+    def click(self, button="left", x=None, y=None):
+        self.pyautogui.click(x, y, button=button)
+
+    def move_relative(self, dx, dy):
+        self.pyautogui.moveRel(dx, dy)
+
+    def move_to(self, x, y):
+        self.pyautogui.moveTo(x, y)
+
+
+class DirectInputBackend(InputBackend):
+    """Windows SendInput后端：事件先缓存，flush()时一次SendInput批量提交，没有任何人为等待
+
+    按键使用扫描码发送，游戏读取原始输入时也能识别；鼠标相对移动直接发送MOUSEEVENTF_MOVE。
+    输入调度线程和视角控制线程会同时使用该后端，缓存的事件用锁保护。
+    """
+
+    name = "direct"
+
+    INPUT_MOUSE = 0
+    INPUT_KEYBOARD = 1
+    KEYEVENTF_KEYUP = 0x0002
+    KEYEVENTF_SCANCODE = 0x0008
+    MOUSEEVENTF_MOVE = 0x0001
+    MOUSEEVENTF_ABSOLUTE = 0x8000
+    MOUSE_BUTTON_FLAGS = {
+        "left": (0x0002, 0x0004),
+        "right": (0x0008, 0x0010),
+        "middle": (0x0020, 0x0040)
+    }
+    # pyautogui按键名→虚拟键码（字母和数字直接使用大写ASCII码）
+    VIRTUAL_KEYS = {
+        "space": 0x20, "esc": 0x1B, "escape": 0x1B, "enter": 0x0D, "tab": 0x09,
+        "shift": 0x10, "ctrl": 0x11, "alt": 0x12,
+        "up": 0x26, "down": 0x28, "left": 0x25, "right": 0x27
+    }
+
+    def __init__(self):
+        import ctypes
+        from ctypes import wintypes
+
+        class MOUSEINPUT(ctypes.Structure):
+            _fields_ = [("dx", wintypes.LONG), ("dy", wintypes.LONG), ("mouseData", wintypes.DWORD),
+                        ("dwFlags", wintypes.DWORD), ("time", wintypes.DWORD),
+                        ("dwExtraInfo", ctypes.POINTER(wintypes.ULONG))]
+
+        class KEYBDINPUT(ctypes.Structure):
+            _fields_ = [("wVk", wintypes.WORD), ("wScan", wintypes.WORD), ("dwFlags", wintypes.DWORD),
+                        ("time", wintypes.DWORD), ("dwExtraInfo", ctypes.POINTER(wintypes.ULONG))]
+
+        class _INPUTUNION(ctypes.Union):
+            _fields_ = [("mi", MOUSEINPUT), ("ki", KEYBDINPUT)]
+
+        class INPUT(ctypes.Structure):
+            _fields_ = [("type", wintypes.DWORD), ("union", _INPUTUNION)]
+
+        self.ctypes = ctypes
+        self.user32 = ctypes.windll.user32
+        self.INPUT = INPUT
+        self.MOUSEINPUT = MOUSEINPUT
+        self.KEYBDINPUT = KEYBDINPUT
+        self.pending = []
+        self.lock = threading.Lock()
+        self.screen_width = self.user32.GetSystemMetrics(0)
+        self.screen_height = self.user32.GetSystemMetrics(1)
+
+    def _scan_code(self, key):
+        vk = self.VIRTUAL_KEYS.get(key.lower())
+        if vk is None:
+            if len(key) != 1:
+                raise ValueError(f"不支持的按键: {key}")
+            vk = ord(key.upper())
+        return self.user32.MapVirtualKeyW(vk, 0)
+
+    def _keyboard(self, key, flags):
+        ki = self.KEYBDINPUT(0, self._scan_code(key), self.KEYEVENTF_SCANCODE | flags, 0, None)
+        event = self.INPUT(self.INPUT_KEYBOARD)
+        event.union.ki = ki
+        with self.lock:
+            self.pending.append(event)
+
+    def _mouse(self, flags, dx=0, dy=0):
+        mi = self.MOUSEINPUT(dx, dy, 0, flags, 0, None)
+        event = self.INPUT(self.INPUT_MOUSE)
+        event.union.mi = mi
+        with self.lock:
+            self.pending.append(event)
+
+    def key_down(self, key):
+        self._keyboard(key, 0)
+
+    def key_up(self, key):
+        self._keyboard(key, self.KEYEVENTF_KEYUP)
+
+    def click(self, button="left", x=None, y=None):
+        if x is not None and y is not None:
+            self.move_to(x, y)
+        down, up = self.MOUSE_BUTTON_FLAGS[button]
+        self._mouse(down)
+        self._mouse(up)
+
+    def move_relative(self, dx, dy):
+        self._mouse(self.MOUSEEVENTF_MOVE, int(dx), int(dy))
+
+    def move_to(self, x, y):
+        # 绝对坐标需要归一化到0~65535
+        nx = int(x * 65535 / max(1, self.screen_width - 1))
+        ny = int(y * 65535 / max(1, self.screen_height - 1))
+        self._mouse(self.MOUSEEVENTF_MOVE | self.MOUSEEVENTF_ABSOLUTE, nx, ny)
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            events = (self.INPUT * len(self.pending))(*self.pending)
+            self.pending = []
+        self.user32.SendInput(len(events), events, self.ctypes.sizeof(self.INPUT))
+
+
+class WindowMessageBackend(InputBackend):
+    """向指定窗口投递窗口消息的后端：多实例运行时每个进程控制自己的游戏窗口，不需要窗口在前台
+
+    按键和点击用PostMessage发给目标窗口；视角转动依赖原始鼠标输入，无法用窗口消息模拟，
+    只在目标窗口位于前台时用SendInput发送，否则丢弃并计数。
+    """
+
+    name = "window"
+
+    WM_KEYDOWN = 0x0100
+    WM_KEYUP = 0x0101
+    WM_MOUSEMOVE = 0x0200
+    MOUSE_MESSAGES = {
+        "left": (0x0201, 0x0202, 0x0001),
+        "right": (0x0204, 0x0205, 0x0002),
+        "middle": (0x0207, 0x0208, 0x0010)
+    }
+
+    def __init__(self, hwnd):
+        from ctypes import wintypes
+        self.wintypes = wintypes
+        self.hwnd = hwnd
+        self.direct = DirectInputBackend()  # 复用扫描码换算和前台时的相对移动
+        self.user32 = self.direct.user32
+        self.stats = {"messages": 0, "moves_dropped": 0}
+
+    def _post(self, message, wparam, lparam):
+        wintypes = self.wintypes
+        self.user32.PostMessageW(wintypes.HWND(self.hwnd), message, wintypes.WPARAM(wparam), wintypes.LPARAM(lparam))
+        self.stats["messages"] += 1
+
+    def _key(self, key, up):
+        scan = self.direct._scan_code(key)
+        vk = self.user32.MapVirtualKeyW(scan, 1)
+        # lParam：重复次数1、扫描码；松开时置上一状态位和转换状态位
+        lparam = 1 | (scan << 16) | (0xC0000000 if up else 0)
+        self._post(self.WM_KEYUP if up else self.WM_KEYDOWN, vk, lparam)
+
+    def key_down(self, key):
+        self._key(key, False)
+
+    def key_up(self, key):
+        self._key(key, True)
+
+    def click(self, button="left", x=None, y=None):
+        if x is not None and y is not None:
+            # 屏幕坐标换算为窗口客户区坐标
+            import win32gui
+            x, y = win32gui.ScreenToClient(self.hwnd, (int(x), int(y)))
+            lparam = (int(y) & 0xFFFF) << 16 | (int(x) & 0xFFFF)
+            self._post(self.WM_MOUSEMOVE, 0, lparam)
+        else:
+            lparam = 0
+        down, up, flag = self.MOUSE_MESSAGES[button]
+        self._post(down, flag, lparam)
+        self._post(up, 0, lparam)
+
+    def move_relative(self, dx, dy):
+        if self.user32.GetForegroundWindow() == self.hwnd:
+            self.direct.move_relative(dx, dy)
+        else:
+            self.stats["moves_dropped"] += 1
+
+    def move_to(self, x, y):
+        if self.user32.GetForegroundWindow() == self.hwnd:
+            self.direct.move_to(x, y)
+
+    def flush(self):
+        self.direct.flush()
+
+
+class RecordingBackend(InputBackend):
+    """空后端：不产生真实输入，只记录带时间戳的事件
+
+    用于在没有显示器的Linux上测试和压测GameController，close()时可写入JSONL文件。
+    """
+
+    name = "recording"
+
+    def __init__(self, log_path=None, max_events=100000):
+        self.log_path = log_path
+        self.events = deque(maxlen=max_events)
+        self.lock = threading.Lock()
+
+    def _record(self, event, **data):
+        with self.lock:
+            self.events.append({"time": time.time(), "event": event, **data})
+
+    def key_down(self, key):
+        self._record("key_down", key=key)
+
+    def key_up(self, key):
+        self._record("key_up", key=key)
+
+    def click(self, button="left", x=None, y=None):
+        self._record("click", button=button, x=x, y=y)
+
+    def move_relative(self, dx, dy):
+        self._record("move_relative", dx=dx, dy=dy)
+
+    def move_to(self, x, y):
+        self._record("move_to", x=x, y=y)
+
+    def close(self):
+        if not self.log_path:
+            return
+        with self.lock, open(self.log_path, "w", encoding="utf-8") as f:
+            for event in self.events:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+def create_input_backend(name="auto", **kwargs):
+    """按名称创建输入后端：auto(Windows上为direct，其它系统为recording)、direct、window(需要hwnd)、pyautogui、recording"""
+    if name == "auto":
+        name = "direct" if os.name == "nt" else "recording"
+    if name == "direct":
+        return DirectInputBackend()
+    if name == "window":
+        return WindowMessageBackend(**kwargs)
+    if name == "pyautogui":
+        return PyAutoGUIBackend(**kwargs)
+    if name in ("recording", "null"):
+        return RecordingBackend(**kwargs)
+    raise ValueError(f"未知的输入后端: {name}")
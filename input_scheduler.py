@@ -0,0 +1,208 @@
+# input_scheduler.py
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+from app_logging import get_logger
+from input_backend import create_input_backend
+from llm_health import LatencyHistogram
+
+logger = get_logger("input_scheduler")
+
+
+class ActionHandle:
+    """一次已入队操作的句柄，可以等待其完成并读取各阶段时间"""
+
+    def __init__(self, action):
+        self.action = action
+        self.enqueued_at = time.time()
+        self.started_at = None   # 第一个输入事件发出的时间
+        self.finished_at = None  # 最后一个输入事件（松开按键）发出的时间
+        self.ok = True
+        self._done = threading.Event()
+        self._remaining = 0
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def latency(self):
+        """从入队到松开按键的总耗时(秒)，未完成时为None"""
+        return self.finished_at - self.enqueued_at if self.finished_at else None
+
+    def wait(self, timeout=None):
+        """等待操作完成，返回是否在超时前完成"""
+        return self._done.wait(timeout)
+
+    def _finish(self, ok=True):
+        self.ok = ok
+        self.finished_at = time.time()
+        self._done.set()
+
+    @classmethod
+    def completed(cls, action, ok=True):
+        """立即完成的句柄（同步执行的操作或无法识别的操作）"""
+        handle = cls(action)
+        handle.started_at = handle.enqueued_at
+        handle._finish(ok)
+        return handle
+
+
+class InputScheduler:
+    """非阻塞输入调度线程
+
+    调用方把带时间的输入事件（按下、松开、移动鼠标）放入队列后立即返回句柄，
+    由后台线程按时间顺序发出。不同按键可以同时按住（例如边走边转向），
+    同一个按键的多次按住会合并，只在第一次按下和最后一次松开时发出事件。
+    同一时刻到期的事件通过输入后端一次提交。
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or create_input_backend()
+        self.events = []  # 堆：(发出时间, 序号, 函数, 句柄)
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.held_keys = {}  # {按键: 当前按住的次数}，与按键事件一起在condition下修改
+        self.generation = 0  # 每次release_all()加1
+        self.batch_generation = 0  # 调度线程正在执行的一批事件取出时的generation
+        self.running = True
+
+        # 每个操作从入队到松开的耗时统计
+        self.latency_histogram = LatencyHistogram()
+        self.recent_timings = deque(maxlen=100)  # (操作, 入队→开始, 入队→完成)
+
+        self.thread = threading.Thread(target=self._run, name="InputScheduler", daemon=True)
+        self.thread.start()
+
+    def _schedule(self, handle, steps, start_at=None):
+        """steps为[(相对开始时间的偏移秒数, 函数)]，全部执行完后句柄完成"""
+        start_at = max(time.time(), start_at or 0)
+        with self.condition:
+            handle._remaining = len(steps)
+            for offset, fn in steps:
+                heapq.heappush(self.events, (start_at + offset, next(self.sequence), fn, handle))
+            self.condition.notify()
+        return handle
+
+    def hold_key(self, key, duration, start_at=None, action=None):
+        """按住按键duration秒后松开"""
+        handle = ActionHandle(action or key)
+        return self._schedule(handle, [
+            (0, lambda: self._key_down(key)),
+            (duration, lambda: self._key_up(key))
+        ], start_at)
+
+    def click(self, button="left", x=None, y=None, start_at=None, action=None):
+        """鼠标点击，给出x、y时先移动到该屏幕坐标"""
+        handle = ActionHandle(action or f"click:{button}")
+        return self._schedule(handle, [(0, lambda: self.backend.click(button, x, y))], start_at)
+
+    def move_relative(self, dx, dy, duration=0.0, steps=10, start_at=None, action=None):
+        """相对移动鼠标，duration>0时拆成多步平滑移动，不占用调度线程"""
+        handle = ActionHandle(action or f"move:{dx},{dy}")
+        if duration <= 0:
+            return self._schedule(handle, [(0, lambda: self.backend.move_relative(dx, dy))], start_at)
+
+        # 每一步移动的整数像素，误差累计到最后一步
+        moves = []
+        done_x = done_y = 0
+        for i in range(1, steps + 1):
+            step_x = round(dx * i / steps) - done_x
+            step_y = round(dy * i / steps) - done_y
+            done_x += step_x
+            done_y += step_y
+            moves.append((duration * (i - 1) / steps, lambda x=step_x, y=step_y: self.backend.move_relative(x, y)))
+        return self._schedule(handle, moves, start_at)
+
+    def _key_down(self, key):
+        with self.condition:
+            # release_all()之前已取出的按下事件作废，否则按键会在松开全部按键之后又被按下
+            if self.batch_generation != self.generation:
+                return
+            count = self.held_keys.get(key, 0)
+            if count == 0:
+                self.backend.key_down(key)
+            self.held_keys[key] = count + 1
+
+    def _key_up(self, key):
+        with self.condition:
+            count = self.held_keys.get(key, 0) - 1
+            if count <= 0:
+                self.held_keys.pop(key, None)
+                self.backend.key_up(key)
+            else:
+                self.held_keys[key] = count
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and (not self.events or self.events[0][0] > time.time()):
+                    timeout = self.events[0][0] - time.time() if self.events else None
+                    self.condition.wait(timeout)
+                if not self.running:
+                    return
+                # 取出所有已到期的事件，作为一批提交
+                now = time.time()
+                self.batch_generation = self.generation
+                due = []
+                while self.events and self.events[0][0] <= now:
+                    due.append(heapq.heappop(self.events))
+
+            for _, _, fn, handle in due:
+                if handle.started_at is None:
+                    handle.started_at = time.time()
+                try:
+                    fn()
+                except Exception as e:
+                    logger.warning("输入事件执行失败：%s", e, action=handle.action)
+                    handle.ok = False
+            try:
+                self.backend.flush()
+            except Exception as e:
+                logger.warning("提交输入事件失败：%s", e)
+            for _, _, _, handle in due:
+                handle._remaining -= 1
+                if handle._remaining == 0:
+                    handle._finish(handle.ok)
+                    self._record_timing(handle)
+
+    def _record_timing(self, handle):
+        self.latency_histogram.record(handle.latency)
+        self.recent_timings.append((handle.action, handle.started_at - handle.enqueued_at, handle.latency))
+
+    def get_stats(self):
+        """操作从入队到松开按键的耗时分布"""
+        with self.condition:
+            pending_events = len(self.events)
+            held_keys = dict(self.held_keys)
+        return {
+            **self.latency_histogram.summary(),
+            "pending_events": pending_events,
+            "held_keys": held_keys
+        }
+
+    def release_all(self):
+        """松开所有仍按住的按键（退出时调用）"""
+        with self.condition:
+            handles = {handle for _, _, _, handle in self.events}
+            self.events.clear()
+            self.generation += 1
+            for key in list(self.held_keys):
+                self.backend.key_up(key)
+            self.held_keys.clear()
+            self.backend.flush()
+        # 被取消的操作也要唤醒等待者
+        for handle in handles:
+            if not handle.done:
+                handle._finish(ok=False)
+
+    def close(self):
+        self.release_all()
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(timeout=1)
+        self.backend.close()
@@ -0,0 +1,171 @@
+# learning_store.py
+import copy
+import json
+import os
+import threading
+from multiprocessing.managers import BaseManager
+
+from app_logging import get_logger
+
+logger = get_logger("learning_store")
+
+
+def default_learning_memory():
+    return {
+        "success_actions": {},  # 成功动作记录 {状态键: {动作: 得分}}
+        "failure_actions": set(),  # 失败动作记录，保存为JSON时转换为列表
+        "last_state": None,
+        "last_action": None,
+        "learning_rate": 0.1
+    }
+
+
+def learning_memory_from_json(data):
+    """从JSON数据恢复学习表，格式不正确时返回None"""
+    if not isinstance(data, dict) or not isinstance(data.get("failure_actions"), list):
+        return None
+    memory = default_learning_memory()
+    memory.update(data)
+    memory["failure_actions"] = set(data["failure_actions"])
+    return memory
+
+
+def learning_memory_to_json(memory):
+    """可JSON序列化的学习表（失败记录转换为排序后的列表，文件格式与之前相同）"""
+    return dict(memory, failure_actions=sorted(memory["failure_actions"]))
+
+
+def apply_learning_update(memory, state_key, action, success):
+    """把一次动作结果计入学习表：成功时累加该状态下动作的得分并移出失败记录，失败时加入失败记录"""
+    if success:
+        action_stats = memory["success_actions"].setdefault(state_key, {})
+        action_stats[action] = action_stats.get(action, 0) + memory["learning_rate"]
+        memory["failure_actions"].discard(action)
+    else:
+        memory["failure_actions"].add(action)
+
+
+class LearningStore:
+    """多个实例共享的学习表
+
+    在编排进程启动的服务进程中运行，各实例进程通过multiprocessing管理器的代理调用record_batch()批量上报动作结果，
+    定期用snapshot()拉取合并后的学习表；写文件在后台线程中按间隔进行（先写临时文件再替换）。
+    """
+
+    def __init__(self, path, save_interval=5.0):
+        self.path = path
+        self.save_interval = save_interval
+        self.memory = self._load()
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.stats = {"updates": 0, "snapshots": 0, "saves": 0}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._save_loop, name="LearningStoreSave", daemon=True)
+        self.thread.start()
+
+    def _load(self):
+        memory = default_learning_memory()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                memory = learning_memory_from_json(json.load(f)) or memory
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error("加载共享学习数据失败: %s", e)
+        return memory
+
+    def record(self, state_key, action, success):
+        with self.lock:
+            apply_learning_update(self.memory, state_key, action, success)
+            self.stats["updates"] += 1
+            self.dirty = True
+
+    def record_batch(self, updates):
+        """一次上报多条动作结果[(状态键, 动作, 是否成功)]，实例进程批量调用以减少跨进程往返"""
+        with self.lock:
+            for state_key, action, success in updates:
+                apply_learning_update(self.memory, state_key, action, success)
+            self.stats["updates"] += len(updates)
+            self.dirty = True
+
+    def snapshot(self):
+        with self.lock:
+            self.stats["snapshots"] += 1
+            return copy.deepcopy(self.memory)
+
+    def get_stats(self):
+        return dict(self.stats, states=len(self.memory["success_actions"]))
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps(learning_memory_to_json(self.memory), ensure_ascii=False, indent=2)
+            self.dirty = False
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+            self.stats["saves"] += 1
+        except Exception as e:
+            logger.error("保存共享学习数据失败: %s", e)
+
+    def _save_loop(self):
+        while not self.stop_event.wait(self.save_interval):
+            self.save()
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join(timeout=1)
+        self.save()
+
+
+# 学习表服务进程中的唯一实例，由_init_store()在服务进程启动时创建
+_store = None
+
+
+def _init_store(path, save_interval):
+    global _store
+    _store = LearningStore(path, save_interval)
+
+
+def _get_store():
+    return _store
+
+
+class _StoreManager(BaseManager):
+    pass
+
+
+_StoreManager.register("get_store", callable=_get_store,
+                       exposed=("record", "record_batch", "snapshot", "get_stats", "close"))
+
+
+def start_learning_store(path, address=("127.0.0.1", 0), authkey=None, save_interval=5.0, ctx=None):
+    """在单独的服务进程中运行共享学习表，返回(manager, 学习表代理)，manager.address为实际监听地址
+
+    用stop_learning_store()停止：先写出最后的更新，再关闭服务进程和监听端口。
+    """
+    manager = _StoreManager(address=address, authkey=authkey, ctx=ctx)
+    manager.start(initializer=_init_store, initargs=(path, save_interval))
+    return manager, manager.get_store()
+
+
+def connect_learning_store(address, authkey):
+    """连接编排进程启动的共享学习表，返回代理对象"""
+    manager = _StoreManager(address=address, authkey=authkey)
+    manager.connect()
+    return manager.get_store()
+
+
+def stop_learning_store(manager, store):
+    """写出最后的更新并关闭服务进程，返回关闭前的学习表统计（服务已不可用时为None）"""
+    stats = None
+    try:
+        store.close()
+        stats = store.get_stats()
+    except Exception as e:
+        logger.error("关闭共享学习表失败: %s", e)
+    manager.shutdown()
+    return stats
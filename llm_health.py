@@ -0,0 +1,109 @@
+# llm_health.py
+import threading
+import time
+from collections import deque
+
+from app_logging import get_logger
+
+logger = get_logger("llm_health")
+
+
+class LatencyHistogram:
+    """滚动窗口延迟统计，只保留最近的若干次样本"""
+
+    def __init__(self, window=200):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.samples.append(latency)
+
+    def count(self):
+        return len(self.samples)
+
+    def percentile(self, p):
+        """返回最近样本的第p百分位延迟(秒)，没有样本时返回None"""
+        with self.lock:
+            if not self.samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def summary(self):
+        return {
+            "count": self.count(),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99)
+        }
+
+
+class CircuitBreaker:
+    """LLM后端熔断器
+
+    连续失败（报错或超时）达到阈值后熔断，冷却期内不再调用后端；
+    冷却结束后在后台线程中探测后端，探测成功才恢复调用。
+    调用方只在state为CLOSED时调用后端，被跳过的决策次数由调用方统计。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    PROBING = "probing"
+
+    def __init__(self, probe, failure_threshold=3, cooldown=10.0, name="LLM"):
+        """
+        Args:
+            probe (callable): 探测函数，后端可用时返回True
+            failure_threshold (int): 连续失败多少次后熔断
+            cooldown (float): 熔断后等待多久开始探测(秒)
+        """
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.name = name
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+        self.stats = {"opened": 0, "probes": 0, "probe_failures": 0}
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.state != self.CLOSED or self.consecutive_failures < self.failure_threshold:
+                return
+            self.state = self.OPEN
+            self.opened_at = time.time()
+            self.stats["opened"] += 1
+        logger.warning("后端连续失败，熔断", backend=self.name, failures=self.consecutive_failures, cooldown=self.cooldown)
+        threading.Thread(target=self._probe_loop, name=f"{self.name}CircuitProbe", daemon=True).start()
+
+    def _probe_loop(self):
+        """冷却期结束后在后台探测后端，成功则恢复，失败则继续冷却"""
+        while True:
+            time.sleep(self.cooldown)
+            with self.lock:
+                self.state = self.PROBING
+                self.stats["probes"] += 1
+            try:
+                healthy = self.probe()
+            except Exception:
+                healthy = False
+            with self.lock:
+                if healthy:
+                    self.state = self.CLOSED
+                    self.consecutive_failures = 0
+                else:
+                    self.state = self.OPEN
+                    self.opened_at = time.time()
+                    self.stats["probe_failures"] += 1
+            if healthy:
+                logger.info("后端探测成功，恢复调用", backend=self.name)
+                return
@@ -2,210 +2,903 @@ import time
 import requests
 import json
 import os
+import re
+import zlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from learning_store import apply_learning_update, default_learning_memory, learning_memory_from_json, learning_memory_to_json
+from llm_health import LatencyHistogram, CircuitBreaker
+from memory_budget import BoundedCache
+from metrics import registry
+from app_logging import get_logger
+
+logger = get_logger("local_ai")
+
+
+class RequestCancelled(Exception):
+    """对冲请求中落败的请求被取消"""
+
+
+class OllamaBackend:
+    """一个Ollama模型后端（模型名+API地址）及其状态"""
+
+    def __init__(self, model_name, api_base="http://localhost:11434"):
+        self.model_name = model_name
+        self.api_base = api_base
+        self.available = False
+        self.prefix_context = None  # 提示词前缀的context只对同一模型有效
+        self.latency_histogram = LatencyHistogram()
+        self.circuit_breaker = None
+        self.stats = {"requests": 0, "wins": 0, "hedged": 0, "cancelled": 0, "errors": 0, "timeouts": 0}
+
+    @property
+    def name(self):
+        return f"{self.model_name}@{self.api_base}"
+
 
 class DeepSeekAI:
-    def __init__(self, model_name="deepseek-r1:8b", api_base="http://localhost:11434"):
-        """初始化DeepSeek AI，添加学习记忆功能"""
+    # 操作名称→操作指令
+    ACTION_MAP = {
+        "前进": "w", "后退": "s", "左移": "a", "右移": "d",
+        "左转": "鼠标左移", "右转": "鼠标右移",
+        "跳跃": "空格", "攻击/砍伐": "左键点击", "打开背包": "e"
+    }
+
+    def __init__(self, model_name="deepseek-r1:8b", api_base="http://localhost:11434", plan_mode=False,
+                 structured_output=True, reuse_prefix=True, backends=None, agent_id=None, learning_store=None):
+        """初始化DeepSeek AI，添加学习记忆功能
+
+        Args:
+            backends (list): 多个模型/地址，如[{"model": "qwen2.5:0.5b"}, {"model": "deepseek-r1:8b"}]，
+                按顺序作为主请求和对冲请求的目标；为None时只使用model_name和api_base
+            agent_id (str): 通过inference_broker共享推理时的实例ID，用于代理的公平调度和延迟统计
+            plan_mode (bool): 计划模式，一次LLM调用返回多步动作并在后续帧中依次执行
+            structured_output (bool): 约束解码模式，用Ollama的format JSON schema把输出限制在动作枚举内
+            reuse_prefix (bool): 复用预热过的固定提示词前缀(Ollama context)，每次只发送变化的后缀
+            learning_store: 多实例共享的学习表代理(learning_store.connect_learning_store)，
+                为None时使用本地的learning_data.json
+        """
         self.model_name = model_name
         self.api_base = api_base
-        self.model_loaded = self._check_model()
+        self.structured_output = structured_output
+        self.keep_alive = "30m"  # 让模型常驻显存，避免空闲后重新加载
+        self.request_headers = {"X-Agent-Id": agent_id} if agent_id else {}
+        
+        # 模型后端列表：第一个可用后端发主请求，超过对冲延迟仍未返回时依次向后续后端发对冲请求
+        if backends is None:
+            backends = [{"model": model_name, "api_base": api_base}]
+        self.backends = [OllamaBackend(b["model"], b.get("api_base", api_base)) for b in backends]
+        for backend in self.backends:
+            backend.available = self._check_model(backend)
+        self.model_loaded = any(backend.available for backend in self.backends)
+        self.hedge_percentile = 90  # 主请求超过该百分位延迟仍未返回时发出对冲请求
+        self.hedge_executor = ThreadPoolExecutor(max_workers=2 * len(self.backends), thread_name_prefix="LLMHedge")
         
         # 性能优化参数
-        self.max_inference_time = 0.8  # 最大推理时间(秒)
+        # 推理超时根据最近的延迟分布自适应调整，样本不足时使用初始值
+        self.initial_inference_time = 0.8  # 初始推理超时(秒)
+        self.min_inference_time = 0.3  # 自适应超时下限(秒)
+        self.max_inference_time = 5.0  # 自适应超时上限(秒)
+        self.timeout_percentile = 95  # 以该百分位延迟为基准
+        self.timeout_margin = 1.2  # 在百分位延迟基础上留出的余量
+        self.min_latency_samples = 10  # 样本数达到该值才开始自适应
+        self.latency_histogram = LatencyHistogram()  # 整体决策延迟（对冲时为胜出请求的延迟）
+        # 熔断器：每个后端连续失败或超时后暂停调用，冷却后在后台探测恢复
+        for backend in self.backends:
+            backend.circuit_breaker = CircuitBreaker(
+                lambda backend=backend: self._probe_backend(backend),
+                failure_threshold=3, cooldown=10.0, name=backend.model_name
+            )
+        self.breaker_rejections = 0
+        self.llm_outcomes = {"ok": 0, "timeout": 0, "failed": 0}  # 每次LLM决策的结果
+        self.llm_outcome_counters = {
+            outcome: registry.counter("llm_outcomes_total", "LLM决策结果", {"outcome": outcome})
+            for outcome in self.llm_outcomes
+        }
+        self.llm_seconds = registry.histogram("llm_inference_seconds", "LLM决策耗时（对冲时为胜出请求）(秒)")
         self.cache_ttl = 5  # 缓存过期时间(秒)
-        self.prompt_cache = {}
+        # 状态键最多1000个，过期条目只在读取时删除，用LRU上限保证缓存不会随运行时间增长
+        self.prompt_cache = BoundedCache(max_entries=256, ttl=self.cache_ttl)
         
-        # 自主学习系统
-        self.learning_memory = {
-            "success_actions": {},  # {情境: {动作: 成功率}}
-            "failure_actions": [],  # 失败动作记录，使用列表代替集合以便JSON序列化
-            "last_state": None,
-            "last_action": None,
-            "learning_rate": 0.1
+        # 分层决策参数：规则(<1ms) → 学习表 → LLM
+        self.learned_confidence = 0.3  # 学习表最佳动作得分达到该值才直接采用
+        self.min_llm_budget = 0.3  # 剩余预算低于该值时不再调用LLM(秒)
+        self.default_time_budget = 1.0  # 未指定预算时每帧的决策预算(秒)
+        self.last_decision = None  # 最近一次决策的层级和预算使用情况
+        self.tier_stats = {"rules": 0, "plan": 0, "learned": 0, "llm": 0, "speculative": 0, "fallback": 0}
+        self.decision_metrics = {
+            tier: (registry.counter("decisions_total", "各层级的决策次数", {"tier": tier}),
+                   registry.histogram("decision_seconds", "各层级的决策耗时(秒)", {"tier": tier}))
+            for tier in self.tier_stats
+        }
+        
+        # 计划模式：LLM一次返回一串动作，排队在后续帧执行，状态显著变化时提前作废
+        self.plan_mode = plan_mode
+        self.max_plan_length = 4  # 每个计划最多包含的动作数
+        self.action_plan = deque()
+        self.plan_state = None  # 生成计划时的游戏状态
+        # 计划由决策线程取出执行，分析线程检测到菜单时作废，读写都在锁内进行
+        self.plan_lock = threading.Lock()
+        self.plan_stats = {
+            "llm_calls": 0,
+            "plans_created": 0,
+            "plans_completed": 0,
+            "plans_invalidated": 0,
+            "plan_actions": 0
         }
+        self.stats_start_time = time.time()
+        
+        # 提示词前缀复用：固定说明部分只预填充一次，之后通过context复用其KV缓存
+        self.reuse_prefix = reuse_prefix
+        self.prefill_stats = {"calls": 0, "prompt_tokens": 0, "prompt_eval_time": 0.0}
         
-        # 加载学习数据
+        # 上一次决策的状态和动作（用于学习反馈）
+        self.last_state = None
+        self.last_action = None
+        
+        # 自主学习系统
+        self.learning_memory = default_learning_memory()
+        
+        # 加载学习数据：共享学习表由编排进程保存，本实例上报结果并定期拉取其它实例学到的内容
         self.learning_data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'learning_data.json')
-        self._load_learning_data()
+        self.learning_store = learning_store
+        self.store_sync_interval = 10.0  # 拉取共享学习表的间隔(秒)
+        self.store_flush_interval = 1.0  # 批量上报动作结果的间隔(秒)
+        self.last_store_sync = 0
+        # 上报和拉取都是跨进程调用，在后台线程中进行；决策和执行线程只把结果放入队列
+        self.store_updates = deque()  # 等待上报的(状态键, 动作, 是否成功)
+        self.store_stop_event = threading.Event()
+        self.store_thread = None
+        # 每次更新后立即写文件；由检查点(checkpoint.SessionCheckpointer)定期保存时关闭，避免决策线程做I/O
+        self.autosave_learning = True
+        if learning_store is not None:
+            self._sync_learning_store()
+            self.store_thread = threading.Thread(target=self._store_loop, name="LearningStoreSync", daemon=True)
+            self.store_thread.start()
+        else:
+            self._load_learning_data()
+        
+        for backend in self.backends:
+            if backend.available:
+                self._preload_model(backend)
 
-    def _check_model(self):
+    def _check_model(self, backend):
         """检查模型是否已在Ollama中可用"""
         try:
-            response = requests.get(f"{self.api_base}/api/tags")
+            response = requests.get(f"{backend.api_base}/api/tags")
             response.raise_for_status()
             models = [model["name"] for model in response.json().get("models", [])]
-            if self.model_name in models:
-                print(f"Ollama模型 {self.model_name} 可用")
+            if backend.model_name in models:
+                logger.info("Ollama模型可用", model=backend.model_name)
                 return True
             else:
-                print(f"错误：Ollama中未找到模型 {self.model_name}")
-                print(f"可用模型：{models}")
+                logger.error("Ollama中未找到模型", model=backend.model_name, available=models)
                 return False
         except Exception as e:
-            print(f"连接Ollama API失败：{e}")
-            print("请确保Ollama服务已启动：`ollama serve`")
+            logger.error("连接Ollama API失败：%s（请确保Ollama服务已启动：`ollama serve`）", e)
             return False
 
+    def _preload_model(self, backend):
+        """预加载模型并设置keep_alive，避免第一次决策时加载模型"""
+        try:
+            response = requests.post(
+                f"{backend.api_base}/api/generate",
+                json={"model": backend.model_name, "keep_alive": self.keep_alive},
+                headers=self.request_headers,
+                timeout=60
+            )
+            response.raise_for_status()
+            logger.info("模型已预加载", model=backend.model_name, keep_alive=self.keep_alive)
+        except Exception as e:
+            logger.warning("预加载模型失败：%s", e, model=backend.model_name)
+            return
+        
+        if self.reuse_prefix:
+            self._warm_prefix(backend)
+    
+    def _warm_prefix(self, backend):
+        """预填充固定提示词前缀，保存返回的context供后续请求复用
+
+        返回的context末尾包含预热时生成的token，去掉后才是纯前缀。
+        """
+        try:
+            response = requests.post(
+                f"{backend.api_base}/api/generate",
+                json={
+                    "model": backend.model_name,
+                    "prompt": self._prompt_prefix(),
+                    "stream": False,
+                    "keep_alive": self.keep_alive,
+                    "options": {"num_predict": 1}
+                },
+                headers=self.request_headers,
+                timeout=60
+            )
+            response.raise_for_status()
+            result = response.json()
+            context = result.get("context")
+            generated = result.get("eval_count", 0)
+            if context and generated:
+                context = context[:-generated] if len(context) > generated else None
+            backend.prefix_context = context
+            if backend.prefix_context:
+                logger.info("提示词前缀已预热", model=backend.model_name, tokens=len(backend.prefix_context))
+            else:
+                logger.warning("未返回context，无法复用提示词前缀", model=backend.model_name)
+        except Exception as e:
+            logger.warning("预热提示词前缀失败：%s", e, model=backend.model_name)
+            backend.prefix_context = None
+
     def _load_learning_data(self):
         """加载历史学习数据"""
         if os.path.exists(self.learning_data_path):
             try:
                 with open(self.learning_data_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    # 确保failure_actions是列表类型
-                    if "failure_actions" in data and isinstance(data["failure_actions"], list):
-                        self.learning_memory = data
+                    memory = learning_memory_from_json(json.load(f))
+                    # 确保failure_actions是列表类型（加载后转换为集合）
+                    if memory is not None:
+                        self.learning_memory = memory
                     else:
                         # 如果格式不正确，使用默认值
-                        print("学习数据格式不正确，使用默认值")
-                print(f"加载学习数据: {self.learning_data_path}")
+                        logger.warning("学习数据格式不正确，使用默认值")
+                logger.info("加载学习数据", path=self.learning_data_path)
             except Exception as e:
-                print(f"加载学习数据失败: {e}")
+                logger.error("加载学习数据失败: %s", e)
                 # 使用默认学习记忆
                 pass
         
     def _save_learning_data(self):
         """保存学习数据"""
+        tmp_path = self.learning_data_path + ".tmp"
         try:
-            with open(self.learning_data_path, 'w', encoding='utf-8') as f:
-                json.dump(self.learning_memory, f, ensure_ascii=False, indent=2)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(learning_memory_to_json(self.learning_memory), f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.learning_data_path)
         except Exception as e:
-            print(f"保存学习数据失败: {e}")
+            logger.error("保存学习数据失败: %s", e)
         
-    def _update_learning_memory(self, success):
-        """更新学习记忆，基于上一个动作的结果"""
-        if not self.last_state or not self.last_action:
+    def _sync_learning_store(self):
+        """拉取共享学习表，替换本地副本"""
+        try:
+            self.learning_memory = self.learning_store.snapshot()
+        except Exception as e:
+            logger.warning("拉取共享学习表失败: %s", e)
+        self.last_store_sync = time.time()
+
+    def _flush_store_updates(self):
+        """把排队的动作结果一次性上报到共享学习表"""
+        updates = []
+        while self.store_updates:
+            updates.append(self.store_updates.popleft())
+        if not updates:
+            return
+        try:
+            self.learning_store.record_batch(updates)
+        except Exception as e:
+            logger.warning("上报共享学习表失败: %s", e, updates=len(updates))
+
+    def _store_loop(self):
+        while not self.store_stop_event.wait(self.store_flush_interval):
+            self._flush_store_updates()
+            if time.time() - self.last_store_sync >= self.store_sync_interval:
+                self._sync_learning_store()
+
+    def close(self):
+        """停止共享学习表同步线程（上报剩余结果）和对冲请求线程池"""
+        if self.store_thread is not None:
+            self.store_stop_event.set()
+            self.store_thread.join(timeout=2)
+            self.store_thread = None
+            self._flush_store_updates()
+        self.hedge_executor.shutdown(wait=False)
+
+    def _update_learning_memory(self, success, state=None, action=None):
+        """更新学习记忆，基于上一个动作（或指定的状态和动作）的结果"""
+        state = state or self.last_state
+        action = action or self.last_action
+        if not state or not action:
             return
         
-        state_key = self._get_state_key(self.last_state)
+        state_key = str(self._get_state_key(state))
         
         # 更新成功/失败记录
-        if success:
-            if state_key not in self.learning_memory["success_actions"]:
-                self.learning_memory["success_actions"][state_key] = {}
-            action_stats = self.learning_memory["success_actions"][state_key]
-            action_stats[self.last_action] = action_stats.get(self.last_action, 0) + self.learning_memory["learning_rate"]
-            
-            # 如果动作成功，从失败记录中移除
-            if self.last_action in self.learning_memory["failure_actions"]:
-                self.learning_memory["failure_actions"].remove(self.last_action)
-        else:
-            if self.last_action not in self.learning_memory["failure_actions"]:
-                self.learning_memory["failure_actions"].append(self.last_action)
+        apply_learning_update(self.learning_memory, state_key, action, success)
         
-        # 保存学习数据
-        self._save_learning_data()
+        if self.learning_store is None:
+            # 保存学习数据
+            if self.autosave_learning:
+                self._save_learning_data()
+            return
+        self.store_updates.append((state_key, action, success))
         
     def _get_state_key(self, game_state):
         """将游戏状态转换为哈希键"""
-        return hash(frozenset(game_state["ratios"].items())) % 1000  # 限制状态数量
+        # 使用crc32而不是hash()，保证不同进程间键值一致，学习数据才能跨次运行复用
+        items = repr(sorted(game_state["ratios"].items())).encode("utf-8")
+        return zlib.crc32(items) % 1000  # 限制状态数量
         
     def create_situation_hash(self, game_state):
         """创建情境哈希值"""
         return self._get_state_key(game_state)
         
+    def _prompt_prefix(self):
+        """提示词中固定不变的说明部分（只与决策模式有关）"""
+        if self.plan_mode and self.structured_output:
+            output_hint = f'返回JSON，如{{"actions": ["w", "w", "左键点击", "鼠标右移"]}}，包含1到{self.max_plan_length}个操作符'
+        elif self.plan_mode:
+            output_hint = f"返回1到{self.max_plan_length}个操作符，用空格分隔，如: w w 左键点击 鼠标右移"
+        elif self.structured_output:
+            output_hint = '返回JSON，如{"action": "w"}'
+        else:
+            output_hint = "仅返回操作符，如w/a/s/d/空格/左键点击/e"
+        
+        task = "规划接下来的操作" if self.plan_mode else "决定最佳操作"
+        return f"我的世界生存专家，根据环境和历史经验{task}。可选操作:前进(w),后退(s),左移(a),右移(d),左转(鼠标左移),右转(鼠标右移),跳跃(空格),攻击/砍伐(左键点击),打开背包(e)。{output_hint}。"
+    
     def _optimize_prompt(self, game_state):
-        """优化提示词以减少推理时间"""
+        """优化提示词以减少推理时间，只返回随状态变化的后缀（环境描述和学习经验）"""
         state_key = self._get_state_key(game_state)
+        cache_key = (state_key, self.plan_mode)
         
         # 检查缓存
-        current_time = time.time()
-        if state_key in self.prompt_cache and current_time - self.prompt_cache[state_key]["time"] < self.cache_ttl:
-            return self.prompt_cache[state_key]["prompt"]
+        prompt = self.prompt_cache.get(cache_key)
+        if prompt is not None:
+            return prompt
         
         # 构建精简提示词
         env_desc = game_state["description_cn"][:100]  # 限制描述长度
         
         # 加入学习经验
-        state_actions = self.learning_memory["success_actions"].get(state_key, {})
+        state_actions = self.learning_memory["success_actions"].get(str(state_key), {})
         if state_actions:
             best_action = max(state_actions, key=state_actions.get)
             learning_hint = f"历史最佳动作: {best_action}"
         else:
             learning_hint = "无历史成功动作"
         
-        prompt = f"我的世界生存专家，根据环境和历史经验决定最佳操作。环境: {env_desc}。{learning_hint}。可选操作:前进(w),后退(s),左移(a),右移(d),左转(鼠标左移),右转(鼠标右移),跳跃(空格),攻击/砍伐(左键点击),打开背包(e)。仅返回操作符，如w/a/s/d/空格/左键点击/e"
+        prompt = f"环境: {env_desc}。{learning_hint}。"
         
         # 更新缓存
-        self.prompt_cache[state_key] = {
-            "prompt": prompt,
-            "time": current_time
-        }
+        self.prompt_cache.put(cache_key, prompt)
         
         return prompt
         
-    def get_action(self, game_state):
-        """根据游戏状态生成操作指令"""
-        if not self.model_loaded:
-            return self._simple_rule_based_action(game_state)
+    def get_action(self, game_state, time_budget=None):
+        """根据游戏状态生成操作指令（分层决策：规则 → 学习表 → LLM）
+
+        Args:
+            game_state (dict): 分析器返回的游戏状态
+            time_budget (float): 本帧可用于决策的时间(秒)，None表示使用默认预算
+
+        Returns:
+            str: 操作指令
+        """
+        start_time = time.time()
+        budget = self.default_time_budget if time_budget is None else max(0.0, time_budget)
         
         # 记录当前状态用于学习
         self.last_state = game_state
+        state_key = self._get_state_key(game_state)
+        state_actions = self.learning_memory["success_actions"].get(str(state_key), {})
         
-        # 优化提示词并检查缓存
-        prompt = self._optimize_prompt(game_state)
+        # 第一层：确定性规则（<1ms）
+        tier = "rules"
+        action = self._rule_tier_action(game_state)
+        
+        # 计划模式：继续执行尚未作废的计划
+        if action is None and self.action_plan:
+            action = self._next_plan_action(game_state)
+            if action is not None:
+                tier = "plan"
+        
+        # 第二层：学习表中足够可信的动作
+        if action is None:
+            tier = "learned"
+            action = self._learned_tier_action(state_actions)
         
-        # 检查失败动作，避免重复
+        # 第三层：前两层都不确定且剩余预算足够时才调用LLM
+        if action is None:
+            remaining = budget - (time.time() - start_time)
+            if self.model_loaded and remaining >= self.min_llm_budget and self._llm_fits_budget(remaining) \
+                    and self.llm_available():
+                tier = "llm"
+                actions = self._llm_decide(game_state, state_key, min(self.inference_timeout(), remaining))
+                action = self.start_plan(game_state, actions)
+        
+        # 兜底：学习表中的最佳动作或随机规则动作
+        if action is None:
+            tier = "fallback"
+            if state_actions:
+                action = max(state_actions, key=state_actions.get)
+            else:
+                action = self._simple_rule_based_action(game_state)
+        
+        return self.record_decision(game_state, action, tier, budget, start_time)
+    
+    def record_decision(self, game_state, action, tier, budget, start_time):
+        """记录一次决策的层级和预算使用情况，并作为学习反馈的对象"""
+        elapsed = time.time() - start_time
+        self.tier_stats[tier] += 1
+        counter, histogram = self.decision_metrics[tier]
+        counter.inc()
+        histogram.record(elapsed)
+        self.last_decision = {
+            "tier": tier,
+            "budget": budget,
+            "elapsed": elapsed,
+            "budget_used": elapsed / budget if budget > 0 else 1.0
+        }
+        self.last_state = game_state
+        self.last_action = action
+        return action
+    
+    def inference_timeout(self):
+        """根据最近延迟的百分位计算推理超时"""
+        if self.latency_histogram.count() < self.min_latency_samples:
+            return self.initial_inference_time
+        timeout = self.latency_histogram.percentile(self.timeout_percentile) * self.timeout_margin
+        return min(self.max_inference_time, max(self.min_inference_time, timeout))
+    
+    def _llm_fits_budget(self, remaining):
+        """剩余预算连一半的请求都完成不了时（低于中位延迟）不再调用LLM"""
+        if self.latency_histogram.count() < self.min_latency_samples:
+            return True
+        return remaining >= self.latency_histogram.percentile(50)
+    
+    def _active_backends(self):
+        """可用且未熔断的后端，按配置顺序排列"""
+        return [backend for backend in self.backends
+                if backend.available and backend.circuit_breaker.state == CircuitBreaker.CLOSED]
+    
+    def llm_available(self):
+        """是否至少有一个后端可以调用（全部熔断时直接返回False，不阻塞）"""
+        if self._active_backends():
+            return True
+        self.breaker_rejections += 1
+        return False
+    
+    def _hedge_delay(self, backend, timeout):
+        """主请求等待多久后发出对冲请求：该后端最近延迟的百分位，样本不足时取超时的一半"""
+        if backend.latency_histogram.count() < self.min_latency_samples:
+            return timeout / 2
+        return min(timeout, backend.latency_histogram.percentile(self.hedge_percentile))
+    
+    def _probe_backend(self, backend):
+        """熔断器探测：发送最小的生成请求，在超时上限内返回即认为后端恢复
+
+        后端可能在熔断期间重启或换了模型，恢复前丢弃旧的前缀context并重新预热。
+        """
+        backend.prefix_context = None
+        start_time = time.time()
+        response = requests.post(
+            f"{backend.api_base}/api/generate",
+            json={
+                "model": backend.model_name,
+                "prompt": "w",
+                "stream": False,
+                "keep_alive": self.keep_alive,
+                "options": {"num_predict": 1}
+            },
+            headers=self.request_headers,
+            timeout=self.max_inference_time
+        )
+        response.raise_for_status()
+        backend.latency_histogram.record(time.time() - start_time)
+        if self.reuse_prefix:
+            self._warm_prefix(backend)
+        return True
+    
+    def get_latency_report(self):
+        """LLM延迟分布、当前超时和熔断器状态"""
+        return {
+            **self.latency_histogram.summary(),
+            "timeout": self.inference_timeout(),
+            "breaker_states": {backend.name: backend.circuit_breaker.state for backend in self.backends},
+            "opened": sum(backend.circuit_breaker.stats["opened"] for backend in self.backends),
+            "rejected": self.breaker_rejections
+        }
+    
+    def get_backend_report(self):
+        """每个后端的请求数、胜出率和延迟分布"""
+        report = []
+        for backend in self.backends:
+            requests_sent = backend.stats["requests"]
+            report.append({
+                "backend": backend.name,
+                **backend.stats,
+                "win_rate": backend.stats["wins"] / requests_sent if requests_sent else 0.0,
+                **backend.latency_histogram.summary()
+            })
+        return report
+    
+    def needs_llm(self, game_state):
+        """判断该状态是否需要LLM决策（规则、计划和学习表都不确定时）"""
+        if self._rule_tier_action(game_state) is not None:
+            return False
+        with self.plan_lock:
+            has_plan = bool(self.action_plan) and not self._plan_invalidated(game_state)
+        if has_plan:
+            return False
         state_key = self._get_state_key(game_state)
+        state_actions = self.learning_memory["success_actions"].get(str(state_key), {})
+        return self._learned_tier_action(state_actions) is None
+    
+    def start_plan(self, game_state, actions):
+        """采用LLM返回的动作序列：返回第一步，计划模式下其余动作排队到后续帧"""
+        if not actions:
+            return None
+        with self.plan_lock:
+            self.action_plan.clear()
+            if self.plan_mode and len(actions) > 1:
+                self.action_plan.extend(actions[1:self.max_plan_length])
+                self.plan_state = game_state
+                self.plan_stats["plans_created"] += 1
+        return actions[0]
+    
+    def _next_plan_action(self, game_state):
+        """取出计划中的下一步动作，计划执行完毕时计入完成数；没有计划或计划已作废时返回None"""
+        with self.plan_lock:
+            if not self.action_plan:
+                return None
+            if self._plan_invalidated(game_state):
+                self._clear_plan()
+                return None
+            action = self.action_plan.popleft()
+            self.plan_stats["plan_actions"] += 1
+            if not self.action_plan:
+                self.plan_stats["plans_completed"] += 1
+                self.plan_state = None
+            return action
+    
+    def invalidate_plan(self, reason=None):
+        """作废尚未执行完的计划"""
+        with self.plan_lock:
+            if self.action_plan and reason:
+                logger.debug("计划作废", reason=reason)
+            self._clear_plan()
+    
+    def _clear_plan(self):
+        """作废计划，调用方需持有plan_lock"""
+        if not self.action_plan:
+            return
+        self.action_plan.clear()
+        self.plan_state = None
+        self.plan_stats["plans_invalidated"] += 1
+    
+    def _plan_invalidated(self, game_state):
+        """状态相对生成计划时发生显著变化（掉血、出现新结构或物品）时计划作废
+
+        打开菜单时由分析阶段调用invalidate_plan()作废，这里不再判断。
+        """
+        plan_state = self.plan_state
+        if plan_state is None:
+            return False
+        if game_state.get("health", 20) < plan_state.get("health", 20):
+            return True
+        for field in ("detected_structures", "detected_items"):
+            if set(game_state.get(field, {})) - set(plan_state.get(field, {})):
+                return True
+        return False
+    
+    def get_plan_report(self):
+        """计划模式统计：每分钟LLM调用次数和计划完成率"""
+        elapsed_minutes = max((time.time() - self.stats_start_time) / 60, 1e-6)
+        created = self.plan_stats["plans_created"]
+        return {
+            **self.plan_stats,
+            "llm_calls_per_minute": self.plan_stats["llm_calls"] / elapsed_minutes,
+            "plan_completion_rate": self.plan_stats["plans_completed"] / created if created else 0.0
+        }
+    
+    def _rule_tier_action(self, game_state):
+        """第一层：只在规则有把握时返回动作，否则返回None"""
+        desc = game_state["description_cn"]
+        
+        # 树木、敌人、矿石都直接攻击/挖掘
+        target_keywords = ["树木", "木头", "树干", "原木", "怪物", "敌人", "僵尸", "骷髅", "爬行者",
+                           "矿石", "铁", "金", "钻石", "煤"]
+        if any(keyword in desc for keyword in target_keywords):
+            return "左键点击"
+        
+        # 在水中需要跳跃上浮
+        if "水" in desc:
+            return "空格"
+        
+        return None
+    
+    def _learned_tier_action(self, state_actions):
+        """第二层：学习表中最佳动作得分足够高且未在失败记录中时返回，否则返回None"""
+        if not state_actions:
+            return None
+        best_action = max(state_actions, key=state_actions.get)
+        if state_actions[best_action] < self.learned_confidence:
+            return None
+        if best_action in self.learning_memory["failure_actions"]:
+            return None
+        return best_action
+    
+    def _llm_decide(self, game_state, state_key, timeout, cancel_event=None):
+        """第三层：调用Ollama API，在超时时间内返回动作列表，失败或无法解析时返回空列表
 
+        配置了多个后端时使用对冲请求：主请求超过对冲延迟仍未返回，就向下一个后端再发一次，
+        先返回有效动作的请求胜出，其余请求被取消。
+        cancel_event由调用方设置时（例如推测结果被丢弃）立即断开所有请求，不计入延迟和结果统计。
+        """
+        # 优化提示词并检查缓存
+        suffix = self._optimize_prompt(game_state)
+        
+        backends = self._active_backends()
+        if not backends:
+            return []
+        
         # 调用Ollama API
-        try:
-            # 设置超时和优化参数
-            start_time = time.time()
-            response = requests.post(
-                f"{self.api_base}/api/generate",
-                json={
-                    "model": self.model_name,
-                    "prompt": prompt,
-                    "stream": False,
-                    "temperature": 0.1 if state_key in self.learning_memory["success_actions"] else 0.3,  # 有历史经验时降低随机性
-                    "max_tokens": 5,  # 进一步限制输出长度
-                    "top_p": 0.5,  # 减少候选词多样性以加速推理
-                    "stop": ["\n"]  # 遇到换行立即停止
-                },
-                timeout=self.max_inference_time  # 设置超时
+        self.plan_stats["llm_calls"] += 1
+        start_time = time.time()
+        deadline = start_time + timeout
+        # 同一个事件既用于调用方取消，也用于结束时取消落败的对冲请求；每次调用使用新的事件
+        cancel_event = cancel_event or threading.Event()
+        futures = {}
+        
+        def submit(backend, hedged):
+            if hedged:
+                backend.stats["hedged"] += 1
+            future = self.hedge_executor.submit(
+                self._call_backend, backend, suffix, state_key, deadline - time.time(), cancel_event
             )
-            inference_time = time.time() - start_time
-            
-            if inference_time > self.max_inference_time * 0.8:
-                print(f"警告：推理时间过长({inference_time:.2f}s)")
-            response.raise_for_status()
-            result = response.json()
-            
-            # 从响应中提取操作
-            text = result.get("response", "").strip()
-            action_map = {
-                "前进": "w", "后退": "s", "左移": "a", "右移": "d",
-                "左转": "鼠标左移", "右转": "鼠标右移",
-                "跳跃": "空格", "攻击/砍伐": "左键点击", "打开背包": "e"
-            }
-            
-            # 快速匹配操作
-            for keyword, key in action_map.items():
-                if keyword in text or key in text:
-                    self.last_action = key
-                    return key
-            
-            # 如果没找到匹配的操作，使用最佳历史动作或默认
-            self.last_action = max(state_actions, key=state_actions.get) if state_actions else "w"
-            return self.last_action
-            
+            futures[future] = backend
+        
+        submit(backends[0], hedged=False)
+        pending_backends = backends[1:]
+        # 每发出一个请求后都要再等一个对冲延迟才发下一个，三个以上后端时不会变成同时全部发出
+        next_hedge_at = start_time + self._hedge_delay(backends[0], timeout)
+        actions = []
+        winner = None
+        while futures and winner is None and not cancel_event.is_set():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            # 还有备用后端时只等到对冲时刻，之后发出对冲请求
+            wait_time = remaining
+            if pending_backends:
+                wait_time = min(remaining, max(0.0, next_hedge_at - time.time()))
+            done, _ = wait(futures, timeout=wait_time, return_when=FIRST_COMPLETED)
+            for future in done:
+                backend = futures.pop(future)
+                result = future.result()
+                if result and winner is None:
+                    actions, winner = result, backend
+            if winner is not None or not pending_backends:
+                continue
+            if not futures or time.time() >= next_hedge_at:
+                # 到达对冲时刻，或已发出的请求都失败了（立即尝试下一个后端）
+                backend = pending_backends.pop(0)
+                submit(backend, hedged=True)
+                next_hedge_at = time.time() + self._hedge_delay(backend, timeout)
+        
+        # 取消落败或超时的请求
+        cancelled = cancel_event.is_set() and winner is None
+        cancel_event.set()
+        inference_time = time.time() - start_time
+        if cancelled:
+            logger.debug("推理已被调用方取消", seconds=round(inference_time, 3))
+            return []
+        if winner is None:
+            # 仍有请求未返回说明是超时，否则是所有后端都失败了
+            outcome = "timeout" if futures else "failed"
+            self.llm_outcomes[outcome] += 1
+            self.llm_outcome_counters[outcome].inc()
+            logger.warning("推理超时或失败，使用兜底动作", outcome=outcome)
+            # 超时样本按超时时间计入，使后续超时随真实延迟上调
+            self.latency_histogram.record(min(inference_time, timeout))
+            return []
+        
+        self.llm_outcomes["ok"] += 1
+        self.llm_outcome_counters["ok"].inc()
+        winner.stats["wins"] += 1
+        self.latency_histogram.record(inference_time)
+        self.llm_seconds.record(inference_time)
+        if inference_time > timeout * 0.8:
+            logger.warning("推理时间过长", seconds=round(inference_time, 2), timeout=round(timeout, 2))
+        return actions
+    
+    def _call_backend(self, backend, suffix, state_key, timeout, cancel_event):
+        """向单个后端发送生成请求并解析动作，记录该后端的延迟、熔断和取消统计"""
+        backend.stats["requests"] += 1
+        start_time = time.time()
+        try:
+            result = self._generate(backend, self._build_generate_request(backend, suffix, state_key),
+                                    timeout, cancel_event)
+        except RequestCancelled:
+            backend.stats["cancelled"] += 1
+            return []
         except requests.exceptions.Timeout:
-            print(f"推理超时，使用规则动作")
-            self.last_action = self._simple_rule_based_action(game_state)
-            return self.last_action
+            backend.stats["timeouts"] += 1
+            backend.latency_histogram.record(timeout)
+            backend.circuit_breaker.record_failure()
+            return []
         except Exception as e:
-            print(f"调用API失败：{e}")
-            self.last_action = self._simple_rule_based_action(game_state)
-            return self.last_action
+            logger.warning("调用API失败：%s", e, model=backend.model_name)
+            backend.stats["errors"] += 1
+            backend.circuit_breaker.record_failure()
+            return []
+        
+        backend.latency_histogram.record(time.time() - start_time)
+        backend.circuit_breaker.record_success()
+        self._record_prefill(result)
+        
+        # 从响应中提取操作
+        text = result.get("response", "").strip()
+        if self.structured_output:
+            return self._parse_structured(text)
+        
+        # 去掉deepseek-r1的思考过程
+        text = re.sub(r"<think>.*?(</think>|$)", "", text, flags=re.S).strip()
+        if self.plan_mode:
+            return self._parse_plan(text)
+        
+        # 快速匹配操作
+        action = self._match_action(text)
+        return [action] if action else []
+    
+    def _generate(self, backend, request, timeout, cancel_event):
+        """以流式方式调用/api/generate，在截止时间或被取消时立即断开连接
+
+        断开连接后Ollama会停止生成，落败的对冲请求不会继续占用模型。
+        """
+        if timeout <= 0:
+            raise requests.exceptions.Timeout("推理超时")
+        deadline = time.time() + timeout
+        # X-Deadline告诉推理代理该请求的剩余时间，过期的请求会在代理中直接丢弃
+        headers = dict(self.request_headers, **{"X-Deadline": f"{timeout:.3f}"})
+        response = requests.post(f"{backend.api_base}/api/generate", json=request, stream=True,
+                                 headers=headers, timeout=timeout)
+        try:
+            response.raise_for_status()
+            pieces = []
+            try:
+                for line in response.iter_lines():
+                    if cancel_event.is_set():
+                        raise RequestCancelled()
+                    if time.time() > deadline:
+                        raise requests.exceptions.Timeout("推理超时")
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise RuntimeError(chunk["error"])
+                    pieces.append(chunk.get("response", ""))
+                    if chunk.get("done"):
+                        chunk["response"] = "".join(pieces)
+                        return chunk
+            except requests.exceptions.ConnectionError as e:
+                # 流式读取超时会被requests包装成ConnectionError
+                if cancel_event.is_set():
+                    raise RequestCancelled()
+                if "timed out" in str(e):
+                    raise requests.exceptions.Timeout("推理超时")
+                raise
+            raise RuntimeError("响应流意外结束")
+        finally:
+            response.close()
+    
+    def _build_generate_request(self, backend, suffix, state_key):
+        """构建/api/generate请求体，生成参数必须放在options中才会生效"""
+        options = {
+            "temperature": 0.1 if str(state_key) in self.learning_memory["success_actions"] else 0.3,  # 有历史经验时降低随机性
+            "top_p": 0.5,  # 减少候选词多样性以加速推理
+        }
+        request = {
+            "model": backend.model_name,
+            "stream": True,
+            "keep_alive": self.keep_alive,
+            "options": options
+        }
+        
+        # 有预热好的前缀时只发送变化的后缀，否则发送完整提示词
+        if self.reuse_prefix and backend.prefix_context:
+            request["context"] = backend.prefix_context
+            request["prompt"] = suffix
+        else:
+            request["prompt"] = self._prompt_prefix() + suffix
+        
+        if self.structured_output:
+            # JSON输出本身有固定开销，按动作数放宽生成长度
+            options["num_predict"] = 16 + 12 * self.max_plan_length if self.plan_mode else 16
+            request["format"] = self._action_schema()
+        else:
+            options["num_predict"] = 20 if self.plan_mode else 5  # 进一步限制输出长度，计划模式需要容纳多个动作
+            options["stop"] = ["\n"]  # 遇到换行立即停止
+        return request
+    
+    def _record_prefill(self, result):
+        """记录提示词token数和预填充耗时，用于确认前缀复用的效果"""
+        prompt_tokens = result.get("prompt_eval_count", 0)
+        prompt_eval_time = result.get("prompt_eval_duration", 0) / 1e9  # Ollama返回纳秒
+        self.prefill_stats["calls"] += 1
+        self.prefill_stats["prompt_tokens"] += prompt_tokens
+        self.prefill_stats["prompt_eval_time"] += prompt_eval_time
+        logger.debug("预填充完成", prompt_tokens=prompt_tokens, prompt_eval_ms=round(prompt_eval_time * 1000, 1))
+    
+    def get_prefill_report(self):
+        """提示词预填充统计：平均token数和平均预填充耗时"""
+        calls = self.prefill_stats["calls"]
+        return {
+            **self.prefill_stats,
+            "prefix_reused": self.reuse_prefix and any(backend.prefix_context for backend in self.backends),
+            "avg_prompt_tokens": self.prefill_stats["prompt_tokens"] / calls if calls else 0.0,
+            "avg_prompt_eval_time": self.prefill_stats["prompt_eval_time"] / calls if calls else 0.0
+        }
+    
+    def _action_schema(self):
+        """限制输出只能是动作枚举的JSON schema"""
+        action_enum = {"type": "string", "enum": list(self.ACTION_MAP.values())}
+        if self.plan_mode:
+            return {
+                "type": "object",
+                "properties": {
+                    "actions": {
+                        "type": "array",
+                        "items": action_enum,
+                        "minItems": 1,
+                        "maxItems": self.max_plan_length
+                    }
+                },
+                "required": ["actions"]
+            }
+        return {
+            "type": "object",
+            "properties": {"action": action_enum},
+            "required": ["action"]
+        }
+    
+    def _parse_structured(self, text):
+        """精确解析约束解码返回的JSON，不在动作枚举内的结果视为无效"""
+        try:
+            data = json.loads(text)
+        except ValueError:
+            logger.warning("无法解析模型输出: %s", text[:50])
+            return []
+        if not isinstance(data, dict):
+            return []
+        
+        valid_actions = self.ACTION_MAP.values()
+        if self.plan_mode:
+            actions = data.get("actions")
+            if not isinstance(actions, list):
+                return []
+            return [action for action in actions if action in valid_actions][:self.max_plan_length]
+        
+        action = data.get("action")
+        return [action] if action in valid_actions else []
+    
+    def _match_action(self, text):
+        """在文本中匹配第一个可识别的操作"""
+        if text in self.ACTION_MAP.values():
+            return text
+        for keyword, key in self.ACTION_MAP.items():
+            if keyword in text or key in text:
+                return key
+        return None
+    
+    def _parse_plan(self, text):
+        """将"w w 左键点击 鼠标右移"形式的回复解析为动作列表"""
+        actions = []
+        for token in re.split(r"[\s,，、/]+", text):
+            action = self._match_action(token) if token else None
+            if action:
+                actions.append(action)
+            if len(actions) >= self.max_plan_length:
+                break
+        return actions
 
-    def feedback_success(self):
-        """反馈动作成功"""
-        self._update_learning_memory(success=True)
+    def feedback_success(self, state=None, action=None):
+        """反馈动作成功（流水线中决策和评估不同步时，传入被评估动作的决策状态和动作）"""
+        self._update_learning_memory(success=True, state=state, action=action)
         
-    def feedback_failure(self):
+    def feedback_failure(self, state=None, action=None):
         """反馈动作失败"""
-        self._update_learning_memory(success=False)
+        self._update_learning_memory(success=False, state=state, action=action)
         
     def _simple_rule_based_action(self, game_state):
         """基于规则的简单决策（API调用失败时使用）"""
@@ -3,17 +3,107 @@ import sys
 import os
 import cv2
 import time
-import traceback
+import argparse
+import json
+import signal
+import threading
+from collections import deque
 
-def main():
+from app_logging import LOG_LEVELS, flush_logging, get_logger, get_logging_stats, setup_logging, shutdown_logging
+from frame_pacing import PACING_PRESETS, FramePacer
+from stage_profiler import PROFILE_MODES, PROFILE_STAGES, StageProfiler
+
+logger = get_logger("main")
+
+# 退出码：供无人值守运行时的守护进程判断是否需要重启
+EXIT_OK = 0
+EXIT_RUNTIME_ERROR = 1
+EXIT_IMPORT_ERROR = 2
+EXIT_INIT_ERROR = 3
+# 以这些原因退出的会话视为已结束，下次启动不再从检查点恢复
+FINISHED_EXIT_REASONS = ("esc", "victory")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Minecraft AI自动生存")
+    parser.add_argument("--tick-rate", type=float, default=None, help="初始决策频率(次/秒)，fixed模式下为固定频率(默认1.0)")
+    parser.add_argument("--pacing", default="balanced", choices=list(PACING_PRESETS),
+                        help="帧节奏预设：根据各阶段耗时自动调整决策频率、分析分辨率和可选阶段；fixed为固定频率")
+    parser.add_argument("--queue-size", type=int, default=1, help="流水线阶段之间的队列长度（满时丢弃最旧的数据）")
+    parser.add_argument("--metrics-port", type=int, default=9108, help="本机Prometheus指标接口端口，0表示不启动")
+    parser.add_argument("--metrics-snapshot", default=None, help="定期写入指标快照的JSONL文件路径（默认不写）")
+    parser.add_argument("--metrics-interval", type=float, default=10.0, help="指标快照间隔(秒)")
+    parser.add_argument("--log-level", default="INFO", choices=LOG_LEVELS,
+                        help="日志级别：每帧的动作、分数变化等为DEBUG，默认INFO下决策循环不产生控制台输出")
+    parser.add_argument("--log-file", default=None, help="同时写入的日志文件（按10MB轮转）")
+    parser.add_argument("--log-json", action="store_true", help="每条日志输出一行JSON")
+    parser.add_argument("--profile", default="off", choices=PROFILE_MODES,
+                        help="性能剖析：sample为低开销采样（输出折叠调用栈），cprofile只在所选阶段内启用cProfile")
+    parser.add_argument("--profile-stages", default=",".join(PROFILE_STAGES),
+                        help=f"参与剖析的阶段，逗号分隔（默认全部: {','.join(PROFILE_STAGES)}）")
+    parser.add_argument("--profile-ticks", type=int, default=100, help="剖析的帧数，0表示一直剖析到退出")
+    parser.add_argument("--profile-dir", default="profiles", help="剖析结果输出目录")
+    parser.add_argument("--slow-tick-threshold", type=float, default=None,
+                        help="慢帧阈值(秒)：截图到动作完成超过该值时自动写出该帧的调用栈（默认不捕获）")
+    parser.add_argument("--headless", action="store_true",
+                        help="无人值守模式：不显示画面、不等待按键，收到SIGINT/SIGTERM时正常退出并返回退出码")
+    parser.add_argument("--max-runtime", type=float, default=0, help="运行时长上限(秒)，到时正常退出，0表示不限")
+    parser.add_argument("--stats-file", default=None, help="退出时写入运行统计的JSON文件")
+    parser.add_argument("--max-consecutive-errors", type=int, default=20,
+                        help="流水线阶段或主循环连续出错达到该次数时以退出码1退出（便于守护进程重启），0表示不限")
+    parser.add_argument("--instance-id", default=None,
+                        help="多实例运行时的实例ID：作为推理代理的agent_id和所有指标的instance标签")
+    parser.add_argument("--window-hwnd", type=int, default=None, help="绑定指定的游戏窗口句柄，默认自动查找")
+    parser.add_argument("--input-backend", default="auto", choices=("auto", "direct", "window", "pyautogui", "recording"),
+                        help="输入后端：window向--window-hwnd指定的窗口投递消息，多个实例可同时控制各自的窗口")
+    parser.add_argument("--api-base", default="http://localhost:11434", help="Ollama或推理代理(inference_broker)的地址")
+    parser.add_argument("--learning-store", default=None,
+                        help="共享学习表地址host:port（由orchestrator提供，认证密钥取自环境变量MINECRAFT_AI_STORE_KEY）")
+    parser.add_argument("--checkpoint-dir", default="checkpoints", help="会话检查点目录")
+    parser.add_argument("--checkpoint-interval", type=float, default=30.0, help="检查点间隔(秒)，0表示不写检查点")
+    parser.add_argument("--no-resume", action="store_true", help="启动时不从检查点恢复会话")
+    parser.add_argument("--memory-budget", type=float, default=0,
+                        help="进程内存预算(MB)，超出时清空缓存并记录警告，0表示只统计不收缩")
+    parser.add_argument("--memory-interval", type=float, default=30.0, help="统计各组件内存占用的间隔(秒)")
+    args = parser.parse_args(argv)
+    # 频率不大于0时采集阶段没有间隔，会空转占满CPU
+    if args.tick_rate is not None and args.tick_rate <= 0:
+        parser.error("--tick-rate必须大于0")
+    return args
+
+def write_stats_file(path, stats):
+    """先写临时文件再替换，守护进程读取时不会读到写了一半的文件"""
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(stats, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.error("写入运行统计失败: %s", e)
+
+def install_signal_handlers(callback):
+    """SIGINT/SIGTERM（Windows下还有控制台关闭时的SIGBREAK）触发正常退出"""
+    for name in ("SIGINT", "SIGTERM", "SIGBREAK"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), callback)
+
+def main(argv=None, stop_event=None):
+    """运行AI，返回退出码
+
+    Args:
+        stop_event: 外部退出请求（threading.Event或multiprocessing.Event），例如编排进程通知实例退出
+    """
+    args = parse_args(argv)
+    # 日志在后台线程中格式化和写出，决策循环内只做级别判断和入队
+    setup_logging(args.log_level, log_file=args.log_file, json_format=args.log_json)
+    exit_code = EXIT_OK
     try:
-        print(f"Python版本: {sys.version}")
-        print(f"工作目录: {os.getcwd()}")
+        logger.info("Python版本: %s", sys.version)
+        logger.info("工作目录: %s", os.getcwd())
         
         # 添加项目目录到搜索路径
         project_dir = os.path.dirname(os.path.abspath(__file__))
         sys.path.append(project_dir)
-        print(f"项目目录: {project_dir}")
+        logger.info("项目目录: %s", project_dir)
 
         # 导入模块
         try:
@@ -21,34 +111,94 @@ def main():
             from game_analyzer import GameStateAnalyzer, put_chinese_text, get_chinese_font
             from game_controller import GameController
             from local_ai import DeepSeekAI
-            print("所有模块导入成功！")
+            from decision_worker import SpeculativeDecisionWorker
+            from menu_recovery import MenuRecovery
+            from pipeline import Pipeline
+            from metrics import registry, MetricsExporter
+            from input_backend import create_input_backend
+            from checkpoint import SessionCheckpointer
+            from memory_budget import MemoryBudget
+            from learning_store import learning_memory_to_json
+            logger.info("所有模块导入成功！")
         except ImportError as e:
-            print(f"模块导入失败: {e}")
-            print(traceback.format_exc())
-            input("按Enter键退出...")
-            return
+            logger.exception("模块导入失败: %s", e)
+            exit_code = EXIT_IMPORT_ERROR
+            return exit_code
 
         # 初始化各模块
-        print("\n初始化模块...")
+        logger.info("初始化模块...")
         try:
+            learning_store = None
+            if args.learning_store:
+                from learning_store import connect_learning_store
+                host, port = args.learning_store.rsplit(":", 1)
+                learning_store = connect_learning_store((host, int(port)),
+                                                        os.environ.get("MINECRAFT_AI_STORE_KEY", "").encode())
+            if args.instance_id:
+                registry.set_const_labels(instance=args.instance_id)
+            if args.window_hwnd is not None:
+                # 共享窗口跟踪器绑定指定窗口，截图、点击和菜单恢复都使用该窗口
+                from window_tracker import get_shared_tracker
+                get_shared_tracker(args.window_hwnd)
             capture = MinecraftScreenCapture()
             analyzer = GameStateAnalyzer()
-            ai = DeepSeekAI(model_name="deepseek-r1:8b")
+            # 计划模式：一次LLM调用返回多步动作，摊薄推理开销
+            ai = DeepSeekAI(model_name="deepseek-r1:8b", api_base=args.api_base, plan_mode=True,
+                            agent_id=args.instance_id, learning_store=learning_store)
+            # 推测式决策线程：动作执行期间提前为下一状态推理
+            decision_worker = SpeculativeDecisionWorker(ai)
             # 初始化控制器，设置回到游戏模式：1=直接运行回到游戏exe文件
-            controller = GameController(back_to_game_mode=1)
-            chinese_font = get_chinese_font()
-            print("模块初始化完成")
+            backend_options = {"hwnd": args.window_hwnd} if args.input_backend == "window" else {}
+            controller = GameController(back_to_game_mode=1,
+                                        input_backend=create_input_backend(args.input_backend, **backend_options))
+            # 菜单恢复状态机：后台按ESC→点击按钮→mchd.exe的顺序关闭菜单
+            menu_recovery = MenuRecovery(controller, capture, analyzer)
+            # 无人值守模式不显示画面，不需要加载字体
+            chinese_font = None if args.headless else get_chinese_font()
+            logger.info("模块初始化完成")
         except Exception as e:
-            print(f"初始化失败: {e}")
-            print(traceback.format_exc())
-            input("按Enter键退出...")
-            return
+            logger.exception("初始化失败: %s", e)
+            exit_code = EXIT_INIT_ERROR
+            return exit_code
+
 
+        # 帧节奏控制：测量各阶段耗时，自动调整决策频率、分析分辨率和可选阶段
+        # LLM推理延迟也参与频率调整：间隔至少为最小决策预算加推理延迟中位数
+        pacer = FramePacer(args.pacing, tick_rate=args.tick_rate or (1.0 if args.pacing == "fixed" else None),
+                           inference_latency=lambda: ai.latency_histogram.percentile(50) if ai.model_loaded else None,
+                           min_decision_budget=ai.min_llm_budget)
 
-        print("\n开始AI自动生存（按ESC退出）...")
+        # 指标：热路径上只更新内存中的数值，导出在后台线程中进行
+        metrics_exporter = None
+        try:
+            metrics_exporter = MetricsExporter(registry, port=args.metrics_port, snapshot_path=args.metrics_snapshot,
+                                               snapshot_interval=args.metrics_interval)
+        except OSError as e:
+            logger.warning("指标导出启动失败: %s", e)
+        # 性能剖析：各阶段处理函数和画面显示包装在剖析上下文中，结果在后台线程写出
+        profiler = StageProfiler(args.profile, stages=[s.strip() for s in args.profile_stages.split(",") if s.strip()],
+                                 ticks=args.profile_ticks, output_dir=args.profile_dir,
+                                 slow_tick_threshold=args.slow_tick_threshold)
+        stage_histograms = {}
+        ticks_counter = registry.counter("ticks_total", "完成的决策帧数")
+        tick_latency = registry.histogram("tick_latency_seconds", "从截图到动作完成的延迟(秒)")
+        score_gauge = registry.gauge("score", "当前分数")
+        tick_rate_gauge = registry.gauge("tick_rate", "当前决策频率(次/秒)")
+        scale_gauge = registry.gauge("analysis_scale", "当前分析分辨率缩放")
+
+        def observe_stage(name, seconds):
+            pacer.record_stage(name, seconds)
+            histogram = stage_histograms.get(name)
+            if histogram is None:
+                histogram = stage_histograms[name] = registry.histogram(
+                    "stage_seconds", "流水线各阶段处理一项数据的耗时(秒)", {"stage": name})
+            histogram.record(seconds)
+
+        logger.info("开始AI自动生存（按ESC退出，节奏: %s，初始 %.1f 次决策/秒）...", args.pacing, pacer.tick_rate)
         frame_count = 0
         start_time = time.time()
         last_state = None
+        is_night = False
         
         # 游戏状态跟踪
         game_stats = {
@@ -58,216 +208,404 @@ def main():
             "mobs_killed": 0,
             "structures_found": 0
         }
+        exit_reason = None
+
+        def collect_session():
+            return {
+                "saved_at": time.time(),
+                "instance_id": args.instance_id,
+                "runtime": resumed_runtime + time.time() - start_time,
+                "frames": resumed_frames + frame_count,
+                "game_stats": game_stats,
+                "exit_reason": exit_reason
+            }
+
+        # 检查点：后台定期保存会话状态和本地学习表，崩溃或被强制重启后从上次的检查点继续。
+        # 上一次决策的状态和动作不保存：重启后没有等待评估的动作，恢复它们不会产生学习反馈
+        checkpointer = None
+        resumed_runtime = 0.0
+        resumed_frames = 0
+        if args.checkpoint_interval > 0:
+            checkpointer = SessionCheckpointer(args.checkpoint_dir, interval=args.checkpoint_interval)
+            session = None if args.no_resume else checkpointer.load("session")
+            if session and session.get("exit_reason") not in FINISHED_EXIT_REASONS:
+                game_stats.update(session.get("game_stats") or {})
+                resumed_runtime = session.get("runtime", 0.0)
+                resumed_frames = session.get("frames", 0)
+                logger.info("从检查点恢复会话", score=game_stats["score"], frames=resumed_frames,
+                            runtime=round(resumed_runtime), saved_at=time.ctime(session.get("saved_at", 0)))
+            checkpointer.register("session", collect_session)
+            if learning_store is None:
+                # 共享学习表由编排进程保存；本地学习表改为随检查点写出，决策线程不再每次更新都写文件
+                ai.autosave_learning = False
+                checkpointer.register("learning", lambda: learning_memory_to_json(ai.learning_memory),
+                                      path=ai.learning_data_path)
+
+        # 流水线各阶段：捕获 → 分析 → 决策 → 执行，各自在独立线程中运行，
+        # 阶段之间用只保留最新数据的有界队列连接，每个阶段处理一帧的数据用字典tick传递
+        def capture_stage():
+            nonlocal frame_count
+            # 1. 捕获游戏画面
+            frame = capture.capture_frame()
+            if frame is None:
+                return None
+            frame_count += 1
+            return {"frame": frame, "captured_at": time.time()}
+
+        def analyze_stage(tick):
+            nonlocal is_night
+            frame = tick["frame"]
+            # 检查是否打开了菜单：恢复在后台进行，期间丢弃画面，不做决策和操作
+            if menu_recovery.active or analyzer.is_menu_open(frame):
+                if menu_recovery.start():
+                    logger.info("检测到菜单已打开，后台尝试关闭...")
+                    ai.invalidate_plan("检测到菜单")
+                return None
+
+            # 2. 分析环境
+            game_state = analyzer.analyze_frame(frame, scale=pacer.analysis_scale)
+            state_desc = game_state["description_cn"]
+            
+            # 更新游戏统计
+            if "村庄" in state_desc or "神殿" in state_desc or "密室" in state_desc:
+                game_stats["structures_found"] += 1
+
+            # 检查是否为夜晚（可选阶段，节奏控制降级时沿用上次的结果）
+            if pacer.optional_enabled("night"):
+                was_night = is_night
+                is_night = analyzer.is_night(frame)
+                if is_night != was_night:
+                    logger.info("进入夜晚模式，调整视觉分析参数..." if is_night else "夜晚结束，恢复视觉分析参数")
+            if is_night:
+                # 可以在这里调整AI决策参数以适应夜晚环境
+                game_state["is_night"] = True
+            else:
+                game_state["is_night"] = False
+            # 分析完成后释放整帧画面的引用：游戏状态会被学习反馈、计划和推测决策长时间持有，
+            # 只有显示画面时才在tick中保留到显示完成
+            game_state.pop("frame", None)
+            if args.headless:
+                del tick["frame"]
+            tick["game_state"] = game_state
+            return tick
+
+        # 已执行、等待评估的动作：不再在执行后单独截图分析，
+        # 而是用下一个在动作完成后截取的画面的分析结果（同时也是下一次决策的输入）来评估。
+        # 流水线中节拍可能短于一个动作，评估到来之前可能又执行了新动作，所以按完成顺序排队；
+        # 执行阶段只追加、决策阶段只取出，deque的两端操作是线程安全的
+        pending_evaluations = deque(maxlen=16)
+
+        def evaluate_action(pending, new_game_state):
+            """根据动作前后的状态评估动作结果，更新学习记忆和分数"""
+            nonlocal last_state
+            game_state = pending["game_state"]
+            action = pending["action"]
+            previous_health = game_state.get('health', 20)
+            current_health = new_game_state.get('health', 20)
+            success = True
+            
+            # 判断失败条件：生命值降低或跌落
+            if current_health < previous_health:
+                success = False
+                game_stats['deaths'] += 1
+                logger.debug("动作失败：生命值减少", action=action, health_lost=previous_health - current_health)
+            elif '跌落' in new_game_state['description_cn']:
+                success = False
+                logger.debug("动作失败：发生跌落", action=action)
+            
+            # 判断成功条件：发现新结构或获取物品
+            if new_game_state['detected_structures'] or new_game_state['detected_items']:
+                success = True
+                logger.debug("动作成功：发现新结构或物品", action=action)
+            
+            # 更新学习记忆
+            if success:
+                ai.feedback_success(game_state, action)
+                game_stats['score'] += 2
+            else:
+                ai.feedback_failure(game_state, action)
+                game_stats['score'] -= 1
+            
+            # 5. 学习系统 - 评估行动结果：如果资源比例增加则视为成功
+            current_resources = sum(new_game_state["ratios"].values())
+            last_resources = sum(game_state["ratios"].values())
+            if current_resources > last_resources:
+                ai.feedback_success(game_state, action)
+                logger.debug("行动成功 - 已记录", action=action)
+            elif "死亡" in new_game_state["description_cn"]:  # 简化死亡检测
+                ai.feedback_failure(game_state, action)
+                game_stats["deaths"] += 1
+                game_stats["score"] -= 10
+                logger.info("死亡 -10分", action=action)
+            
+            # 保存最新观察到的状态
+            last_state = {
+                "situation_hash": ai.create_situation_hash(new_game_state),
+                "ratios": new_game_state["ratios"],
+                "structures": new_game_state.get("detected_structures", {}),
+                "inventory": new_game_state.get("detected_items", {})
+            }
+
+        def decide_stage(tick):
+            if menu_recovery.active:
+                return None
+            # 在动作完成后截取的画面：其分析结果即为这些动作的执行结果
+            while pending_evaluations and tick["captured_at"] >= pending_evaluations[0]["finished_at"]:
+                evaluate_action(pending_evaluations.popleft(), tick["game_state"])
+
+            # 3. AI决策 (超时控制)：从截图起到目标延迟为止剩余的时间作为分层决策的预算，
+            # 不随截图频率缩短，否则频率升高后LLM层永远拿不到足够的预算
+            tick_interval = pacer.tick_interval
+            ai_timeout = pacer.decision_budget(tick["captured_at"])
+            action_start = time.time()
+            action = decision_worker.resolve(tick["game_state"], time_budget=ai_timeout)
+            ai_time = time.time() - action_start
+            decision = ai.last_decision
+            logger.debug("决策完成", tier=decision['tier'], elapsed=round(decision['elapsed'], 3), budget=round(decision['budget'], 2))
+            
+            # 根据AI响应时间占节拍的比例调整分数（1次/秒时即原来的0.8s/0.3s）
+            if ai_time > 0.8 * tick_interval:
+                game_stats["score"] -= 1
+                logger.debug("响应过慢 -1分", ai_time=round(ai_time, 3))
+            elif ai_time < 0.3 * tick_interval:
+                game_stats["score"] += 1
+                logger.debug("响应迅速 +1分", ai_time=round(ai_time, 3))
+            tick["action"] = action
+            return tick
+
+        def act_stage(tick):
+            if menu_recovery.active:
+                return None
+            game_state = tick["game_state"]
+            action = tick["action"]
+
+            # 4. 执行操作
+            try:
+                # 动作执行后的画面通常与当前画面接近，以当前状态作为预测的下一状态提前推理
+                decision_worker.speculate(game_state)
+                # 操作在输入调度线程中执行，这里只等待按键松开，执行结果由之后的画面评估
+                action_handle = controller.execute_action(action)
+                action_handle.wait(timeout=2.0)
+                pending_evaluations.append({"game_state": game_state, "action": action, "finished_at": time.time()})
+            except Exception as e:
+                logger.warning("执行过程中发生错误，执行操作失败 -5分: %s", e, action=action)
+                game_stats["score"] -= 5
+                ai.feedback_failure(game_state, action)
+                game_stats['score'] -= 1
+
+            # 记录截图到动作完成的延迟，按节奏控制的结果调整截图频率
+            latency = time.time() - tick["captured_at"]
+            pacer.record_tick(latency)
+            profiler.record_tick(tick["captured_at"], latency)
+            pipeline.set_tick_rate(pacer.tick_rate)
+            ticks_counter.inc()
+            tick_latency.record(latency)
+            score_gauge.set(game_stats["score"])
+            tick_rate_gauge.set(pacer.tick_rate)
+            scale_gauge.set(pacer.analysis_scale)
+            return tick
+
+        pipeline = Pipeline(tick_rate=pacer.tick_rate, queue_size=args.queue_size, observer=observe_stage)
+        pipeline.add_stage("capture", profiler.wrap("capture", capture_stage))
+        pipeline.add_stage("analyze", profiler.wrap("analyze", analyze_stage))
+        pipeline.add_stage("decide", profiler.wrap("decide", decide_stage))
+        display_queue = pipeline.add_stage("act", profiler.wrap("act", act_stage))
+
+        # 内存预算：后台估算各组件占用，进程内存超出预算时清空可重建的缓存
+        memory_budget = MemoryBudget(args.memory_budget, interval=args.memory_interval)
+        memory_budget.register("prompt_cache", lambda: ai.prompt_cache.entries, trim=ai.prompt_cache.clear)
+        memory_budget.register("learning_table", lambda: ai.learning_memory)
+        memory_budget.register("pipeline_queues", lambda: [queue.items for queue in pipeline.queues])
+        memory_budget.register("decision_state", lambda: [ai.last_state, ai.plan_state, ai.action_plan,
+                                                          pending_evaluations, decision_worker.pending])
+        memory_budget.register("profiler", lambda: [profiler.samples, profiler.recent])
+        memory_budget.register("metrics", lambda: [getattr(metric, "counts", None)
+                                                   for metric in list(registry.metrics.values())])
+        pipeline.start()
         
+        # 退出请求：ESC、信号、运行时长上限或游戏胜利
+        if stop_event is None:
+            stop_event = threading.Event()
+
+        def request_stop(signum, frame):
+            nonlocal exit_reason
+            exit_reason = exit_reason or f"signal:{signal.Signals(signum).name}"
+            stop_event.set()
+
+        if args.headless:
+            install_signal_handlers(request_stop)
+            logger.info("无人值守模式：不显示画面，收到SIGINT/SIGTERM时退出")
+
         try:
-            while True:
-                frame_count += 1
-                loop_start = time.time()
-                
+            # 主线程只负责显示画面和处理退出（OpenCV窗口必须在主线程中操作）
+            loop_errors = 0
+            while not stop_event.is_set():
                 try:
-                    # 1. 捕获游戏画面
-                    frame = capture.capture_frame()
-                    if frame is None:
-                        time.sleep(0.1)
-                        continue
-
-                    # 2. 分析环境
-                    game_state = analyzer.analyze_frame(frame)
-                    state_desc = game_state["description_cn"]
-                    
-                    # 更新游戏统计
-                    if "村庄" in state_desc or "神殿" in state_desc or "密室" in state_desc:
-                        game_stats["structures_found"] += 1
-                    
-                    # 检查是否打开了菜单
-                    is_menu = analyzer.is_menu_open(frame)
-                    if is_menu:
-                        print("检测到菜单已打开，尝试关闭...")
-                        
-                        # 确保游戏窗口被激活
-                        try:
-                            import win32gui
-                            hwnd = win32gui.FindWindow(None, win32gui.GetWindowText(win32gui.GetForegroundWindow()))
-                            if hwnd:
-                                win32gui.SetForegroundWindow(hwnd)
-                                print("已激活游戏窗口")
-                                time.sleep(0.5)  # 等待窗口激活
-                        except Exception as e:
-                            print(f"激活窗口时出错: {e}")
-                        
-                        # 执行回到游戏操作
-                        controller.execute_action("回到游戏")
-                        
-                        # 增加等待时间至10秒，确保回到游戏操作完成
-                        time.sleep(10)
-                        
-                        # 多次检查菜单是否关闭，最多重试3次
-                        retry_count = 0
-                        max_retries = 3
-                        while retry_count < max_retries:
-                            new_frame = capture.capture_frame()
-                            if new_frame is None:
-                                print("无法捕获新画面，重试...")
-                                time.sleep(2)
-                                retry_count += 1
-                                continue
-                            
-                            if analyzer.is_menu_open(new_frame):
-                                print(f"菜单仍然打开，第{retry_count+1}次尝试关闭...")
-                                controller.execute_action("回到游戏")
-                                time.sleep(5)
-                                retry_count += 1
-                            else:
-                                print("菜单已成功关闭")
-                                break
-                        
-                        if retry_count >= max_retries:
-                            print("多次尝试关闭菜单失败，继续执行...")
-                        
+                    # 截图或分析持续出错时不空转：以运行时错误退出，由守护进程或编排进程重启
+                    failing_stage = pipeline.failing_stage(args.max_consecutive_errors) \
+                        if args.max_consecutive_errors else None
+                    if failing_stage is not None:
+                        logger.error("流水线阶段连续出错，准备退出", stage=failing_stage, errors=args.max_consecutive_errors)
+                        exit_reason = f"stage_errors:{failing_stage}"
+                        exit_code = EXIT_RUNTIME_ERROR
+                        break
+                    tick = display_queue.get(timeout=0.05)
+                    if args.max_runtime and time.time() - start_time >= args.max_runtime:
+                        logger.info("达到运行时长上限，准备退出...")
+                        exit_reason = "max_runtime"
+                        break
+                    if args.headless:
+                        # 只消费执行阶段的输出，不显示画面、不轮询按键
+                        if game_stats["score"] >= 10000:
+                            logger.info("恭喜！击败末影龙！游戏胜利！")
+                            exit_reason = "victory"
+                            break
+                        loop_errors = 0
                         continue
 
-                    # 检查是否为夜晚
-                    is_night = analyzer.is_night(frame)
-                    if is_night:
-                        print("当前为夜晚模式，调整视觉分析参数...")
-                        # 可以在这里调整AI决策参数以适应夜晚环境
-                        game_state["is_night"] = True
-                    else:
-                        game_state["is_night"] = False
-
-                    # 3. AI决策 (超时控制)
-                    ai_timeout = max(0, 1.0 - game_state.get("processing_time", 0.0))
-                    action_start = time.time()
-                    action = ai.get_action(game_state)
-                    ai_time = time.time() - action_start
-                    
-                    # 根据AI响应时间调整分数
-                    if ai_time > 0.8:
-                        game_stats["score"] -= 1
-                        print("响应过慢 -1分")
-                    elif ai_time < 0.3:
-                        game_stats["score"] += 1
-                        print("响应迅速 +1分")
-                    
-                    # 4. 执行操作
-                    new_game_state = None
-                    try:
-                        previous_health = game_state.get('health', 20)
-                        controller.execute_action(action)
-
-                        # 5. 获取执行后的游戏状态
-                        new_frame = capture.capture_frame()
-                        new_game_state = analyzer.analyze_frame(new_frame)
-                    except Exception as e:
-                        print(f"执行过程中发生错误: {e}")
-                        game_stats["score"] -= 5
-                        print("执行操作失败 -5分")
-                    finally:
-                        # 确保资源正确释放
-                        pass
-
-                    # 检查new_game_state是否被成功创建
-                    success = False
-                    if new_game_state is not None:
-                        current_health = new_game_state.get('health', 20)
-                        success = True
-                        
-                        # 判断失败条件：生命值降低或跌落
-                        if current_health < previous_health:
-                            success = False
-                            game_stats['deaths'] += 1
-                            print(f"动作失败：生命值减少 {previous_health - current_health}")
-                        elif '跌落' in new_game_state['description_cn']:
-                            success = False
-                            print("动作失败：发生跌落")
-                    else:
-                        print("未能获取新游戏状态，动作失败")
-                    
-                    # 判断成功条件：发现新结构或获取物品
-                    if new_game_state is not None and (new_game_state['detected_structures'] or new_game_state['detected_items']):
-                        success = True
-                        print("动作成功：发现新结构或物品")
-                    
-                    # 更新学习记忆
-                    if success:
-                        ai.feedback_success()
-                        game_stats['score'] += 2
-                    else:
-                        ai.feedback_failure()
-                        game_stats['score'] -= 1
-                    
-                    # 5. 学习系统 - 评估行动结果
-                    if last_state:
-                        # 简单的评估：如果状态改善则视为成功
-                        current_resources = sum(game_state["ratios"].values())
-                        last_resources = sum(last_state["ratios"].values())
-
-                        if current_resources > last_resources:
-                            ai.feedback_success()
-                            print("行动成功 - 已记录")
-                        elif "死亡" in state_desc:  # 简化死亡检测
-                            ai.feedback_failure()
-                            game_stats["deaths"] += 1
-                            game_stats["score"] -= 10
-                            print("死亡 -10分")
-                    
-                    # 保存当前状态用于下次评估
-                    last_state = {
-                        "situation_hash": ai.create_situation_hash(game_state),
-                        "ratios": game_state["ratios"],
-                        "structures": game_state.get("detected_structures", {}),
-                        "inventory": game_state.get("detected_items", {})
-                    }
-                    
-                    # 6. 显示画面
-                    display_text = f"{state_desc} | 操作: {action} | 分数: {game_stats['score']}"
-                    display_frame = put_chinese_text(
-                        frame, display_text, (10, 30),
-                        chinese_font, 16, (255, 255, 255)
-                    )
-                    cv2.imshow("Minecraft AI", display_frame)
+                    if tick is not None and pacer.optional_enabled("display"):
+                        # 6. 显示画面
+                        with profiler.stage("display"):
+                            display_text = f"{tick['game_state']['description_cn']} | 操作: {tick['action']} | 分数: {game_stats['score']}"
+                            display_frame = put_chinese_text(
+                                tick["frame"], display_text, (10, 30),
+                                chinese_font, 16, (255, 255, 255)
+                            )
+                            cv2.imshow("Minecraft AI", display_frame)
                     
                     # 检查是否击败末影龙（简化版）
                     if game_stats["score"] >= 10000:
-                        print("恭喜！击败末影龙！游戏胜利！")
+                        logger.info("恭喜！击败末影龙！游戏胜利！")
+                        exit_reason = "victory"
                         break
 
                     # 按ESC退出
                     key = cv2.waitKey(1)
                     if key == 27:
-                        print("准备退出游戏...")
+                        logger.info("准备退出游戏...")
+                        exit_reason = "esc"
                         break
-                    
-                    # 控制循环频率
-                    loop_time = time.time() - loop_start
-                    if loop_time < 1.0:
-                        time.sleep(1.0 - loop_time)
+                    loop_errors = 0
                         
                 except KeyboardInterrupt:
-                    print("\n用户中断程序")
+                    logger.info("用户中断程序")
+                    exit_reason = "keyboard_interrupt"
                     break
                 except Exception as e:
-                    print(f"\n运行时错误: {e}")
-                    print(traceback.format_exc())
+                    logger.exception("运行时错误: %s", e)
+                    loop_errors += 1
+                    if args.max_consecutive_errors and loop_errors >= args.max_consecutive_errors:
+                        logger.error("主循环连续出错，准备退出", errors=loop_errors)
+                        exit_reason = "loop_errors"
+                        exit_code = EXIT_RUNTIME_ERROR
+                        break
                     time.sleep(1)
 
         finally:
-            cv2.destroyAllWindows()
+            pipeline.stop()
+            if not args.headless:
+                cv2.destroyAllWindows()
+            decision_worker.close()
+            ai.close()
+            menu_recovery.close()
+            controller.close()
+            capture.close()
+            if metrics_exporter is not None:
+                metrics_exporter.close()
+            profiler.close()
+            memory_budget.close()
+            memory_report = memory_budget.measure()
+            if checkpointer is not None:
+                checkpointer.close()
             total_time = time.time() - start_time
             fps = frame_count / total_time if total_time > 0 else 0
+            # 统计报告直接输出到控制台，先等队列中的日志写完，避免交错
+            flush_logging()
             print("\n===== 游戏统计 =====")
             print(f"总帧数: {frame_count}")
             print(f"平均FPS: {fps:.1f}")
             print(f"最终分数: {game_stats['score']}")
             print(f"死亡次数: {game_stats['deaths']}")
             print(f"发现结构: {game_stats['structures_found']}")
+            for stage_report in pipeline.get_stats():
+                print(f"阶段 {stage_report['stage']}: 处理 {stage_report['processed']}, 平均 {stage_report['avg_time'] * 1000:.0f}ms, "
+                      f"占用率 {stage_report['occupancy']:.0%}, 丢弃 {stage_report['queue_dropped']}, 跳过 {stage_report['skipped']}")
+            pacing_report = pacer.get_report()
+            if pacing_report["ticks"]:
+                print(f"帧节奏({pacing_report['preset']}): 延迟 p50/p95 {pacing_report['p50']:.2f}/{pacing_report['p95']:.2f}s, "
+                      f"目标 {pacing_report['target_latency']:.2f}s 达标率 {pacing_report['within_target_rate']:.0%}, "
+                      f"当前 {pacing_report['tick_rate']:.2f} 次/秒, 分析缩放 {pacing_report['analysis_scale']:.2f}, "
+                      f"可选阶段 {','.join(pacing_report['optional_stages']) or '关'}, 调整 {pacing_report['adjustments']} 次")
+            print(f"决策层级统计: {ai.tier_stats}")
+            input_stats = controller.get_input_stats()
+            if input_stats["count"]:
+                print(f"操作耗时(入队→松开) p50/p95: {input_stats['p50']:.2f}/{input_stats['p95']:.2f}s")
+            print(f"推测式决策统计: {decision_worker.stats}")
+            recovery_report = menu_recovery.get_report()
+            print(f"菜单恢复: 成功 {recovery_report['recovered']}/{recovery_report['attempts']}")
+            for name, method_report in recovery_report["methods"].items():
+                if method_report["successes"]:
+                    print(f"  {name}: 成功 {method_report['successes']}/{method_report['tries']}, "
+                          f"恢复耗时 p50/p95 {method_report['p50']:.2f}/{method_report['p95']:.2f}s")
+            plan_report = ai.get_plan_report()
+            print(f"LLM调用: {plan_report['llm_calls']} 次 ({plan_report['llm_calls_per_minute']:.1f} 次/分钟)")
+            print(f"计划完成率: {plan_report['plan_completion_rate']:.0%} (完成 {plan_report['plans_completed']}/{plan_report['plans_created']}, 作废 {plan_report['plans_invalidated']})")
+            latency_report = ai.get_latency_report()
+            if latency_report["count"]:
+                print(f"LLM延迟 p50/p95/p99: {latency_report['p50']:.2f}/{latency_report['p95']:.2f}/{latency_report['p99']:.2f}s, 当前超时: {latency_report['timeout']:.2f}s")
+            print(f"熔断器: {latency_report['breaker_states']} (熔断 {latency_report['opened']} 次, 拒绝 {latency_report['rejected']} 次)")
+            for backend_report in ai.get_backend_report():
+                if backend_report["count"]:
+                    print(f"后端 {backend_report['backend']}: 请求 {backend_report['requests']}, 胜出率 {backend_report['win_rate']:.0%}, "
+                          f"对冲 {backend_report['hedged']}, 取消 {backend_report['cancelled']}, "
+                          f"p50/p95 {backend_report['p50']:.2f}/{backend_report['p95']:.2f}s")
+            prefill_report = ai.get_prefill_report()
+            print(f"平均提示词tokens: {prefill_report['avg_prompt_tokens']:.1f}, 平均预填充耗时: {prefill_report['avg_prompt_eval_time'] * 1000:.1f}ms (前缀复用: {prefill_report['prefix_reused']})")
+            if profiler.enabled:
+                profile_report = profiler.get_report()
+                print(f"性能剖析({profile_report['mode']}): {profile_report['ticks']} 帧, 采样 {profile_report['samples']}, "
+                      f"慢帧 {profile_report['slow_ticks']} (写出 {profile_report['slow_dumps']}), "
+                      f"文件 {profile_report['files']} → {profile_report['output_dir']}")
+            if memory_report["rss"] is not None:
+                print(f"内存: RSS {memory_report['rss'] / 1024 / 1024:.0f}MB (峰值 {memory_report['peak_rss'] / 1024 / 1024:.0f}MB), "
+                      f"超出预算 {memory_report['over_budget']} 次")
+            print("内存占用: " + ", ".join(f"{name} {size / 1024:.0f}KB" for name, size in memory_report["components"].items())
+                  + f", 提示词缓存 {ai.prompt_cache.get_stats()}")
+            logging_stats = get_logging_stats()
+            if checkpointer is not None:
+                checkpoint_report = checkpointer.get_report()
+                print(f"检查点: {checkpoint_report['checkpoints']} 次, 写入 {checkpoint_report['writes']} 个文件 "
+                      f"(未变化跳过 {checkpoint_report['unchanged']}), 共 {checkpoint_report['bytes'] / 1024:.0f}KB, "
+                      f"平均/最大耗时 {checkpoint_report['avg_time'] * 1000:.1f}/{checkpoint_report['max_time'] * 1000:.1f}ms")
+            print(f"日志: 丢弃 {logging_stats['dropped']}, 重复省略 {logging_stats['suppressed']}")
             print("===================")
+            if args.stats_file:
+                write_stats_file(args.stats_file, {
+                    "instance_id": args.instance_id,
+                    "exit_code": exit_code,
+                    "exit_reason": exit_reason or ("stop_requested" if stop_event.is_set() else "unknown"),
+                    "runtime": total_time,
+                    "frames": frame_count,
+                    "fps": fps,
+                    "game_stats": game_stats,
+                    "stages": pipeline.get_stats(),
+                    "pacing": pacing_report,
+                    "tiers": ai.tier_stats,
+                    "plan": plan_report,
+                    "menu_recovery": recovery_report,
+                    "checkpoint": checkpointer.get_report() if checkpointer is not None else None,
+                    "memory": memory_report,
+                    "metrics": registry.snapshot()
+                })
             
     except Exception as e:
-        print(f"\n主程序错误: {e}")
-        print(traceback.format_exc())
+        logger.exception("主程序错误: %s", e)
+        exit_code = EXIT_RUNTIME_ERROR
     finally:
-        input("按Enter键退出...")
+        shutdown_logging()
+        if not args.headless:
+            input("按Enter键退出...")
+    return exit_code
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,205 @@
+# memory_budget.py
+import ctypes
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+from app_logging import get_logger
+from metrics import registry
+
+logger = get_logger("memory_budget")
+
+
+def deep_sizeof(obj, max_objects=200000):
+    """估算对象及其包含的字典、列表、集合、字符串和numpy数组占用的字节数，同一对象只计一次
+
+    只展开内置容器，其它对象只计对象本身；最多访问max_objects个对象，限制估算本身的开销。
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack and len(seen) < max_objects:
+        item = stack.pop()
+        if item is None or id(item) in seen:
+            continue
+        seen.add(id(item))
+        nbytes = getattr(item, "nbytes", None)
+        if isinstance(nbytes, int):
+            # numpy数组：视图的getsizeof不含数据，取两者中较大的
+            total += max(sys.getsizeof(item), nbytes)
+            continue
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            for key, value in list(item.items()):
+                stack.append(key)
+                stack.append(value)
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(list(item))
+    return total
+
+
+def process_rss():
+    """当前进程的常驻内存(字节)：优先psutil，其次Linux的/proc和Windows的GetProcessMemoryInfo，都不可用时返回None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if sys.platform == "win32":
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+    return None
+
+
+class BoundedCache:
+    """容量有上限的LRU缓存，可选过期时间
+
+    超过max_entries时淘汰最久未使用的条目；过期条目在读取时删除，并随LRU淘汰自然清出。
+    """
+
+    def __init__(self, max_entries=256, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # {键: (写入时间, 值)}
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return default
+            if self.ttl is not None and time.time() - entry[0] >= self.ttl:
+                del self.entries[key]
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return default
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_stats(self):
+        return dict(self.stats, entries=len(self.entries), max_entries=self.max_entries)
+
+
+class MemoryBudget:
+    """按组件统计内存占用，进程内存超过预算时收缩缓存
+
+    各组件用register()登记一个返回其数据的函数（和可选的收缩函数），后台线程按间隔估算各组件的大小
+    并更新memory_bytes{component}指标；进程RSS超过budget_mb时调用各收缩函数并记录警告。
+    估算在后台线程中不加锁进行，恰好遇到决策线程修改字典时跳过该组件，下次再估算。
+    """
+
+    def __init__(self, budget_mb=0, interval=30.0):
+        """
+        Args:
+            budget_mb (float): 进程内存预算(MB)，0表示只统计不收缩
+            interval (float): 统计间隔(秒)
+        """
+        self.budget_bytes = budget_mb * 1024 * 1024
+        self.interval = interval
+        self.components = {}  # {名称: (数据函数, 收缩函数)}
+        self.sizes = {}  # {名称: 最近一次估算的字节数}
+        self.rss = None
+        self.peak_rss = 0
+        self.stats = {"measurements": 0, "skipped": 0, "over_budget": 0, "trims": 0, "measure_time": 0.0}
+        self.rss_gauge = registry.gauge("process_rss_bytes", "进程常驻内存(字节)")
+        self.gauges = {}
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="MemoryBudget", daemon=True)
+        self.thread.start()
+
+    def register(self, name, collect, trim=None):
+        """登记一个组件
+
+        Args:
+            collect: 无参数函数，返回该组件持有的数据（字典、列表、numpy数组等）
+            trim: 超出预算时调用的无参数函数，例如清空缓存
+        """
+        self.components[name] = (collect, trim)
+        self.gauges[name] = registry.gauge("memory_bytes", "各组件估算的内存占用(字节)", {"component": name})
+
+    def measure(self):
+        """估算各组件大小和进程RSS，超出预算时收缩，返回报告"""
+        start = time.perf_counter()
+        for name, (collect, trim) in list(self.components.items()):
+            try:
+                size = deep_sizeof(collect())
+            except RuntimeError:
+                # 估算期间字典被其它线程修改
+                self.stats["skipped"] += 1
+                continue
+            self.sizes[name] = size
+            self.gauges[name].set(size)
+        self.rss = process_rss()
+        if self.rss is not None:
+            self.peak_rss = max(self.peak_rss, self.rss)
+            self.rss_gauge.set(self.rss)
+            if self.budget_bytes and self.rss > self.budget_bytes:
+                self.stats["over_budget"] += 1
+                self._trim()
+        self.stats["measurements"] += 1
+        self.stats["measure_time"] += time.perf_counter() - start
+        return self.get_report()
+
+    def _trim(self):
+        trimmed = [name for name, (collect, trim) in self.components.items() if trim is not None]
+        for name in trimmed:
+            try:
+                self.components[name][1]()
+            except Exception as e:
+                logger.warning("收缩缓存失败: %s", e, component=name)
+        self.stats["trims"] += 1
+        logger.warning("进程内存超出预算，已收缩缓存", rss_mb=round(self.rss / 1024 / 1024, 1),
+                       budget_mb=round(self.budget_bytes / 1024 / 1024, 1), components=",".join(trimmed))
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.measure()
+            except Exception as e:
+                logger.warning("统计内存占用失败: %s", e)
+
+    def get_report(self):
+        return dict(self.stats, components=dict(self.sizes), rss=self.rss, peak_rss=self.peak_rss,
+                    budget=self.budget_bytes or None)
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join(timeout=2)
@@ -0,0 +1,163 @@
+# menu_recovery.py
+import threading
+import time
+
+from app_logging import get_logger
+from llm_health import LatencyHistogram
+
+logger = get_logger("menu_recovery")
+
+
+class MenuRecovery:
+    """事件驱动的菜单恢复状态机
+
+    检测到菜单后在后台线程中按代价从低到高依次尝试关闭菜单：ESC键 → 点击回到游戏按钮 → 运行mchd.exe。
+    每种方法执行后以截图频率轮询快速菜单检测，菜单一消失立即结束，不再固定等待；
+    超过该方法的等待上限仍未关闭才换下一种方法。每种方法执行前都重新检测一次，
+    菜单已经关闭（或检测是误报）时立即结束，避免ESC反而打开暂停菜单。每种方法的恢复耗时都会记录下来。
+    """
+
+    IDLE = "idle"
+    RECOVERING = "recovering"
+
+    # 方法按代价从低到高排列，值为该方法执行后等待菜单关闭的上限(秒)
+    METHODS = (("esc", 1.0), ("click", 2.0), ("exe", 15.0))
+
+    def __init__(self, controller, capture, analyzer, poll_interval=0.05, retry_cooldown=5.0):
+        """
+        Args:
+            controller: GameController
+            capture: MinecraftScreenCapture
+            analyzer: GameStateAnalyzer
+            poll_interval (float): 轮询菜单检测的间隔(秒)
+            retry_cooldown (float): 所有方法都失败后，再次尝试前的冷却时间(秒)
+        """
+        self.controller = controller
+        self.capture = capture
+        self.analyzer = analyzer
+        self.poll_interval = poll_interval
+        self.retry_cooldown = retry_cooldown
+
+        self.state = self.IDLE
+        self.current_method = None
+        self.lock = threading.Lock()
+        self.thread = None
+        self.last_failure_time = 0
+        self.stats = {"attempts": 0, "recovered": 0, "failed": 0, "already_closed": 0}
+        self.method_stats = {
+            name: {"tries": 0, "successes": 0, "latency": LatencyHistogram()}
+            for name, _ in self.METHODS
+        }
+        # 每次恢复从检测到菜单到菜单关闭的总耗时
+        self.recovery_histogram = LatencyHistogram()
+
+    @property
+    def active(self):
+        return self.state == self.RECOVERING
+
+    def start(self):
+        """开始后台恢复（已在恢复中或处于失败冷却期时忽略），返回是否启动"""
+        with self.lock:
+            if self.state == self.RECOVERING:
+                return False
+            if time.time() - self.last_failure_time < self.retry_cooldown:
+                return False
+            self.state = self.RECOVERING
+        self.thread = threading.Thread(target=self._recover, name="MenuRecovery", daemon=True)
+        self.thread.start()
+        return True
+
+    def _menu_open(self):
+        frame = self.capture.capture_frame()
+        if frame is None:
+            return True
+        return self.analyzer.is_menu_open_fast(frame)
+
+    def _wait_closed(self, deadline, process=None):
+        """轮询菜单检测直到菜单关闭或超过deadline；exe方法时进程退出后再做最后一次检测"""
+        while time.time() < deadline:
+            if not self._menu_open():
+                return True
+            if process is not None and process.poll() is not None:
+                # exe已经执行完，给游戏一次轮询间隔的时间刷新画面
+                time.sleep(self.poll_interval)
+                return not self._menu_open()
+            time.sleep(self.poll_interval)
+        return False
+
+    def _activate_window(self):
+        tracker = getattr(self.capture, "tracker", None)
+        if tracker is not None and not tracker.focused:
+            tracker.activate()
+
+    def _run_method(self, name):
+        """执行一种恢复方法，返回exe方法启动的进程（其它方法返回None）"""
+        if name == "esc":
+            self.controller.execute_action("esc").wait(timeout=1.0)
+        elif name == "click":
+            self.controller._click_back_to_game(self.capture.game_region)
+        elif name == "exe":
+            return self.controller.start_back_to_game_exe()
+        return None
+
+    def _recover(self):
+        recovery_start = time.time()
+        self.stats["attempts"] += 1
+        recovered = False
+        try:
+            self._activate_window()
+            for name, max_wait in self.METHODS:
+                if not self._menu_open():
+                    recovered = True
+                    self.stats["already_closed"] += 1
+                    logger.info("菜单已关闭，不再执行恢复方法", method=name)
+                    break
+                self.current_method = name
+                method_stats = self.method_stats[name]
+                method_stats["tries"] += 1
+                method_start = time.time()
+                process = None
+                try:
+                    process = self._run_method(name)
+                    if name == "exe" and process is None:
+                        continue
+                    recovered = self._wait_closed(method_start + max_wait, process)
+                except Exception as e:
+                    logger.warning("菜单恢复方法出错: %s", e, method=name)
+                finally:
+                    if process is not None and process.poll() is None:
+                        process.kill()
+
+                if recovered:
+                    elapsed = time.time() - method_start
+                    method_stats["successes"] += 1
+                    method_stats["latency"].record(elapsed)
+                    logger.info("菜单已关闭", method=name, seconds=round(elapsed, 2))
+                    break
+                logger.info("未能关闭菜单，尝试下一种方法...", method=name)
+        finally:
+            self.current_method = None
+            with self.lock:
+                if recovered:
+                    self.stats["recovered"] += 1
+                    self.recovery_histogram.record(time.time() - recovery_start)
+                else:
+                    self.stats["failed"] += 1
+                    self.last_failure_time = time.time()
+                    logger.warning("所有方法都未能关闭菜单，%.0f秒后重试", self.retry_cooldown)
+                self.state = self.IDLE
+
+    def get_report(self):
+        """各恢复方法的成功次数和恢复耗时"""
+        return {
+            **self.stats,
+            **{f"total_{key}": value for key, value in self.recovery_histogram.summary().items()},
+            "methods": {
+                name: {"tries": stats["tries"], "successes": stats["successes"], **stats["latency"].summary()}
+                for name, stats in self.method_stats.items()
+            }
+        }
+
+    def close(self):
+        if self.thread is not None:
+            self.thread.join(timeout=1)
@@ -0,0 +1,288 @@
+# metrics.py
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app_logging import get_logger
+
+logger = get_logger("metrics")
+
+# Prometheus直方图导出时使用的桶上限(秒)
+EXPORT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    """只增不减的计数器"""
+
+    kind = "counter"
+
+    def __init__(self, name, help="", labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """可任意设置的瞬时值"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help="", labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    """HDR风格的延迟直方图
+
+    以微秒为单位，每个2的幂区间再等分为16个桶（相对误差约6%），桶按需创建，
+    记录一次只需一次整数运算和一次字典加法，不加锁、不分配大数组；
+    多线程同时记录时偶尔丢失一次计数，对统计结果没有影响。
+    """
+
+    kind = "histogram"
+    SUB_BUCKET_BITS = 4
+
+    def __init__(self, name, help="", labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.counts = {}  # {桶序号: 次数}
+        self.count = 0
+        self.sum = 0.0
+
+    def _index(self, micros):
+        shift = max(0, micros.bit_length() - self.SUB_BUCKET_BITS - 1)
+        return (shift << self.SUB_BUCKET_BITS) + (micros >> shift)
+
+    def _upper_bound(self, index):
+        """桶序号对应的取值上限(秒)"""
+        sub = 1 << self.SUB_BUCKET_BITS
+        shift = max(0, (index >> self.SUB_BUCKET_BITS) - 1) if index >= 2 * sub else 0
+        mantissa = index - (shift << self.SUB_BUCKET_BITS)
+        return ((mantissa + 1) << shift) / 1e6
+
+    def record(self, seconds):
+        micros = int(seconds * 1e6) if seconds > 0 else 0
+        # 与_index相同的计算，内联以减少热路径上的函数调用
+        shift = micros.bit_length() - 5
+        if shift < 0:
+            shift = 0
+        index = (shift << 4) + (micros >> shift)
+        counts = self.counts
+        counts[index] = counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += seconds
+
+    def time(self):
+        """计时上下文：with histogram.time(): ..."""
+        return _Timer(self)
+
+    def percentile(self, p):
+        total = self.count
+        if not total:
+            return None
+        target = total * p / 100
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return self._upper_bound(index)
+        return self._upper_bound(max(self.counts))
+
+    def cumulative(self, bounds=EXPORT_BUCKETS):
+        """各桶上限以内的累计次数，用于Prometheus导出"""
+        items = sorted((self._upper_bound(index), count) for index, count in list(self.counts.items()))
+        result = []
+        seen = 0
+        position = 0
+        for bound in bounds:
+            while position < len(items) and items[position][0] <= bound:
+                seen += items[position][1]
+                position += 1
+            result.append((bound, seen))
+        return result
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99)
+        }
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    """指标注册表：按名称和标签获取（首次调用时创建）计数器、瞬时值和直方图
+
+    各模块在初始化时取得指标对象并保存，热路径上只调用inc/set/record，不做任何I/O；
+    导出（Prometheus文本、JSONL快照）在单独的线程中进行。
+    """
+
+    def __init__(self, prefix="minecraft_ai"):
+        self.prefix = prefix
+        self.metrics = {}  # {(名称, 标签元组): 指标}
+        self.const_labels = {}  # 导出时附加到所有指标上的标签，例如多实例运行时的实例ID
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels):
+        key = (name, tuple(sorted((labels or {}).items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = cls(f"{self.prefix}_{name}", help, labels)
+                    self.metrics[key] = metric
+        return metric
+
+    def counter(self, name, help="", labels=None):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help="", labels=None):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help="", labels=None):
+        return self._get(Histogram, name, help, labels)
+
+    def set_const_labels(self, **labels):
+        self.const_labels = dict(labels)
+
+    def _format_labels(self, labels, extra=None):
+        items = list(self.const_labels.items()) + list(labels.items()) + list((extra or {}).items())
+        if not items:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+    def render_prometheus(self):
+        """Prometheus文本格式"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        described = set()
+        for metric in sorted(metrics, key=lambda m: m.name):
+            if metric.name not in described:
+                described.add(metric.name)
+                if metric.help:
+                    lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if metric.kind == "histogram":
+                for bound, count in metric.cumulative():
+                    lines.append(f"{metric.name}_bucket{self._format_labels(metric.labels, {'le': bound})} {count}")
+                lines.append(f"{metric.name}_bucket{self._format_labels(metric.labels, {'le': '+Inf'})} {metric.count}")
+                lines.append(f"{metric.name}_sum{self._format_labels(metric.labels)} {metric.sum}")
+                lines.append(f"{metric.name}_count{self._format_labels(metric.labels)} {metric.count}")
+            else:
+                lines.append(f"{metric.name}{self._format_labels(metric.labels)} {metric.value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """所有指标当前值的字典，键为"名称{标签}" """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name + self._format_labels(metric.labels): metric.snapshot() for metric in metrics}
+
+
+# 进程内共用的注册表
+registry = MetricsRegistry()
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path not in ("/metrics", "/"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsExporter:
+    """在后台线程中导出指标：本机Prometheus文本接口和定期写入的JSONL快照"""
+
+    def __init__(self, metrics_registry=None, host="127.0.0.1", port=9108, snapshot_path=None, snapshot_interval=10.0):
+        """
+        Args:
+            port (int): Prometheus接口端口，0表示不启动HTTP接口
+            snapshot_path (str): JSONL快照文件路径，None表示不写快照
+            snapshot_interval (float): 快照间隔(秒)
+        """
+        self.registry = metrics_registry or registry
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.server = None
+        self.threads = []
+        self.stop_event = threading.Event()
+
+        if port:
+            handler = type("MetricsHandler", (_MetricsRequestHandler,), {"registry": self.registry})
+            self.server = ThreadingHTTPServer((host, port), handler)
+            self.server.daemon_threads = True
+            self.threads.append(threading.Thread(target=self.server.serve_forever, name="MetricsHTTP", daemon=True))
+            logger.info("指标接口: http://%s:%s/metrics", host, self.server.server_address[1])
+        if snapshot_path:
+            self.threads.append(threading.Thread(target=self._snapshot_loop, name="MetricsSnapshot", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def write_snapshot(self):
+        with open(self.snapshot_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"time": time.time(), "metrics": self.registry.snapshot()}, ensure_ascii=False) + "\n")
+
+    def _snapshot_loop(self):
+        while not self.stop_event.wait(self.snapshot_interval):
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                logger.warning("写入指标快照失败: %s", e)
+
+    def close(self):
+        self.stop_event.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.snapshot_path:
+            # 退出前再写一次，保留最终数值
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                logger.warning("写入指标快照失败: %s", e)
@@ -0,0 +1,267 @@
+# ollama_stub.py
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 与DeepSeekAI.ACTION_MAP的取值保持一致
+STUB_ACTIONS = ["w", "s", "a", "d", "鼠标左移", "鼠标右移", "空格", "左键点击", "e"]
+
+
+class LatencyDistribution:
+    """可复现的延迟分布，格式如 "const:0.3"、"uniform:0.2,0.6"、"normal:0.4,0.1"、"lognormal:0.4,0.5"
+
+    lognormal的两个参数分别是中位数(秒)和形状参数sigma，适合模拟LLM的长尾延迟。
+    """
+
+    def __init__(self, spec="const:0.2", seed=0):
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p]
+        self.spec = spec
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sample(self):
+        with self.lock:
+            if self.kind == "const":
+                value = self.params[0]
+            elif self.kind == "uniform":
+                value = self.rng.uniform(self.params[0], self.params[1])
+            elif self.kind == "normal":
+                value = self.rng.gauss(self.params[0], self.params[1])
+            elif self.kind == "lognormal":
+                value = self.rng.lognormvariate(math.log(self.params[0]), self.params[1])
+            else:
+                raise ValueError(f"未知的延迟分布: {self.spec}")
+        return max(0.0, value)
+
+
+class OllamaStub:
+    """确定性的本地Ollama替身，实现/api/tags和/api/generate（流式和非流式）
+
+    用于在没有Ollama和GPU的机器上测试和压测local_ai.py：
+    延迟按配置的分布采样，可以在回复前插入<think>思考段，并按比例注入错误、卡死和断流。
+    同一个种子下的行为完全可复现。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, models=("deepseek-r1:8b",), latency="const:0.2",
+                 token_delay=0.005, think_tokens=0, error_rate=0.0, hang_rate=0.0, drop_rate=0.0,
+                 hang_time=30.0, seed=0):
+        """
+        Args:
+            port (int): 监听端口，0表示自动分配
+            latency (str): 首个token前的延迟分布（模拟预填充和排队）
+            token_delay (float): 每个输出token的延迟(秒)
+            think_tokens (int): 非JSON模式下在回复前输出的<think>思考段长度（token数）
+            error_rate (float): 返回HTTP 500的比例
+            hang_rate (float): 卡住hang_time秒才响应的比例
+            drop_rate (float): 流式输出中途断开连接的比例
+        """
+        self.models = list(models)
+        self.latency = LatencyDistribution(latency, seed)
+        self.token_delay = token_delay
+        self.think_tokens = think_tokens
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.drop_rate = drop_rate
+        self.hang_time = hang_time
+        self.rng = random.Random(seed + 1)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "hangs": 0, "drops": 0, "cancelled": 0}
+
+        handler = type("StubHandler", (_StubRequestHandler,), {"stub": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """在后台线程中启动服务，返回服务地址"""
+        self.thread = threading.Thread(target=self.server.serve_forever, name="OllamaStub", daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _roll_fault(self):
+        """按配置的比例决定本次请求注入哪种故障"""
+        with self.lock:
+            self.stats["requests"] += 1
+            roll = self.rng.random()
+        if roll < self.error_rate:
+            return "error"
+        if roll < self.error_rate + self.hang_rate:
+            return "hang"
+        if roll < self.error_rate + self.hang_rate + self.drop_rate:
+            return "drop"
+        return None
+
+    def build_response(self, body):
+        """根据请求确定性地生成回复文本（同一提示词总是得到同一动作）"""
+        prompt = body.get("prompt", "")
+        digest = hashlib.md5(prompt.encode("utf-8")).digest()
+        actions = [STUB_ACTIONS[b % len(STUB_ACTIONS)] for b in digest[:4]]
+
+        schema = body.get("format")
+        if isinstance(schema, dict) and "actions" in schema.get("properties", {}):
+            max_items = schema["properties"]["actions"].get("maxItems", 4)
+            return json.dumps({"actions": actions[:max_items]}, ensure_ascii=False)
+        if isinstance(schema, dict) or schema == "json":
+            return json.dumps({"action": actions[0]}, ensure_ascii=False)
+
+        text = " ".join(actions)
+        if self.think_tokens:
+            text = "<think>" + "嗯" * self.think_tokens + "</think>" + text
+        return text
+
+    def split_tokens(self, text):
+        """把回复切成近似token的片段（JSON和英文按4个字符，中文按1个字）"""
+        tokens = []
+        buffer = ""
+        for char in text:
+            buffer += char
+            if ord(char) > 127 or len(buffer) >= 4:
+                tokens.append(buffer)
+                buffer = ""
+        if buffer:
+            tokens.append(buffer)
+        return tokens
+
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stub = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        line = (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": name} for name in self.stub.models]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        stub = self.stub
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path != "/api/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        if body.get("model") not in stub.models:
+            self._send_json(404, {"error": f"model '{body.get('model')}' not found"})
+            return
+
+        # 只带model的请求是预加载/卸载，立即返回
+        if "prompt" not in body:
+            self._send_json(200, {"model": body["model"], "response": "", "done": True})
+            return
+
+        fault = stub._roll_fault()
+        if fault == "error":
+            with stub.lock:
+                stub.stats["errors"] += 1
+            self._send_json(500, {"error": "injected failure"})
+            return
+
+        first_token_delay = stub.latency.sample()
+        if fault == "hang":
+            with stub.lock:
+                stub.stats["hangs"] += 1
+            first_token_delay = stub.hang_time
+
+        # 带context时只有新增的后缀需要预填充
+        prompt = body.get("prompt", "")
+        prompt_tokens = max(1, len(prompt) // 2)
+        context = list(body.get("context") or []) + list(range(prompt_tokens))
+        text = stub.build_response(body)
+        tokens = stub.split_tokens(text)
+        num_predict = body.get("options", {}).get("num_predict")
+        if num_predict is not None and num_predict >= 0:
+            tokens = tokens[:num_predict]
+        final = {
+            "model": body["model"],
+            "done": True,
+            "context": context + list(range(len(tokens))),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(first_token_delay * 1e9),
+            "eval_count": len(tokens),
+            "eval_duration": int(len(tokens) * stub.token_delay * 1e9)
+        }
+
+        if not body.get("stream", True):
+            time.sleep(first_token_delay + len(tokens) * stub.token_delay)
+            self._send_json(200, dict(final, response="".join(tokens)))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            time.sleep(first_token_delay)
+            for index, token in enumerate(tokens):
+                if fault == "drop" and index == len(tokens) // 2:
+                    with stub.lock:
+                        stub.stats["drops"] += 1
+                    self.close_connection = True
+                    return
+                self._write_chunk({"model": body["model"], "response": token, "done": False})
+                time.sleep(stub.token_delay)
+            self._write_chunk(dict(final, response=""))
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端主动断开（例如对冲请求落败被取消）
+            with stub.lock:
+                stub.stats["cancelled"] += 1
+            self.close_connection = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="确定性的本地Ollama替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--models", default="deepseek-r1:8b", help="逗号分隔的模型名")
+    parser.add_argument("--latency", default="lognormal:0.4,0.5", help="首个token前的延迟分布")
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--think-tokens", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    stub = OllamaStub(args.host, args.port, args.models.split(","), args.latency, args.token_delay,
+                      args.think_tokens, args.error_rate, args.hang_rate, args.drop_rate, seed=args.seed)
+    print(f"Ollama替身已启动: {stub.url} (模型: {args.models}, 延迟: {args.latency})")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        print("Ollama替身退出")
+    finally:
+        stub.server.server_close()
@@ -0,0 +1,333 @@
+# orchestrator.py
+import argparse
+import json
+import multiprocessing
+import os
+import secrets
+import signal
+import sys
+import threading
+import time
+
+from app_logging import get_logger, setup_logging, shutdown_logging
+
+logger = get_logger("orchestrator")
+
+# 实例退出码（见main.py）：运行时错误时重启；导入或初始化失败重启也无济于事
+RESTART_EXIT_CODES = (1,)
+
+
+def plan_cpu_affinity(instances, cpu_count, reserved=1, cpus_per_instance=None):
+    """为每个实例分配CPU核心：前reserved个核心留给编排进程、推理代理和Ollama，
+    其余核心平均分给各实例，核心不够时实例之间循环共用"""
+    available = list(range(reserved, cpu_count)) or list(range(cpu_count))
+    per_instance = cpus_per_instance or max(1, len(available) // max(1, instances))
+    per_instance = min(per_instance, len(available))
+    plans = []
+    for index in range(instances):
+        start = index * per_instance
+        plans.append([available[(start + k) % len(available)] for k in range(per_instance)])
+    return plans
+
+
+def pin_to_cpus(cpus):
+    """把当前进程绑定到指定核心：优先使用psutil（Windows和Linux都支持），否则使用os.sched_setaffinity"""
+    try:
+        import psutil
+        psutil.Process().cpu_affinity(list(cpus))
+        return True
+    except ImportError:
+        pass
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, set(cpus))
+        return True
+    return False
+
+
+def run_instance(instance_id, argv, cpus, stop_event, store_key):
+    """实例进程入口：绑定CPU后以无人值守模式运行main，退出码作为进程退出码"""
+    os.environ["MINECRAFT_AI_STORE_KEY"] = store_key
+    if cpus:
+        try:
+            if not pin_to_cpus(cpus):
+                logger.warning("当前系统不支持绑定CPU（可安装psutil）", instance=instance_id)
+        except Exception as e:
+            logger.warning("绑定CPU失败: %s", e, instance=instance_id)
+    import main
+    sys.exit(main.main(argv, stop_event=stop_event))
+
+
+class AgentInstance:
+    """一个游戏窗口对应的实例进程及其重启记录"""
+
+    def __init__(self, instance_id, hwnd, title, argv, cpus, output_dir):
+        self.instance_id = instance_id
+        self.hwnd = hwnd
+        self.title = title
+        self.argv = argv
+        self.cpus = cpus
+        self.output_dir = output_dir
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.exit_codes = []
+        self.finished = False
+
+    @property
+    def stats_path(self):
+        return os.path.join(self.output_dir, "stats.json")
+
+
+class Orchestrator:
+    """多实例编排：每个Minecraft窗口启动一个实例进程
+
+    - 共享推理服务：在本进程中运行inference_broker，各实例的api_base指向它，按实例公平调度并合并相同请求
+    - 共享学习表：在单独的服务进程中运行learning_store，各实例上报动作结果并定期拉取合并后的学习表
+    - 每个实例绑定自己的窗口(截图区域、窗口消息输入)和CPU核心，指标带instance标签、使用独立端口
+    - 实例以运行时错误退出时自动重启，收到SIGINT/SIGTERM时通知所有实例正常退出
+    """
+
+    def __init__(self, windows, agent_args=(), output_dir="instances", backend_url="http://localhost:11434",
+                 broker_port=11500, batch_size=4, use_broker=True, metrics_base_port=9110,
+                 learning_data_path=None, pin_cpus=True, cpus_per_instance=None, reserved_cpus=1,
+                 max_restarts=3, restart_delay=5.0):
+        """
+        Args:
+            windows (list): [(hwnd, 标题)]，每个窗口一个实例
+            agent_args: 额外传给每个实例main.py的参数，例如["--pacing", "power-saver"]
+            metrics_base_port (int): 第i个实例的指标端口为metrics_base_port+i，0表示不启动指标接口
+            max_restarts (int): 每个实例的最大重启次数
+        """
+        self.windows = windows
+        self.agent_args = list(agent_args)
+        self.output_dir = output_dir
+        self.backend_url = backend_url
+        self.broker_port = broker_port
+        self.batch_size = batch_size
+        self.use_broker = use_broker
+        self.metrics_base_port = metrics_base_port
+        self.learning_data_path = learning_data_path or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "learning_data.json")
+        self.pin_cpus = pin_cpus
+        self.cpus_per_instance = cpus_per_instance
+        self.reserved_cpus = reserved_cpus
+        self.max_restarts = max_restarts
+        self.restart_delay = restart_delay
+
+        self.context = multiprocessing.get_context("spawn")
+        self.stop_event = self.context.Event()  # 通知所有实例退出
+        self.store_key = secrets.token_hex(16)
+        self.broker_server = None
+        self.broker = None
+        self.store = None  # 学习表服务进程中LearningStore的代理
+        self.store_manager = None
+        self.store_stats = None  # 停止服务前最后一次的学习表统计
+        self.instances = []
+
+    def _start_services(self):
+        from learning_store import start_learning_store
+        self.store_manager, self.store = start_learning_store(self.learning_data_path, authkey=self.store_key.encode(),
+                                                              ctx=self.context)
+        logger.info("共享学习表已启动", address=self.store_manager.address, path=self.learning_data_path)
+
+        if self.use_broker:
+            from inference_broker import create_broker_server
+            self.broker_server, self.broker = create_broker_server("127.0.0.1", self.broker_port, self.backend_url,
+                                                                   self.batch_size)
+            threading.Thread(target=self.broker_server.serve_forever, name="InferenceBroker", daemon=True).start()
+            logger.info("共享推理代理已启动", port=self.broker_port, backend=self.backend_url)
+
+    def _build_instances(self):
+        cpu_plans = plan_cpu_affinity(len(self.windows), os.cpu_count() or 1, self.reserved_cpus,
+                                      self.cpus_per_instance) if self.pin_cpus else [None] * len(self.windows)
+        api_base = f"http://127.0.0.1:{self.broker_port}" if self.use_broker else self.backend_url
+        host, port = self.store_manager.address
+        for index, ((hwnd, title), cpus) in enumerate(zip(self.windows, cpu_plans)):
+            instance_id = f"mc{index}"
+            instance_dir = os.path.join(self.output_dir, instance_id)
+            os.makedirs(instance_dir, exist_ok=True)
+            argv = [
+                "--headless",
+                "--instance-id", instance_id,
+                "--window-hwnd", str(hwnd),
+                "--input-backend", "window",
+                "--api-base", api_base,
+                "--learning-store", f"{host}:{port}",
+                "--metrics-port", str(self.metrics_base_port + index if self.metrics_base_port else 0),
+                "--stats-file", os.path.join(instance_dir, "stats.json"),
+                "--log-file", os.path.join(instance_dir, "agent.log"),
+                "--checkpoint-dir", os.path.join(instance_dir, "checkpoint"),
+            ] + self.agent_args
+            self.instances.append(AgentInstance(instance_id, hwnd, title, argv, cpus, instance_dir))
+
+    def _spawn(self, instance):
+        instance.process = self.context.Process(
+            target=run_instance,
+            args=(instance.instance_id, instance.argv, instance.cpus, self.stop_event, self.store_key),
+            name=f"Agent-{instance.instance_id}"
+        )
+        instance.process.start()
+        instance.started_at = time.time()
+        logger.info("实例已启动", instance=instance.instance_id, pid=instance.process.pid,
+                    window=instance.title, cpus=instance.cpus)
+
+    def start(self):
+        self._start_services()
+        self._build_instances()
+        for instance in self.instances:
+            self._spawn(instance)
+
+    def supervise(self, poll_interval=1.0):
+        """等待实例退出，按退出码决定是否重启；全部实例结束或收到退出请求时返回"""
+        while not self.stop_event.is_set():
+            running = 0
+            for instance in self.instances:
+                if instance.finished:
+                    continue
+                process = instance.process
+                if process.is_alive():
+                    running += 1
+                    continue
+                exit_code = process.exitcode
+                instance.exit_codes.append(exit_code)
+                if exit_code in RESTART_EXIT_CODES and instance.restarts < self.max_restarts:
+                    instance.restarts += 1
+                    logger.warning("实例异常退出，稍后重启", instance=instance.instance_id, exit_code=exit_code,
+                                   restarts=instance.restarts)
+                    if self.stop_event.wait(self.restart_delay):
+                        break
+                    self._spawn(instance)
+                    running += 1
+                else:
+                    instance.finished = True
+                    logger.info("实例已退出", instance=instance.instance_id, exit_code=exit_code)
+            if not running:
+                return
+            self.stop_event.wait(poll_interval)
+
+    def stop(self, timeout=15.0):
+        """通知所有实例正常退出，超时仍未退出的强制结束，然后关闭共享服务"""
+        self.stop_event.set()
+        deadline = time.time() + timeout
+        for instance in self.instances:
+            process = instance.process
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.time()))
+            if process.is_alive():
+                logger.warning("实例未在限定时间内退出，强制结束", instance=instance.instance_id)
+                process.terminate()
+                process.join(2)
+            if not instance.finished:
+                instance.exit_codes.append(process.exitcode)
+                instance.finished = True
+        if self.broker_server is not None:
+            self.broker_server.shutdown()
+            self.broker_server.server_close()
+            self.broker.close()
+        if self.store is not None:
+            from learning_store import stop_learning_store
+            self.store_stats = stop_learning_store(self.store_manager, self.store)
+            self.store = None
+
+    def get_report(self):
+        """各实例的重启次数、退出码和stats.json中的运行统计"""
+        reports = []
+        for instance in self.instances:
+            report = {
+                "instance": instance.instance_id,
+                "window": instance.title,
+                "cpus": instance.cpus,
+                "restarts": instance.restarts,
+                "exit_codes": instance.exit_codes
+            }
+            try:
+                with open(instance.stats_path, "r", encoding="utf-8") as f:
+                    stats = json.load(f)
+                report.update(frames=stats["frames"], fps=stats["fps"], score=stats["game_stats"]["score"],
+                              exit_reason=stats["exit_reason"])
+            except (OSError, ValueError, KeyError):
+                pass
+            reports.append(report)
+        return {
+            "instances": reports,
+            "broker": self.broker.get_stats() if self.broker is not None else None,
+            "learning_store": self.store.get_stats() if self.store is not None else self.store_stats
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="多个Minecraft窗口的多实例编排",
+                                     epilog="'--'之后的参数原样传给每个实例的main.py，例如: -- --pacing power-saver")
+    parser.add_argument("--instances", type=int, default=0, help="最多启动的实例数，0表示每个窗口一个")
+    parser.add_argument("--title-keyword", default="minecraft", help="窗口标题关键字")
+    parser.add_argument("--backend", default="http://localhost:11434", help="Ollama服务地址")
+    parser.add_argument("--broker-port", type=int, default=11500, help="共享推理代理端口")
+    parser.add_argument("--batch-size", type=int, default=4, help="推理代理同时发往Ollama的最大请求数")
+    parser.add_argument("--no-broker", action="store_true", help="不启动推理代理，各实例直接访问Ollama")
+    parser.add_argument("--metrics-base-port", type=int, default=9110, help="实例指标端口的起始值，0表示不启动")
+    parser.add_argument("--output-dir", default="instances", help="各实例的日志和统计输出目录")
+    parser.add_argument("--learning-data", default=None, help="共享学习表文件，默认为项目目录下的learning_data.json")
+    parser.add_argument("--no-pin", action="store_true", help="不绑定CPU核心")
+    parser.add_argument("--cpus-per-instance", type=int, default=None, help="每个实例绑定的核心数，默认平均分配")
+    parser.add_argument("--reserved-cpus", type=int, default=1, help="留给编排进程、推理代理和Ollama的核心数")
+    parser.add_argument("--max-restarts", type=int, default=3, help="每个实例异常退出后的最大重启次数")
+    if argv is None:
+        argv = sys.argv[1:]
+    agent_args = []
+    if "--" in argv:
+        index = argv.index("--")
+        argv, agent_args = argv[:index], argv[index + 1:]
+    args = parser.parse_args(argv)
+    args.agent_args = agent_args
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging("INFO")
+    try:
+        from window_tracker import find_game_windows
+        windows = find_game_windows(args.title_keyword)
+        if args.instances:
+            windows = windows[:args.instances]
+        if not windows:
+            logger.error("未找到Minecraft窗口")
+            return 1
+        logger.info("找到游戏窗口", count=len(windows), titles=[title for _, title in windows])
+
+        orchestrator = Orchestrator(
+            windows, args.agent_args, output_dir=args.output_dir, backend_url=args.backend,
+            broker_port=args.broker_port, batch_size=args.batch_size, use_broker=not args.no_broker,
+            metrics_base_port=args.metrics_base_port, learning_data_path=args.learning_data,
+            pin_cpus=not args.no_pin, cpus_per_instance=args.cpus_per_instance,
+            reserved_cpus=args.reserved_cpus, max_restarts=args.max_restarts
+        )
+
+        def request_stop(signum, frame):
+            logger.info("收到退出信号，通知所有实例退出...")
+            orchestrator.stop_event.set()
+
+        for name in ("SIGINT", "SIGTERM", "SIGBREAK"):
+            if hasattr(signal, name):
+                signal.signal(getattr(signal, name), request_stop)
+
+        orchestrator.start()
+        try:
+            orchestrator.supervise()
+        finally:
+            orchestrator.stop()
+        report = orchestrator.get_report()
+        for instance in report["instances"]:
+            logger.info("实例统计", **instance)
+        if report["broker"] is not None:
+            logger.info("推理代理统计", **{k: v for k, v in report["broker"].items() if not isinstance(v, dict)})
+        logger.info("共享学习表统计", **report["learning_store"])
+        failed = any(code not in (0, None) for instance in report["instances"] for code in instance["exit_codes"][-1:])
+        return 1 if failed else 0
+    finally:
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
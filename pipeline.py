@@ -0,0 +1,204 @@
+# pipeline.py
+import threading
+import time
+from collections import deque
+
+from app_logging import get_logger
+
+logger = get_logger("pipeline")
+
+
+class DropOldestQueue:
+    """有界队列：满时丢弃最旧的元素再放入新元素
+
+    画面和状态都是越新越有价值，下游处理不过来时宁可丢掉旧帧，也不让上游阻塞或延迟累积。
+    """
+
+    def __init__(self, maxsize=1, name="queue"):
+        self.name = name
+        self.maxsize = maxsize
+        self.items = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.stats = {"puts": 0, "gets": 0, "dropped": 0, "max_depth": 0}
+
+    def put(self, item):
+        """放入元素，返回被丢弃的旧元素（没有丢弃时返回None）"""
+        dropped = None
+        with self.condition:
+            if len(self.items) >= self.maxsize:
+                dropped = self.items.popleft()
+                self.stats["dropped"] += 1
+            self.items.append(item)
+            self.stats["puts"] += 1
+            self.stats["max_depth"] = max(self.stats["max_depth"], len(self.items))
+            self.condition.notify()
+        return dropped
+
+    def get(self, timeout=None):
+        """取出最旧的元素，超时或队列已关闭时返回None"""
+        with self.condition:
+            if not self.items and not self.closed:
+                self.condition.wait(timeout)
+            if not self.items:
+                return None
+            self.stats["gets"] += 1
+            return self.items.popleft()
+
+    def full(self):
+        return len(self.items) >= self.maxsize
+
+    def __len__(self):
+        return len(self.items)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class PipelineStage:
+    """流水线中的一个阶段，在自己的线程中运行
+
+    source阶段（没有输入队列）按目标频率主动产生数据；其它阶段从输入队列取数据处理。
+    处理函数返回None表示本项不再向下游传递（例如检测到菜单时丢弃本帧）。
+    """
+
+    def __init__(self, name, fn, in_queue=None, out_queue=None, interval=None, observer=None):
+        self.name = name
+        self.fn = fn
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.interval = interval  # source阶段的节拍间隔(秒)
+        self.observer = observer  # observer(阶段名, 耗时)，例如帧节奏控制
+        self.running = False
+        self.thread = None
+        self.busy_time = 0.0
+        self.started_at = None
+        self.stats = {"processed": 0, "emitted": 0, "errors": 0, "skipped": 0}
+        self.consecutive_errors = 0  # 连续出错的次数，处理成功一次即清零
+
+    def _emit(self, result):
+        if result is not None and self.out_queue is not None:
+            self.out_queue.put(result)
+            self.stats["emitted"] += 1
+
+    def _process(self, item):
+        start = time.time()
+        try:
+            result = self.fn(item) if self.in_queue is not None else self.fn()
+        except Exception as e:
+            self.stats["errors"] += 1
+            self.consecutive_errors += 1
+            logger.exception("流水线阶段出错: %s", e, stage=self.name)
+            result = None
+        else:
+            self.consecutive_errors = 0
+        elapsed = time.time() - start
+        self.busy_time += elapsed
+        self.stats["processed"] += 1
+        if self.observer is not None:
+            self.observer(self.name, elapsed)
+        self._emit(result)
+
+    def _run(self):
+        next_tick = time.time()
+        while self.running:
+            if self.in_queue is None:
+                # 反压：下游队列仍满时跳过本节拍，不产生注定被丢弃的数据
+                if self.out_queue is not None and self.out_queue.full():
+                    self.stats["skipped"] += 1
+                else:
+                    self._process(None)
+                next_tick += self.interval or 0
+                delay = next_tick - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # 落后超过一个节拍时不追赶，从现在重新计时
+                    next_tick = time.time()
+            else:
+                item = self.in_queue.get(timeout=0.1)
+                if item is not None:
+                    self._process(item)
+
+    def occupancy(self):
+        """阶段忙碌时间占运行时间的比例"""
+        if not self.started_at:
+            return 0.0
+        elapsed = time.time() - self.started_at
+        return self.busy_time / elapsed if elapsed > 0 else 0.0
+
+    def start(self):
+        self.running = True
+        self.started_at = time.time()
+        self.thread = threading.Thread(target=self._run, name=f"Stage-{self.name}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.in_queue is not None:
+            self.in_queue.close()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+
+
+class Pipeline:
+    """分阶段流水线：各阶段在独立线程中并行运行，阶段之间用丢弃最旧元素的有界队列连接
+
+    第一个阶段是source，按tick_rate(次/秒)产生数据；吞吐量由最慢的阶段决定，
+    而不是各阶段耗时之和。
+    """
+
+    def __init__(self, tick_rate=1.0, queue_size=1, observer=None):
+        self.tick_rate = tick_rate
+        self.queue_size = queue_size
+        self.observer = observer
+        self.stages = []
+        self.queues = []
+
+    def add_stage(self, name, fn):
+        """按顺序添加阶段，返回该阶段的输出队列（最后一个阶段的输出队列可供主线程读取）"""
+        in_queue = self.queues[-1] if self.queues else None
+        out_queue = DropOldestQueue(self.queue_size, name=f"{name}->")
+        interval = 1.0 / self.tick_rate if in_queue is None and self.tick_rate > 0 else None
+        self.stages.append(PipelineStage(name, fn, in_queue, out_queue, interval, self.observer))
+        self.queues.append(out_queue)
+        return out_queue
+
+    def set_tick_rate(self, tick_rate):
+        """运行中调整source阶段的节拍频率"""
+        self.tick_rate = tick_rate
+        if self.stages and tick_rate > 0:
+            self.stages[0].interval = 1.0 / tick_rate
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
+        for queue in self.queues:
+            queue.close()
+
+    def failing_stage(self, threshold):
+        """连续出错次数达到threshold的第一个阶段名，没有时返回None"""
+        for stage in self.stages:
+            if stage.consecutive_errors >= threshold:
+                return stage.name
+        return None
+
+    def get_stats(self):
+        """各阶段的处理数、占用率和输出队列的深度、丢弃数"""
+        return [
+            {
+                "stage": stage.name,
+                **stage.stats,
+                "occupancy": stage.occupancy(),
+                "avg_time": stage.busy_time / stage.stats["processed"] if stage.stats["processed"] else 0.0,
+                "queue_depth": len(stage.out_queue),
+                "queue_dropped": stage.out_queue.stats["dropped"]
+            }
+            for stage in self.stages
+        ]
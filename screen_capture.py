@@ -1,107 +1,96 @@
 import cv2
 import numpy as np
 import mss
-import win32gui
 import win32api
 import time
 import win32con
 
+from app_logging import get_logger
+from metrics import registry
+from ui_locator import UILocator
+from window_tracker import get_shared_tracker
+
+logger = get_logger("screen_capture")
+
+CAPTURE_SECONDS = registry.histogram("capture_frame_seconds", "截取一帧游戏画面的耗时(秒)")
+FRAMES_CAPTURED = registry.counter("frames_captured_total", "截取的画面帧数")
+
 class MinecraftScreenCapture:
-    def __init__(self):  # 不再需要手动指定标题，改为自动模糊匹配
-        self.game_region = None  # 游戏窗口区域（top, left, width, height）
+    def __init__(self, tracker=None):  # 不再需要手动指定标题，改为自动模糊匹配
+        # 窗口跟踪器：默认使用进程内共享的跟踪器，游戏窗口区域由它维护
+        self.tracker = None
         # 分析记录文字的相对位置（相对于游戏窗口左上角）
         self.relative_x = 2000
         self.relative_y = 600
+        # Minecraft选项中的GUI缩放（0=自动），与分辨率一起决定界面元素的位置
+        self.gui_scale = 0
+        # 界面元素位置缓存：命中时只做小区域校验，不再整屏搜索
+        self.locator = UILocator()
+        if tracker is not None:
+            self._attach_tracker(tracker)
+
+    def _attach_tracker(self, tracker):
+        self.tracker = tracker
+        tracker.add_listener(self._on_window_change)
+
+    @property
+    def game_region(self):
+        """游戏窗口客户区（top, left, width, height），窗口移动或缩放后自动更新"""
+        if self.tracker is None:
+            return None
+        return self.tracker.game_region
+
+    def _on_window_change(self, event, region):
+        # "回到游戏"按钮记录的是屏幕坐标，窗口移动或缩放后作废
+        if event in ("moved", "resized", "window_lost"):
+            self.locator.invalidate(element="back_to_game_button")
+
+    def close(self):
+        """写出尚未保存的界面元素缓存"""
+        self.locator.close()
 
     def find_game_window(self):
-        """精确匹配Minecraft游戏窗口，排除编辑器等其他窗口"""
-        def callback(hwnd, extra):
-            # 获取窗口标题并转为小写（忽略大小写）
-            window_title = win32gui.GetWindowText(hwnd).lower()
-            # 条件：窗口可见
-            if win32gui.IsWindowVisible(hwnd):
-                extra.append((hwnd, window_title))
-        
-        windows = []
-        win32gui.EnumWindows(callback, windows)  # 遍历所有窗口
-        
-        # 打印所有可见窗口，帮助调试
-        print("找到的可见窗口：")
-        for hwnd, title in windows:
-            print(f"- {title}")
-        
-        # 筛选出包含"minecraft"的窗口，但排除编辑器相关窗口
-        # 排除关键词：trae, editor, code, studio, vscode, pycharm等
-        exclude_keywords = ["trae", "editor", "code", "studio", "vscode", "pycharm"]
-        minecraft_windows = []
-        for hwnd, title in windows:
-            if "minecraft" in title:
-                # 检查是否包含排除关键词
-                exclude = False
-                for keyword in exclude_keywords:
-                    if keyword in title:
-                        exclude = True
-                        break
-                if not exclude:
-                    minecraft_windows.append((hwnd, title))
-        
-        if not minecraft_windows:
-            # 更详细的错误提示，方便排查
-            raise Exception("未找到我的世界窗口！请检查：\n1. 游戏已启动且处于窗口化模式（非全屏）\n2. 窗口未被最小化\n3. 窗口标题中包含'Minecraft'（如启动器或游戏内标题）")
-        
-        # 如果找到多个Minecraft窗口，让用户选择
-        if len(minecraft_windows) > 1:
-            print("找到多个Minecraft窗口，请选择：")
-            for i, (hwnd, title) in enumerate(minecraft_windows):
-                print(f"{i+1}. {title}")
-            try:
-                choice = int(input("请输入选择 (1-{}): ".format(len(minecraft_windows)))) - 1
-                if 0 <= choice < len(minecraft_windows):
-                    hwnd, title = minecraft_windows[choice]
-                else:
-                    print("输入无效，选择第一个窗口")
-                    hwnd, title = minecraft_windows[0]
-            except ValueError:
-                print("输入无效，选择第一个窗口")
-                hwnd, title = minecraft_windows[0]
-        else:
-            hwnd, title = minecraft_windows[0]
-        
-        print(f"选择窗口：{title}")
+        """定位Minecraft游戏窗口（由共享的窗口跟踪器查找并在后台跟踪其位置变化）"""
+        if self.tracker is None:
+            self._attach_tracker(get_shared_tracker())
+        elif self.tracker.hwnd is None:
+            self.tracker.find()
+        if not self.tracker.running:
+            self.tracker.start()
         # 激活窗口（确保能捕获到画面）
-        win32gui.SetForegroundWindow(hwnd)
-        time.sleep(0.5)  # 等待窗口激活
-        
-        # 获取窗口坐标（去除标题栏，只保留游戏画面）
-        rect = win32gui.GetWindowRect(hwnd)
-        # 标题栏高度可能因系统而异，这里增加调试信息
-        title_bar_height = 30
-        self.game_region = {
-            "top": rect[1] + title_bar_height,
-            "left": rect[0],
-            "width": rect[2] - rect[0],
-            "height": rect[3] - rect[1] - title_bar_height
-        }
-        print(f"游戏窗口定位成功：{self.game_region} (标题栏高度: {title_bar_height})")
-        return True
+        if not self.tracker.focused:
+            self.tracker.activate()
+            time.sleep(0.5)  # 等待窗口激活
+        return self.tracker.game_region is not None
 
     def capture_frame(self):
-        """捕获游戏画面，返回OpenCV格式图像（BGR）"""
-        if not self.game_region:
+        """捕获游戏画面，返回OpenCV格式图像（BGR）
+
+        窗口已关闭或最小化时返回None（调用方跳过本帧），窗口跟踪线程会在后台重新查找窗口。
+        """
+        if self.tracker is None:
             self.find_game_window()
+        # 只读取一次区域，避免跟踪线程在截图过程中替换区域
+        region = self.game_region
+        if region is None:
+            logger.warning("游戏窗口不可用（已关闭或最小化），跳过本帧")
+            return None
+        start = time.perf_counter()
         
         with mss.mss() as sct:
             # 截取游戏窗口区域
             monitor = {
-                "top": self.game_region["top"],
-                "left": self.game_region["left"],
-                "width": self.game_region["width"],
-                "height": self.game_region["height"]
+                "top": region["top"],
+                "left": region["left"],
+                "width": region["width"],
+                "height": region["height"]
             }
             sct_img = sct.grab(monitor)
             # 转换为OpenCV格式（BGR）
             frame = np.array(sct_img)
             frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+            CAPTURE_SECONDS.record(time.perf_counter() - start)
+            FRAMES_CAPTURED.inc()
             return frame
 
     def find_text_position(self, text_to_find="分析记录"):
@@ -113,13 +102,35 @@ class MinecraftScreenCapture:
         Returns:
             tuple: (x, y) 文字中心位置的屏幕坐标，如果未找到则返回None
         """
-        print(f"使用传统图像识别查找文字'{text_to_find}'的位置...")
-        
         # 捕获游戏画面
         frame = self.capture_frame()
         if frame is None:
-            print("无法捕获游戏画面，无法进行图像识别")
+            logger.warning("无法捕获游戏画面，无法进行图像识别")
             return None
+
+        # 先校验缓存的位置，失败时才做完整的图像识别
+        height, width = frame.shape[:2]
+        position = self.locator.locate(
+            f"text:{text_to_find}", frame, UILocator.layout_key(width, height, self.gui_scale),
+            lambda f: self._search_text_position(f, text_to_find),
+            self.locator.color_ratio_check([0, 0, 180], [180, 50, 255], min_ratio=0.3)
+        )
+        if position is not None:
+            # 转换为屏幕坐标
+            screen_x = self.game_region["left"] + position[0]
+            screen_y = self.game_region["top"] + position[1]
+            return (screen_x, screen_y)
+
+        # 如果图像识别失败，使用备用方案（相对位置）
+        logger.warning("图像识别失败，使用备用相对位置...")
+        screen_x = self.game_region["left"] + self.relative_x
+        screen_y = self.game_region["top"] + self.relative_y
+        logger.info("使用备用位置: (%s, %s)", screen_x, screen_y)
+        return (screen_x, screen_y)
+
+    def _search_text_position(self, frame, text_to_find):
+        """在游戏画面中完整搜索文字，返回画面内坐标(x, y)，未找到时返回None"""
+        logger.debug("使用传统图像识别查找文字'%s'的位置...", text_to_find)
         
         # 转换为HSV色彩空间，更容易进行颜色筛选
         hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
@@ -158,20 +169,9 @@ class MinecraftScreenCapture:
             if M["m00"] > 0:
                 cx = int(M["m10"] / M["m00"])
                 cy = int(M["m01"] / M["m00"])
-                
-                # 转换为屏幕坐标
-                screen_x = self.game_region["left"] + cx
-                screen_y = self.game_region["top"] + cy
-                
-                print(f"通过图像识别找到文字位置: ({screen_x}, {screen_y})")
-                return (screen_x, screen_y)
-        
-        # 如果图像识别失败，使用备用方案（相对位置）
-        print("图像识别失败，使用备用相对位置...")
-        screen_x = self.game_region["left"] + self.relative_x
-        screen_y = self.game_region["top"] + self.relative_y
-        print(f"使用备用位置: ({screen_x}, {screen_y})")
-        return (screen_x, screen_y)
+                logger.info("通过图像识别找到文字位置: (%s, %s)", self.game_region['left'] + cx, self.game_region['top'] + cy)
+                return (cx, cy)
+        return None
 
 
 
@@ -184,7 +184,7 @@ class MinecraftScreenCapture:
         """
         self.relative_x = x
         self.relative_y = y
-        print(f"已设置分析记录文字位置: ({x}, {y}) (相对于游戏窗口)")
+        logger.info("已设置分析记录文字位置: (%s, %s) (相对于游戏窗口)", x, y)
         
     def verify_click_success(self, x, y, threshold=5):
         """验证点击是否成功
@@ -202,7 +202,7 @@ class MinecraftScreenCapture:
         # 点击前捕获画面
         before_frame = self.capture_frame()
         if before_frame is None:
-            print("无法捕获点击前画面，无法验证点击成功")
+            logger.warning("无法捕获点击前画面，无法验证点击成功")
             return False
         
         # 等待点击生效
@@ -211,7 +211,7 @@ class MinecraftScreenCapture:
         # 点击后捕获画面
         after_frame = self.capture_frame()
         if after_frame is None:
-            print("无法捕获点击后画面，无法验证点击成功")
+            logger.warning("无法捕获点击后画面，无法验证点击成功")
             return False
         
         # 转换为HSV色彩空间
@@ -231,7 +231,7 @@ class MinecraftScreenCapture:
         diff = cv2.absdiff(before_roi, after_roi)
         mean_diff = diff.mean()
         
-        print(f"点击区域颜色差异: {mean_diff}")
+        logger.debug("点击区域颜色差异: %s", mean_diff)
         
         # 如果颜色差异超过阈值，则认为点击成功
         return mean_diff > threshold
@@ -243,7 +243,7 @@ class MinecraftScreenCapture:
             tuple: (x, y) 鼠标的屏幕坐标
         """
         x, y = win32api.GetCursorPos()
-        print(f"当前鼠标位置: ({x}, {y})")
+        logger.debug("当前鼠标位置: (%s, %s)", x, y)
         return (x, y)
 
     def capture_full_screen(self, include_mouse_pos=True):
@@ -258,7 +258,7 @@ class MinecraftScreenCapture:
         # 获取屏幕分辨率
         screen_width = win32api.GetSystemMetrics(0)
         screen_height = win32api.GetSystemMetrics(1)
-        print(f"当前屏幕分辨率: {screen_width}x{screen_height}")
+        logger.debug("当前屏幕分辨率: %sx%s", screen_width, screen_height)
 
         # 获取鼠标位置
         mouse_pos = None
@@ -272,7 +272,7 @@ class MinecraftScreenCapture:
                 mx = max(10, min(mx, screen_width - 10))
                 my = max(10, min(my, screen_height - 10))
                 mouse_pos = (mx, my)
-                print(f"调整后鼠标位置: ({mx}, {my})")
+                logger.debug("调整后鼠标位置: (%s, %s)", mx, my)
             
         with mss.mss() as sct:
             # 截取整个屏幕
@@ -297,10 +297,27 @@ class MinecraftScreenCapture:
         Returns:
             tuple: (x, y) 按钮中心位置的屏幕坐标，如果未找到则返回None
         """
-        print("查找'回到游戏'按钮的位置...")
-        
         # 捕获全屏画面(不包含鼠标位置信息)
         frame, screen_width, screen_height, _ = self.capture_full_screen(include_mouse_pos=False)
+
+        # 先校验缓存的位置（按钮区域应为绿色），失败时才做完整的图像识别
+        position = self.locator.locate(
+            "back_to_game_button", frame, UILocator.layout_key(screen_width, screen_height, self.gui_scale),
+            lambda f: self._search_back_to_game_button(f, screen_width, screen_height),
+            self.locator.color_ratio_check([30, 40, 40], [80, 255, 255])
+        )
+        if position is None:
+            logger.warning("未找到'回到游戏'按钮")
+            return None
+
+        cx, cy = position
+        # 针对y轴坐标偏小的问题，增加一个偏移量
+        cy += 15  # 增加15像素的偏移量以纠正按钮位置
+        return (cx, cy)
+
+    def _search_back_to_game_button(self, frame, screen_width, screen_height):
+        """在全屏画面中完整搜索"回到游戏"按钮，返回按钮区域中心(x, y)，未找到时返回None"""
+        logger.debug("查找'回到游戏'按钮的位置...")
         
         # 转换为HSV色彩空间，更容易进行颜色筛选
         hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
@@ -339,16 +356,11 @@ class MinecraftScreenCapture:
             cx = x + w // 2
             cy = y + h // 2
             
-            # 针对y轴坐标偏小的问题，增加一个偏移量
-            cy += 15  # 增加15像素的偏移量以纠正按钮位置
-            
-            print(f"通过图像识别找到'回到游戏'按钮位置: ({cx}, {cy})")
+            logger.info("通过图像识别找到'回到游戏'按钮位置: (%s, %s)", cx, cy + 15)
             # 记录坐标和分辨率信息，指定编码格式为utf-8
             with open("back_to_game_button_log.txt", "a", encoding="utf-8") as f:
-                f.write(f"时间: {time.strftime('%Y-%m-%d %H:%M:%S')}, 分辨率: {screen_width}x{screen_height}, 坐标: ({cx}, {cy})\n")
+                f.write(f"时间: {time.strftime('%Y-%m-%d %H:%M:%S')}, 分辨率: {screen_width}x{screen_height}, 坐标: ({cx}, {cy + 15})\n")
             return (cx, cy)
-        
-        print("未找到'回到游戏'按钮")
         return None
 
     def click_back_to_game_button(self):
@@ -364,11 +376,11 @@ class MinecraftScreenCapture:
         
         button_position = self.find_back_to_game_button()
         if not button_position:
-            print("未找到'回到游戏'按钮，无法执行点击")
+            logger.warning("未找到'回到游戏'按钮，无法执行点击")
             return False
         
         x, y = button_position
-        print(f"点击'回到游戏'按钮位置：({x}, {y})")
+        logger.info("点击'回到游戏'按钮位置：(%s, %s)", x, y)
         
         try:
             # 确保游戏窗口获得焦点
@@ -389,9 +401,9 @@ class MinecraftScreenCapture:
                 win32gui.SetForegroundWindow(minecraft_hwnd)
                 # 等待窗口激活
                 time.sleep(0.5)
-                print("已激活Minecraft窗口")
+                logger.info("已激活Minecraft窗口")
             else:
-                print("未找到Minecraft窗口")
+                logger.warning("未找到Minecraft窗口")
             
             # 移动鼠标到按钮位置（增加额外的y轴偏移以确保点击按钮中心）
             pyautogui.moveTo(x, y + 5, duration=0.5)
@@ -408,11 +420,11 @@ class MinecraftScreenCapture:
             # 验证点击是否成功（检查按钮是否仍然存在）
             new_button_position = self.find_back_to_game_button()
             if not new_button_position:
-                print("点击成功：'回到游戏'按钮已消失")
+                logger.info("点击成功：'回到游戏'按钮已消失")
                 return True
             else:
                 # 尝试第二次点击
-                print(f"点击失败，尝试第二次点击: {new_button_position}")
+                logger.warning("点击失败，尝试第二次点击: %s", new_button_position)
                 pyautogui.moveTo(new_button_position[0], new_button_position[1] + 5, duration=0.5)
                 pyautogui.doubleClick()
                 time.sleep(0.2)
@@ -422,13 +434,13 @@ class MinecraftScreenCapture:
                 # 再次验证
                 new_button_position2 = self.find_back_to_game_button()
                 if not new_button_position2:
-                    print("第二次点击成功：'回到游戏'按钮已消失")
+                    logger.info("第二次点击成功：'回到游戏'按钮已消失")
                     return True
                 else:
-                    print(f"第二次点击失败：'回到游戏'按钮仍然存在于位置: {new_button_position2}")
+                    logger.warning("第二次点击失败：'回到游戏'按钮仍然存在于位置: %s", new_button_position2)
                     return False
         except Exception as e:
-            print(f"点击过程中出错: {e}")
+            logger.error("点击过程中出错: %s", e)
             return False
             
             # 确保游戏窗口获得焦点
@@ -452,12 +464,12 @@ class MinecraftScreenCapture:
                 if hwnd:
                     # 激活窗口
                     win32gui.SetForegroundWindow(hwnd)
-                    print("已激活Minecraft窗口")
+                    logger.info("已激活Minecraft窗口")
                     time.sleep(0.5)  # 等待窗口激活
                 else:
-                    print("未找到Minecraft窗口，尝试直接点击")
+                    logger.warning("未找到Minecraft窗口，尝试直接点击")
             except Exception as e:
-                print(f"激活窗口时出错: {e}")
+                logger.error("激活窗口时出错: %s", e)
             
             # 移动鼠标到位置，然后点击
             try:
@@ -466,23 +478,23 @@ class MinecraftScreenCapture:
                 # 尝试三次点击
                 for i in range(3):
                     pyautogui.click(x, y)
-                    print(f"执行第{i+1}次点击")
+                    logger.debug("执行第%s次点击", i+1)
                     time.sleep(0.3)  # 每次点击间隔
                 time.sleep(1)  # 等待点击生效
             except Exception as e:
-                print(f"点击操作出错: {e}")
+                logger.error("点击操作出错: %s", e)
                 return False
             
             # 验证点击是否成功
             after_position = self.find_back_to_game_button()
             if not after_position:
-                print("点击验证成功：'回到游戏'按钮已消失")
+                logger.info("点击验证成功：'回到游戏'按钮已消失")
                 return True
             else:
-                print(f"点击验证失败：按钮仍然存在于位置: {after_position}")
+                logger.warning("点击验证失败：按钮仍然存在于位置: %s", after_position)
                 return False
         else:
-            print("无法点击'回到游戏'按钮，因为未找到其位置")
+            logger.warning("无法点击'回到游戏'按钮，因为未找到其位置")
             return False
 
     # 原verify_click_success方法的剩余部分
@@ -493,7 +505,7 @@ class MinecraftScreenCapture:
         # 点击后捕获画面
         after_frame = self.capture_frame()
         if after_frame is None:
-            print("无法捕获点击后画面，无法验证点击成功")
+            logger.warning("无法捕获点击后画面，无法验证点击成功")
             return False
         
         # 转换为游戏窗口内的相对坐标
@@ -502,7 +514,7 @@ class MinecraftScreenCapture:
         
         # 确保坐标在画面范围内
         if rel_x < 0 or rel_x >= self.game_region["width"] or rel_y < 0 or rel_y >= self.game_region["height"]:
-            print(f"点击坐标({x}, {y})超出游戏窗口范围")
+            logger.warning("点击坐标(%s, %s)超出游戏窗口范围", x, y)
             return False
         
         # 提取点击区域周围的颜色（使用3x3区域的平均值）
@@ -512,7 +524,7 @@ class MinecraftScreenCapture:
         # 确保区域在画面范围内
         if rel_y - half_kernel < 0 or rel_y + half_kernel >= self.game_region["height"] or \
            rel_x - half_kernel < 0 or rel_x + half_kernel >= self.game_region["width"]:
-            print("点击区域靠近边缘，无法使用区域验证")
+            logger.warning("点击区域靠近边缘，无法使用区域验证")
             # 退化为单点验证
             before_color = before_frame[rel_y, rel_x]
             after_color = after_frame[rel_y, rel_x]
@@ -525,14 +537,14 @@ class MinecraftScreenCapture:
             after_color_avg = np.mean(after_region, axis=(0, 1))
             color_diff = np.linalg.norm(before_color_avg - after_color_avg)
          
-        print(f"点击前后颜色差异: {color_diff}")
+        logger.debug("点击前后颜色差异: %s", color_diff)
          
         # 如果颜色差异超过阈值，则认为点击成功
         if color_diff > threshold:
-            print("点击成功，颜色发生明显变化")
+            logger.info("点击成功，颜色发生明显变化")
             return True
         else:
-            print("点击可能未成功，颜色变化不明显")
+            logger.warning("点击可能未成功，颜色变化不明显")
             return False        
         # 等待点击生效
         import time
@@ -541,7 +553,7 @@ class MinecraftScreenCapture:
         # 点击后捕获画面
         after_frame = self.capture_frame()
         if after_frame is None:
-            print("无法捕获点击后画面，无法验证点击成功")
+            logger.warning("无法捕获点击后画面，无法验证点击成功")
             return False
         
         # 转换为游戏窗口内的相对坐标
@@ -550,7 +562,7 @@ class MinecraftScreenCapture:
         
         # 确保坐标在画面范围内
         if rel_x < 0 or rel_x >= self.game_region["width"] or rel_y < 0 or rel_y >= self.game_region["height"]:
-            print(f"点击坐标({x}, {y})超出游戏窗口范围")
+            logger.warning("点击坐标(%s, %s)超出游戏窗口范围", x, y)
             return False
         
         # 提取点击区域周围的颜色（使用3x3区域的平均值）
@@ -560,7 +572,7 @@ class MinecraftScreenCapture:
         # 确保区域在画面范围内
         if rel_y - half_kernel < 0 or rel_y + half_kernel >= self.game_region["height"] or \
            rel_x - half_kernel < 0 or rel_x + half_kernel >= self.game_region["width"]:
-            print("点击区域靠近边缘，无法使用区域验证")
+            logger.warning("点击区域靠近边缘，无法使用区域验证")
             # 退化为单点验证
             before_color = before_frame[rel_y, rel_x]
             after_color = after_frame[rel_y, rel_x]
@@ -573,14 +585,14 @@ class MinecraftScreenCapture:
             after_color_avg = np.mean(after_region, axis=(0, 1))
             color_diff = np.linalg.norm(before_color_avg - after_color_avg)
          
-        print(f"点击前后颜色差异: {color_diff}")
+        logger.debug("点击前后颜色差异: %s", color_diff)
          
         # 如果颜色差异超过阈值，则认为点击成功
         if color_diff > threshold:
-            print("点击成功，颜色发生明显变化")
+            logger.info("点击成功，颜色发生明显变化")
             return True
         else:
-            print("点击可能未成功，颜色变化不明显")
+            logger.warning("点击可能未成功，颜色变化不明显")
             return False
 
 # 测试画面捕获
@@ -0,0 +1,266 @@
+# stage_profiler.py
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from app_logging import get_logger
+
+logger = get_logger("stage_profiler")
+
+PROFILE_STAGES = ("capture", "analyze", "decide", "act", "display")
+PROFILE_MODES = ("off", "sample", "cprofile")
+
+
+class StageProfiler:
+    """按流水线阶段划分的性能剖析
+
+    - sample模式：后台线程定期读取各阶段线程正在执行的调用栈（只在阶段处理数据期间采样），
+      开销与阶段代码无关；输出折叠调用栈(.collapsed，可直接用flamegraph.pl/speedscope生成火焰图)和函数表
+    - cprofile模式：只在所选阶段的处理函数运行期间启用cProfile，输出.prof和按累计耗时排序的函数表
+    两种模式都在前N帧内统计，结束后在后台线程写出文件。
+    设置慢帧阈值时始终保留最近的采样，截图到动作完成超过阈值的帧单独写出该帧期间的调用栈。
+    """
+
+    def __init__(self, mode="off", stages=PROFILE_STAGES, ticks=100, output_dir="profiles",
+                 slow_tick_threshold=None, sample_interval=0.005, max_slow_dumps=20):
+        """
+        Args:
+            mode (str): off/sample/cprofile
+            stages: 参与剖析的阶段名
+            ticks (int): 剖析的帧数，0表示一直剖析到退出
+            output_dir (str): 输出目录
+            slow_tick_threshold (float): 慢帧阈值(秒)，None表示不自动捕获慢帧
+            sample_interval (float): 采样间隔(秒)
+            max_slow_dumps (int): 最多写出的慢帧数
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"未知的剖析模式: {mode}")
+        self.mode = mode
+        self.stages = set(stages)
+        self.ticks = ticks
+        self.output_dir = output_dir
+        self.slow_tick_threshold = slow_tick_threshold
+        self.sample_interval = sample_interval
+        self.max_slow_dumps = max_slow_dumps
+        self.prefix = time.strftime("%Y%m%d_%H%M%S")
+
+        self.profiling = mode != "off"  # 前N帧的剖析是否仍在进行
+        self.active = {}  # {线程ident: 阶段名}，阶段处理数据期间才在其中
+        self.profiled_threads = set()  # 当前启用了cProfile的线程
+        self.profiles = {stage: cProfile.Profile() for stage in self.stages} if mode == "cprofile" else {}
+        self.samples = {stage: Counter() for stage in self.stages}  # {阶段名: {折叠调用栈: 采样数}}
+        self.recent = deque(maxlen=int(10 / sample_interval)) if slow_tick_threshold else None  # 最近约10秒的采样
+        self.pending_dumps = deque()  # 等待后台线程写出的任务
+        self.wrapper_code = None  # 采样时调用栈截止到阶段包装函数，不含线程和流水线的框架代码
+        self.tick_count = 0
+        self.stats = {"samples": 0, "slow_ticks": 0, "slow_dumps": 0, "profile_conflicts": 0, "files": 0}
+
+        self.stop_event = threading.Event()
+        self.thread = None
+        if self.enabled:
+            os.makedirs(output_dir, exist_ok=True)
+            self.thread = threading.Thread(target=self._run, name="StageProfiler", daemon=True)
+            self.thread.start()
+
+    @property
+    def enabled(self):
+        return self.mode != "off" or self.slow_tick_threshold is not None
+
+    @property
+    def sampling(self):
+        return (self.mode == "sample" and self.profiling) or self.recent is not None
+
+    def wrap(self, stage, fn):
+        """包装阶段处理函数；未启用或该阶段未选中时原样返回"""
+        if not self.enabled or stage not in self.stages:
+            return fn
+
+        def profiled(*args):
+            with self.stage(stage):
+                return fn(*args)
+
+        self.wrapper_code = profiled.__code__
+        return profiled
+
+    def stage(self, name):
+        """阶段计时上下文：with profiler.stage("display"): ..."""
+        return _StageContext(self, name)
+
+    def _enter(self, name):
+        self.active[threading.get_ident()] = name
+        if self.profiling and self.mode == "cprofile":
+            try:
+                self.profiles[name].enable()
+                self.profiled_threads.add(threading.get_ident())
+                return True
+            except ValueError:
+                # Python 3.12起cProfile基于sys.monitoring，同一时刻只能有一个剖析器生效
+                self.stats["profile_conflicts"] += 1
+        return False
+
+    def _exit(self, name, profiled):
+        if profiled:
+            self.profiles[name].disable()
+            self.profiled_threads.discard(threading.get_ident())
+        self.active.pop(threading.get_ident(), None)
+
+    def record_tick(self, captured_at, latency):
+        """一帧完成时调用：统计帧数、触发慢帧捕获；写文件都交给后台线程"""
+        if not self.enabled:
+            return
+        self.tick_count += 1
+        if self.profiling and self.ticks and self.tick_count >= self.ticks:
+            self.profiling = False
+            self.pending_dumps.append(("window", None))
+        if self.slow_tick_threshold is not None and latency > self.slow_tick_threshold:
+            self.stats["slow_ticks"] += 1
+            if self.stats["slow_dumps"] < self.max_slow_dumps:
+                self.stats["slow_dumps"] += 1
+                self.pending_dumps.append(("slow", (self.tick_count, captured_at, latency)))
+
+    def _run(self):
+        while not self.stop_event.wait(self.sample_interval if self.sampling else 0.1):
+            if self.sampling:
+                self._sample()
+            while self.pending_dumps:
+                self._dump(*self.pending_dumps.popleft())
+
+    def _sample(self):
+        active = dict(self.active)
+        if not active:
+            return
+        frames = sys._current_frames()
+        now = time.time()
+        for ident, stage in active.items():
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if code is self.wrapper_code:
+                    break
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(stage)
+            collapsed = ";".join(reversed(stack))
+            self.stats["samples"] += 1
+            if self.mode == "sample" and self.profiling:
+                self.samples[stage][collapsed] += 1
+            if self.recent is not None:
+                self.recent.append((now, stage, collapsed))
+
+    def _path(self, name):
+        return os.path.join(self.output_dir, f"{self.prefix}_{name}")
+
+    def _write(self, path, text):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        self.stats["files"] += 1
+
+    def _dump(self, kind, info):
+        try:
+            if kind == "window":
+                self.write_reports()
+            else:
+                tick, captured_at, latency = info
+                samples = {}
+                for timestamp, stage, collapsed in list(self.recent):
+                    if timestamp >= captured_at:
+                        samples.setdefault(stage, Counter())[collapsed] += 1
+                name = f"slow_tick{tick}_{latency * 1000:.0f}ms"
+                self._write(self._path(name + ".collapsed"), self._format_collapsed(samples))
+                logger.info("已写出慢帧调用栈", tick=tick, latency=round(latency, 3), path=self._path(name + ".collapsed"))
+        except Exception as e:
+            logger.warning("写出剖析结果失败: %s", e)
+
+    @staticmethod
+    def _format_collapsed(samples):
+        lines = []
+        for stage in sorted(samples):
+            for collapsed, count in samples[stage].most_common():
+                lines.append(f"{collapsed} {count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _function_table(counter):
+        """按采样数统计每个函数的总占比（出现在栈中）和自身占比（位于栈顶）"""
+        total_samples = sum(counter.values())
+        inclusive = Counter()
+        exclusive = Counter()
+        for collapsed, count in counter.items():
+            functions = collapsed.split(";")[1:]
+            if not functions:
+                continue
+            exclusive[functions[-1]] += count
+            for function in set(functions):
+                inclusive[function] += count
+        lines = [f"采样数: {total_samples}", f"{'总占比':>8} {'自身占比':>8} {'总计':>7} {'自身':>7}  函数"]
+        for function, count in inclusive.most_common():
+            lines.append(f"{count / total_samples:>8.1%} {exclusive[function] / total_samples:>8.1%} "
+                         f"{count:>7} {exclusive[function]:>7}  {function}")
+        return "\n".join(lines) + "\n"
+
+    def write_reports(self):
+        """写出前N帧的剖析结果：每个阶段一个折叠调用栈/函数表（sample）或.prof/函数表（cprofile）"""
+        if self.mode == "sample":
+            for stage, counter in self.samples.items():
+                if not counter:
+                    continue
+                self._write(self._path(f"{stage}.collapsed"), self._format_collapsed({stage: counter}))
+                self._write(self._path(f"{stage}.txt"), self._function_table(counter))
+        elif self.mode == "cprofile":
+            # 等正在运行的阶段处理完再汇总，cProfile只能由启用它的线程停止
+            deadline = time.time() + 2.0
+            while self.profiled_threads and time.time() < deadline:
+                time.sleep(0.01)
+            for stage, profile in self.profiles.items():
+                profile.create_stats()
+                if not profile.stats:
+                    continue
+                profile.dump_stats(self._path(f"{stage}.prof"))
+                self.stats["files"] += 1
+                stream = io.StringIO()
+                pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(40)
+                self._write(self._path(f"{stage}.txt"), stream.getvalue())
+        logger.info("剖析结果已写出", mode=self.mode, ticks=self.tick_count, output_dir=self.output_dir)
+
+    def get_report(self):
+        return {"mode": self.mode, "ticks": self.tick_count, "output_dir": self.output_dir, **self.stats}
+
+    def close(self):
+        """停止后台线程；剖析窗口尚未结束时写出已收集的结果"""
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join(timeout=2)
+        self.thread = None
+        while self.pending_dumps:
+            self._dump(*self.pending_dumps.popleft())
+        if self.profiling:
+            self.profiling = False
+            self._dump("window", None)
+
+
+class _StageContext:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if self.profiler.enabled and self.name in self.profiler.stages:
+            self.profiled = self.profiler._enter(self.name)
+            self.entered = True
+        else:
+            self.entered = False
+        return self
+
+    def __exit__(self, *exc):
+        if self.entered:
+            self.profiler._exit(self.name, self.profiled)
+        return False
@@ -0,0 +1,6 @@
+# conftest.py
+import os
+import sys
+
+# 模块都在项目根目录下，测试直接按模块名导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
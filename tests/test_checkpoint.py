@@ -0,0 +1,78 @@
+# test_checkpoint.py
+import json
+import os
+
+import pytest
+
+from checkpoint import SessionCheckpointer
+
+
+@pytest.fixture
+def checkpointer(tmp_path):
+    # 间隔足够长，只由测试手动触发检查点
+    checkpointer = SessionCheckpointer(str(tmp_path), interval=3600, fsync=False)
+    yield checkpointer
+    checkpointer.stop_event.set()
+    checkpointer.thread.join(timeout=1)
+
+
+def test_unchanged_sections_are_skipped(checkpointer):
+    state = {"score": 1}
+    checkpointer.register("session", lambda: state)
+    checkpointer.checkpoint()
+    checkpointer.checkpoint()
+    assert checkpointer.stats["writes"] == 1
+    assert checkpointer.stats["unchanged"] == 1
+
+    state["score"] = 2
+    checkpointer.checkpoint()
+    assert checkpointer.stats["writes"] == 2
+    assert checkpointer.load("session") == {"score": 2}
+
+
+def test_only_changed_section_is_rewritten(checkpointer):
+    session = {"frames": 0}
+    checkpointer.register("session", lambda: session)
+    checkpointer.register("learning", lambda: {"success_actions": {}})
+    checkpointer.checkpoint()
+    learning_path = os.path.join(checkpointer.directory, "learning.json")
+    mtime = os.stat(learning_path).st_mtime_ns
+
+    session["frames"] = 5
+    checkpointer.checkpoint()
+    assert checkpointer.stats["writes"] == 3
+    assert os.stat(learning_path).st_mtime_ns == mtime
+
+
+def test_write_replaces_atomically(checkpointer, tmp_path):
+    path = str(tmp_path / "custom.json")
+    checkpointer.register("custom", lambda: {"a": [1, 2]}, path=path)
+    checkpointer.checkpoint()
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"a": [1, 2]}
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_failing_section_does_not_block_others(checkpointer):
+    def broken():
+        raise ValueError("boom")
+
+    checkpointer.register("broken", broken)
+    checkpointer.register("session", lambda: {"ok": True})
+    checkpointer.checkpoint()
+    assert checkpointer.stats["errors"] == 1
+    assert checkpointer.load("session") == {"ok": True}
+    assert checkpointer.load("broken") is None
+
+
+def test_load_corrupt_file_returns_none(checkpointer):
+    with open(os.path.join(checkpointer.directory, "session.json"), "w", encoding="utf-8") as f:
+        f.write("{not json")
+    assert checkpointer.load("session") is None
+
+
+def test_close_writes_final_checkpoint(tmp_path):
+    checkpointer = SessionCheckpointer(str(tmp_path), interval=3600, fsync=False)
+    checkpointer.register("session", lambda: {"exit_reason": "esc"})
+    checkpointer.close()
+    assert checkpointer.load("session") == {"exit_reason": "esc"}
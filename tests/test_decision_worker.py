@@ -0,0 +1,133 @@
+# test_decision_worker.py
+import threading
+
+import pytest
+
+from decision_worker import SpeculativeDecisionWorker
+
+
+class FakeAI:
+    """只实现推测线程用到的DeepSeekAI接口，_llm_decide的行为由decide函数决定"""
+
+    model_loaded = True
+    default_time_budget = 1.0
+
+    def __init__(self, decide):
+        self.decide = decide
+        self.llm_needed = True
+        self.cancel_events = []
+        self.decisions = []
+        self.started = threading.Semaphore(0)  # 每开始一次推理释放一次
+
+    def needs_llm(self, game_state):
+        return self.llm_needed
+
+    def llm_available(self):
+        return True
+
+    def inference_timeout(self):
+        return 1.0
+
+    def _get_state_key(self, game_state):
+        return 0
+
+    def _llm_decide(self, game_state, state_key, timeout, cancel_event):
+        self.cancel_events.append(cancel_event)
+        self.started.release()
+        return self.decide(cancel_event)
+
+    def start_plan(self, game_state, actions):
+        return actions[0] if actions else None
+
+    def record_decision(self, game_state, action, tier, budget, start_time):
+        self.decisions.append(tier)
+        return action
+
+    def get_action(self, game_state, time_budget=None):
+        self.decisions.append("fallback")
+        return "s"
+
+
+def state(description="平原", grass=0.3):
+    return {"description_cn": description, "ratios": {"grass": grass}}
+
+
+@pytest.fixture
+def make_worker():
+    workers = []
+
+    def make(decide):
+        ai = FakeAI(decide)
+        worker = SpeculativeDecisionWorker(ai)
+        workers.append(worker)
+        return worker, ai
+
+    yield make
+    for worker in workers:
+        worker.close()
+
+
+def wait_until_cancelled(cancel_event):
+    cancel_event.wait(2)
+    return []
+
+
+def test_matching_state_uses_speculation(make_worker):
+    worker, ai = make_worker(lambda cancel_event: ["w"])
+    worker.speculate(state())
+    assert worker.resolve(state(grass=0.32)) == "w"
+    assert ai.decisions == ["speculative"]
+    assert worker.stats["hits"] == 1
+
+
+def test_mismatched_state_cancels_and_falls_back(make_worker):
+    worker, ai = make_worker(wait_until_cancelled)
+    worker.speculate(state())
+    assert ai.started.acquire(timeout=1)
+    assert worker.resolve(state("森林")) == "s"
+    assert ai.cancel_events[0].wait(1)
+    assert worker.stats["mismatched"] == 1 and ai.decisions == ["fallback"]
+
+
+def test_unfinished_speculation_counts_as_late(make_worker):
+    worker, ai = make_worker(wait_until_cancelled)
+    worker.speculate(state())
+    assert ai.started.acquire(timeout=1)
+    assert worker.resolve(state(), time_budget=0.05) == "s"
+    assert ai.cancel_events[0].is_set()
+    assert worker.stats["late"] == 1 and worker.stats["errors"] == 0
+
+
+def test_inference_error_counted_separately(make_worker):
+    def fail(cancel_event):
+        raise RuntimeError("backend down")
+
+    worker, ai = make_worker(fail)
+    worker.speculate(state())
+    assert worker.resolve(state()) == "s"
+    assert worker.stats["errors"] == 1 and worker.stats["late"] == 0
+
+
+def test_cancelled_speculation_counted_separately(make_worker):
+    worker, ai = make_worker(wait_until_cancelled)
+    worker.speculate(state())
+    assert ai.started.acquire(timeout=1)
+    worker.pending[1].cancel()
+    assert worker.resolve(state()) == "s"
+    assert worker.stats["cancelled"] == 1 and worker.stats["late"] == 0
+
+
+def test_new_speculation_cancels_previous(make_worker):
+    worker, ai = make_worker(wait_until_cancelled)
+    worker.speculate(state())
+    assert ai.started.acquire(timeout=1)
+    worker.speculate(state("森林"))
+    assert ai.cancel_events[0].wait(1)
+    assert worker.stats["started"] == 2
+
+
+def test_no_speculation_when_llm_not_needed(make_worker):
+    worker, ai = make_worker(lambda cancel_event: ["w"])
+    ai.llm_needed = False
+    worker.speculate(state())
+    assert worker.pending is None and worker.stats["started"] == 0
@@ -0,0 +1,80 @@
+# test_frame_pacing.py
+import time
+
+import pytest
+
+from frame_pacing import FramePacer
+
+
+def test_rate_limited_by_slowest_stage():
+    pacer = FramePacer("low-latency")
+    pacer.record_stage("decide", 0.45)
+    pacer.adjust()
+    assert pacer.tick_rate == pytest.approx(2.0)
+
+
+def test_rate_limited_by_cpu_budget():
+    pacer = FramePacer("balanced", cpu_budget=0.5)
+    pacer.record_stage("capture", 0.1)
+    pacer.record_stage("analyze", 0.15)
+    pacer.adjust()
+    assert pacer.tick_rate == pytest.approx(2.0)
+
+
+def test_rate_leaves_room_for_inference():
+    pacer = FramePacer("low-latency", inference_latency=lambda: 0.5, min_decision_budget=0.3)
+    pacer.record_stage("capture", 0.01)
+    pacer.adjust()
+    assert pacer.tick_rate == pytest.approx(1.25)
+
+
+def test_rate_never_below_preset_minimum():
+    pacer = FramePacer("balanced")
+    pacer.record_stage("analyze", 10.0)
+    pacer.adjust()
+    assert pacer.tick_rate == pacer.config["min_tick_rate"]
+
+
+def test_fixed_preset_does_not_adjust():
+    pacer = FramePacer("fixed", tick_rate=3.0)
+    pacer.record_stage("analyze", 1.0)
+    pacer.adjust()
+    assert pacer.tick_rate == 3.0
+
+
+def test_over_target_lowers_scale_then_disables_optional_stages():
+    pacer = FramePacer("balanced", min_scale=0.9)
+    pacer.record_stage("capture", 0.01)
+    for _ in range(20):
+        pacer.latency_histogram.record(5.0)
+    pacer.adjust()
+    assert pacer.analysis_scale == 0.9 and pacer.optional_enabled("night")
+    pacer.adjust()
+    assert not pacer.optional_enabled("night") and pacer.optional_enabled("display")
+    pacer.adjust()
+    assert not pacer.optional_enabled("display")
+
+
+def test_under_target_restores_optional_stages_first():
+    pacer = FramePacer("balanced", min_scale=0.9)
+    pacer.analysis_scale = 0.9
+    pacer.disabled_stages = {"night", "display"}
+    pacer.record_stage("capture", 0.01)
+    for _ in range(20):
+        pacer.latency_histogram.record(0.1)
+    pacer.adjust()
+    assert pacer.optional_enabled("display") and not pacer.optional_enabled("night")
+    pacer.adjust()
+    pacer.adjust()
+    assert pacer.optional_enabled("night") and pacer.analysis_scale == 1.0
+
+
+def test_decision_budget_counts_from_capture():
+    pacer = FramePacer("balanced")
+    assert pacer.decision_budget(time.time() - 0.2) == pytest.approx(1.0, abs=0.05)
+    assert pacer.decision_budget(time.time() - 10) == 0.0
+
+
+def test_unknown_preset_rejected():
+    with pytest.raises(ValueError):
+        FramePacer("turbo")
@@ -0,0 +1,90 @@
+# test_game_controller.py
+import json
+import time
+
+import pytest
+
+from game_controller import GameController
+from input_backend import RecordingBackend
+
+
+@pytest.fixture
+def controller():
+    controller = GameController(input_backend="recording")
+    yield controller
+    controller.close()
+
+
+def events(controller, *kinds):
+    return [event for event in list(controller.input_backend.events) if not kinds or event["event"] in kinds]
+
+
+def test_key_action_returns_immediately_and_holds_for_duration(controller):
+    start = time.time()
+    handle = controller.execute_action("w")
+    # 不阻塞调用方，也没有pyautogui式的每次调用额外暂停
+    assert time.time() - start < 0.05
+    assert handle.wait(2) and handle.ok
+
+    recorded = events(controller)
+    assert [(event["event"], event["key"]) for event in recorded] == [("key_down", "w"), ("key_up", "w")]
+    held = recorded[1]["time"] - recorded[0]["time"]
+    assert 0.5 <= held < 0.6
+
+
+def test_actions_are_spaced_by_min_action_interval(controller):
+    controller.min_action_interval = 0.2
+    first = controller.execute_action("空格")
+    second = controller.execute_action("e")
+    assert first.wait(2) and second.wait(2)
+
+    downs = events(controller, "key_down")
+    assert [event["key"] for event in downs] == ["space", "e"]
+    assert downs[1]["time"] - downs[0]["time"] >= 0.19
+    # 每个按键都在按下之后松开
+    order = [(event["event"], event["key"]) for event in events(controller)]
+    for key in ("space", "e"):
+        assert order.index(("key_down", key)) < order.index(("key_up", key))
+
+
+def test_overlapping_holds_of_same_key_press_once(controller):
+    controller.min_action_interval = 0.0
+    handles = [controller.execute_action("w"), controller.execute_action("w")]
+    assert all(handle.wait(2) for handle in handles)
+    keys = [(event["event"], event["key"]) for event in events(controller)]
+    assert keys == [("key_down", "w"), ("key_up", "w")]
+
+
+def test_click_and_camera_turn(controller):
+    controller.min_action_interval = 0.1
+    click = controller.execute_action("左键点击")
+    turn = controller.execute_action("鼠标左移")
+    assert click.wait(2) and turn.wait(2)
+
+    clicks = events(controller, "click")
+    moves = events(controller, "move_relative")
+    assert [event["button"] for event in clicks] == ["left"]
+    assert sum(event["dx"] for event in moves) == -50
+    # 视角转动同样遵守操作间隔
+    assert moves[0]["time"] - clicks[0]["time"] >= 0.09
+
+
+def test_unknown_action_is_skipped(controller):
+    handle = controller.execute_action("飞行")
+    assert handle.done and not handle.ok
+    assert events(controller) == []
+
+
+def test_close_releases_held_keys_and_writes_log(tmp_path):
+    log_path = tmp_path / "input.jsonl"
+    controller = GameController(input_backend=RecordingBackend(log_path=str(log_path)))
+    handle = controller.execute_action("w")
+    deadline = time.time() + 1
+    while not events(controller, "key_down") and time.time() < deadline:
+        time.sleep(0.01)
+    controller.close()
+
+    assert handle.done and not handle.ok
+    with open(log_path, encoding="utf-8") as f:
+        logged = [json.loads(line) for line in f]
+    assert [(event["event"], event["key"]) for event in logged] == [("key_down", "w"), ("key_up", "w")]
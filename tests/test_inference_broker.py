@@ -0,0 +1,163 @@
+# test_inference_broker.py
+import threading
+import time
+
+import pytest
+import requests
+
+import inference_broker
+from inference_broker import InferenceBroker
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"response": self.body["prompt"], "done": True}
+
+
+class FakeOllama:
+    """代替requests.post：记录发出的提示词，gate打开前阻塞"""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.prompts = []
+        self.lock = threading.Lock()
+
+    def post(self, url, json, timeout):
+        with self.lock:
+            self.prompts.append(json["prompt"])
+        self.gate.wait(timeout)
+        return FakeResponse(json)
+
+
+@pytest.fixture
+def ollama(monkeypatch):
+    fake = FakeOllama()
+    monkeypatch.setattr(inference_broker.requests, "post", fake.post)
+    yield fake
+    fake.gate.set()
+
+
+@pytest.fixture
+def make_broker():
+    brokers = []
+
+    def make(**kwargs):
+        broker = InferenceBroker(backend_url="http://ollama", **kwargs)
+        brokers.append(broker)
+        return broker
+
+    yield make
+    for broker in brokers:
+        broker.close()
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def body(prompt, **extra):
+    return dict({"model": "m", "prompt": prompt}, **extra)
+
+
+def test_identical_prompts_are_coalesced(ollama, make_broker):
+    broker = make_broker(batch_size=2)
+    leader = broker.submit("a", body("p"))
+    assert wait_for(lambda: ollama.prompts == ["p"])
+    # 只有stream不同的请求也视为同一个提示词
+    follower = broker.submit("b", body("p", stream=False))
+    ollama.gate.set()
+
+    assert leader.done.wait(2) and follower.done.wait(2)
+    assert follower.result == leader.result == {"response": "p", "done": True}
+    assert ollama.prompts == ["p"]
+    assert broker.stats["coalesced"] == 1
+
+
+def test_expired_requests_are_dropped(ollama, make_broker):
+    broker = make_broker(batch_size=1)
+    first = broker.submit("a", body("first"))
+    assert wait_for(lambda: ollama.prompts == ["first"])
+    expiring = broker.submit("a", body("late"), timeout=0.05)
+    time.sleep(0.1)
+    ollama.gate.set()
+
+    assert first.done.wait(2) and expiring.done.wait(2)
+    assert expiring.result is None and "截止时间" in expiring.error
+    assert ollama.prompts == ["first"]
+    assert broker.stats["expired"] == 1
+
+
+def test_rejects_when_agent_queue_is_full(ollama, make_broker):
+    broker = make_broker(batch_size=1, max_queue_per_agent=1)
+    broker.submit("a", body("running"))
+    assert wait_for(lambda: broker.inflight == 1)
+    queued = broker.submit("a", body("queued"))
+    rejected = broker.submit("a", body("rejected"))
+
+    assert rejected.done.is_set() and rejected.error
+    assert not queued.done.is_set()
+    assert broker.stats["rejected"] == 1
+
+
+def test_agents_are_served_round_robin(ollama, make_broker):
+    broker = make_broker(batch_size=1)
+    handles = [broker.submit("a", body("a0"))]
+    assert wait_for(lambda: ollama.prompts == ["a0"])
+    handles += [broker.submit("a", body("a1")), broker.submit("a", body("a2")), broker.submit("b", body("b1"))]
+    ollama.gate.set()
+
+    assert all(request.done.wait(2) for request in handles)
+    assert ollama.prompts.index("b1") < ollama.prompts.index("a2")
+
+
+def test_cancel_removes_queued_request_and_follower(ollama, make_broker):
+    broker = make_broker(batch_size=1)
+    running = broker.submit("a", body("running"))
+    assert wait_for(lambda: broker.inflight == 1)
+    follower = broker.submit("b", body("running"))
+    queued = broker.submit("a", body("queued"))
+
+    assert broker.cancel(follower)
+    assert broker.cancel(queued)
+    assert not broker.cancel(running)  # 已在执行中
+    assert queued.done.is_set() and queued.error
+    assert broker.get_stats()["queue_depth"] == 0
+    assert broker.stats["cancelled"] == 2
+
+    ollama.gate.set()
+    assert running.done.wait(2)
+    time.sleep(0.05)
+    assert ollama.prompts == ["running"]
+
+
+def test_disconnected_stream_client_is_dropped(ollama):
+    server, broker = inference_broker.create_broker_server("127.0.0.1", 0, "http://ollama", batch_size=1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/generate"
+    session = requests.Session()  # requests.post已被替换为FakeOllama，客户端改用Session
+    try:
+        broker.submit("a", body("running"))
+        assert wait_for(lambda: broker.inflight == 1)
+        # 排队期间代理发送空行心跳，客户端读到第一行后断开
+        response = session.post(url, json=body("queued"), headers={"X-Agent-Id": "a"}, stream=True, timeout=5)
+        assert next(response.iter_lines()) == b""
+        response.close()
+        assert wait_for(lambda: broker.stats["cancelled"] == 1)
+        assert broker.get_stats()["queue_depth"] == 0
+    finally:
+        ollama.gate.set()
+        server.shutdown()
+        server.server_close()
+        broker.close()
+
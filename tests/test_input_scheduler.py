@@ -0,0 +1,120 @@
+# test_input_scheduler.py
+import threading
+import time
+
+import pytest
+
+from input_backend import InputBackend
+from input_scheduler import ActionHandle, InputScheduler
+
+
+class RecordingBackend(InputBackend):
+    """记录发出的输入事件和每次flush之间的批次"""
+
+    name = "recording"
+
+    def __init__(self):
+        self.events = []
+        self.batches = []
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def key_down(self, key):
+        with self.lock:
+            self.events.append(("down", key))
+            self.pending.append(("down", key))
+
+    def key_up(self, key):
+        with self.lock:
+            self.events.append(("up", key))
+            self.pending.append(("up", key))
+
+    def move_relative(self, dx, dy):
+        with self.lock:
+            self.events.append(("move", dx, dy))
+            self.pending.append(("move", dx, dy))
+
+    def flush(self):
+        with self.lock:
+            if self.pending:
+                self.batches.append(self.pending)
+                self.pending = []
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def scheduler():
+    backend = RecordingBackend()
+    scheduler = InputScheduler(backend)
+    yield scheduler
+    scheduler.close()
+
+
+def test_overlapping_holds_of_same_key_are_merged(scheduler):
+    first = scheduler.hold_key("w", 0.2)
+    second = scheduler.hold_key("w", 0.05)
+    assert second.wait(1)
+    # 较短的按住结束时按键仍被第一次按住
+    assert scheduler.held_keys == {"w": 1}
+    assert first.wait(1)
+    assert scheduler.backend.events == [("down", "w"), ("up", "w")]
+    assert scheduler.held_keys == {}
+
+
+def test_different_keys_are_held_together(scheduler):
+    handles = [scheduler.hold_key("w", 0.1), scheduler.hold_key("a", 0.1)]
+    assert all(handle.wait(1) for handle in handles)
+    events = scheduler.backend.events
+    assert sorted(events) == [("down", "a"), ("down", "w"), ("up", "a"), ("up", "w")]
+    # 两个按键都按下后才松开
+    assert max(events.index(("down", "w")), events.index(("down", "a"))) < \
+        min(events.index(("up", "w")), events.index(("up", "a")))
+
+
+def test_sequential_holds_press_again(scheduler):
+    assert scheduler.hold_key("w", 0.02).wait(1)
+    assert scheduler.hold_key("w", 0.02).wait(1)
+    assert scheduler.backend.events == [("down", "w"), ("up", "w")] * 2
+
+
+def test_release_all_releases_held_keys_and_cancels_pending(scheduler):
+    handle = scheduler.hold_key("w", 5.0)
+    deadline = time.time() + 1
+    while not scheduler.held_keys and time.time() < deadline:
+        time.sleep(0.01)
+    scheduler.release_all()
+    assert handle.done and not handle.ok
+    assert scheduler.backend.events == [("down", "w"), ("up", "w")]
+    assert scheduler.held_keys == {}
+
+
+def test_smooth_move_sums_to_target(scheduler):
+    handle = scheduler.move_relative(101, -7, duration=0.05, steps=4)
+    assert handle.wait(1)
+    moves = [event for event in scheduler.backend.events if event[0] == "move"]
+    assert len(moves) == 4
+    assert sum(move[1] for move in moves) == 101 and sum(move[2] for move in moves) == -7
+
+
+def test_handle_records_latency(scheduler):
+    handle = scheduler.hold_key("s", 0.05)
+    assert handle.wait(1)
+    assert handle.ok and handle.latency >= 0.05
+    assert handle.started_at >= handle.enqueued_at
+    assert scheduler.get_stats()["count"] == 1
+
+
+def test_completed_handle_is_done():
+    handle = ActionHandle.completed("e", ok=False)
+    assert handle.done and not handle.ok and handle.latency is not None
+
+
+def test_key_down_popped_before_release_all_is_dropped(scheduler):
+    # 调度线程在release_all()之前取出的按下事件，执行时已过期
+    scheduler.batch_generation = scheduler.generation
+    scheduler.release_all()
+    scheduler._key_down("w")
+    assert scheduler.backend.events == []
+    assert scheduler.get_stats()["held_keys"] == {}
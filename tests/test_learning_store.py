@@ -0,0 +1,66 @@
+# test_learning_store.py
+import json
+
+import pytest
+
+from learning_store import (LearningStore, connect_learning_store, learning_memory_from_json, start_learning_store,
+                            stop_learning_store)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LearningStore(str(tmp_path / "learning.json"), save_interval=3600)
+    yield store
+    store.close()
+
+
+def test_record_batch_merges_updates(store):
+    store.record_batch([("1", "w", True), ("1", "w", True), ("2", "a", False)])
+    memory = store.snapshot()
+    assert memory["success_actions"]["1"]["w"] == pytest.approx(0.2)
+    assert memory["failure_actions"] == {"a"}
+    # 成功后移出失败记录
+    store.record_batch([("3", "a", True)])
+    assert "a" not in store.snapshot()["failure_actions"]
+    assert store.get_stats()["updates"] == 4 and store.get_stats()["states"] == 2
+
+
+def test_snapshot_is_a_copy(store):
+    store.record("1", "w", True)
+    memory = store.snapshot()
+    memory["success_actions"]["1"]["w"] = 100
+    assert store.snapshot()["success_actions"]["1"]["w"] == pytest.approx(0.1)
+
+
+def test_close_saves_and_reload_restores(tmp_path):
+    path = str(tmp_path / "learning.json")
+    store = LearningStore(path, save_interval=3600)
+    store.record_batch([("7", "d", True), ("7", "s", False)])
+    store.close()
+    with open(path, encoding="utf-8") as f:
+        assert learning_memory_from_json(json.load(f))["failure_actions"] == {"s"}
+
+    reloaded = LearningStore(path, save_interval=3600)
+    try:
+        assert reloaded.snapshot()["success_actions"] == {"7": {"d": pytest.approx(0.1)}}
+    finally:
+        reloaded.close()
+
+
+def test_manager_round_trip(tmp_path):
+    path = str(tmp_path / "shared.json")
+    manager, store = start_learning_store(path, address=("127.0.0.1", 0), authkey=b"secret")
+    try:
+        host, port = manager.address
+        assert port != 0
+        client = connect_learning_store((host, port), b"secret")
+        client.record_batch([("5", "w", True), ("5", "e", False)])
+        memory = client.snapshot()
+        assert memory["success_actions"] == {"5": {"w": pytest.approx(0.1)}}
+        assert memory["failure_actions"] == {"e"}
+        assert store.get_stats()["updates"] == 2
+    finally:
+        stats = stop_learning_store(manager, store)
+    assert stats["saves"] == 1
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f)["failure_actions"] == ["e"]
@@ -0,0 +1,79 @@
+# test_llm_health.py
+import threading
+import time
+
+from llm_health import CircuitBreaker, LatencyHistogram
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(lambda: False, failure_threshold=3, cooldown=60.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats["opened"] == 1
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(lambda: False, failure_threshold=2, cooldown=60.0)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failures_while_open_do_not_reopen():
+    breaker = CircuitBreaker(lambda: False, failure_threshold=1, cooldown=60.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.stats["opened"] == 1
+
+
+def test_failed_probe_stays_open_then_recovers():
+    healthy = threading.Event()
+    breaker = CircuitBreaker(healthy.is_set, failure_threshold=1, cooldown=0.05)
+    breaker.record_failure()
+    assert wait_for(lambda: breaker.stats["probe_failures"] >= 1)
+    assert breaker.state in (CircuitBreaker.OPEN, CircuitBreaker.PROBING)
+
+    healthy.set()
+    assert wait_for(lambda: breaker.state == CircuitBreaker.CLOSED)
+    assert breaker.consecutive_failures == 0
+
+
+def test_probe_exception_counts_as_failure():
+    def probe():
+        raise ConnectionError("down")
+
+    breaker = CircuitBreaker(probe, failure_threshold=1, cooldown=0.05)
+    breaker.record_failure()
+    assert wait_for(lambda: breaker.stats["probe_failures"] >= 1)
+    assert breaker.state != CircuitBreaker.CLOSED
+
+
+def test_probing_state_while_probe_runs():
+    release = threading.Event()
+    breaker = CircuitBreaker(lambda: release.wait(2.0), failure_threshold=1, cooldown=0.01)
+    breaker.record_failure()
+    assert wait_for(lambda: breaker.state == CircuitBreaker.PROBING)
+    release.set()
+    assert wait_for(lambda: breaker.state == CircuitBreaker.CLOSED)
+
+
+def test_latency_histogram_percentile():
+    histogram = LatencyHistogram(window=100)
+    for i in range(1, 101):
+        histogram.record(i / 100)
+    assert histogram.count() == 100
+    assert abs(histogram.percentile(50) - 0.5) <= 0.02
+    assert abs(histogram.percentile(95) - 0.95) <= 0.02
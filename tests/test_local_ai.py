@@ -0,0 +1,278 @@
+# test_local_ai.py
+import threading
+import time
+
+import pytest
+
+from learning_store import default_learning_memory
+from llm_health import CircuitBreaker
+from local_ai import DeepSeekAI
+from ollama_stub import STUB_ACTIONS, OllamaStub
+
+MODEL = "deepseek-r1:8b"
+
+
+def wait_for(condition, timeout=3.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def game_state(description="周围是草地", ratios=None):
+    return {
+        "description_cn": description,
+        "ratios": ratios or {"grass": 0.6, "sky": 0.4},
+        "detected_items": [],
+        "detected_structures": []
+    }
+
+
+@pytest.fixture
+def make_stub():
+    stubs = []
+
+    def make(**kwargs):
+        kwargs.setdefault("latency", "const:0.02")
+        kwargs.setdefault("token_delay", 0.001)
+        stub = OllamaStub(**kwargs)
+        stub.start()
+        stubs.append(stub)
+        return stub
+
+    yield make
+    for stub in stubs:
+        stub.stop()
+
+
+@pytest.fixture
+def make_ai(tmp_path):
+    ais = []
+
+    def make(stubs, **kwargs):
+        ai = DeepSeekAI(backends=[{"model": MODEL, "api_base": stub.url} for stub in stubs], **kwargs)
+        # 不读写仓库中的learning_data.json
+        ai.learning_memory = default_learning_memory()
+        ai.learning_data_path = str(tmp_path / "learning_data.json")
+        ais.append(ai)
+        return ai
+
+    yield make
+    for ai in ais:
+        ai.close()
+
+
+def prompt_requests(stub):
+    return stub.stats["requests"]
+
+
+def test_rule_tier_skips_llm(make_stub, make_ai):
+    stub = make_stub()
+    ai = make_ai([stub])
+    before = prompt_requests(stub)
+
+    assert ai.get_action(game_state("前方有树木")) == "左键点击"
+    assert ai.last_decision["tier"] == "rules"
+    assert prompt_requests(stub) == before
+
+
+def test_learned_tier_needs_confidence(make_stub, make_ai):
+    stub = make_stub()
+    ai = make_ai([stub])
+    state = game_state()
+    state_key = str(ai._get_state_key(state))
+    before = prompt_requests(stub)
+
+    ai.learning_memory["success_actions"][state_key] = {"d": 0.9}
+    assert ai.get_action(state) == "d"
+    assert ai.last_decision["tier"] == "learned"
+    assert prompt_requests(stub) == before
+
+    # 得分低于阈值时交给LLM
+    ai.learning_memory["success_actions"][state_key] = {"d": 0.1}
+    assert ai.get_action(state) in STUB_ACTIONS
+    assert ai.last_decision["tier"] == "llm"
+
+
+def test_llm_tier_within_budget(make_stub, make_ai):
+    stub = make_stub()
+    ai = make_ai([stub])
+
+    assert ai.get_action(game_state(), time_budget=1.0) in STUB_ACTIONS
+    assert ai.last_decision["tier"] == "llm"
+    assert ai.llm_outcomes["ok"] == 1
+    assert ai.backends[0].stats["wins"] == 1
+
+
+def test_small_budget_falls_back_without_llm(make_stub, make_ai):
+    stub = make_stub()
+    ai = make_ai([stub])
+    before = prompt_requests(stub)
+
+    ai.get_action(game_state(), time_budget=ai.min_llm_budget / 2)
+    assert ai.last_decision["tier"] == "fallback"
+    assert prompt_requests(stub) == before
+
+
+def test_budget_below_median_latency_falls_back(make_stub, make_ai):
+    stub = make_stub()
+    ai = make_ai([stub])
+    for _ in range(ai.min_latency_samples):
+        ai.latency_histogram.record(0.8)
+    before = prompt_requests(stub)
+
+    ai.get_action(game_state(), time_budget=0.5)
+    assert ai.last_decision["tier"] == "fallback"
+    assert prompt_requests(stub) == before
+
+    ai.get_action(game_state(), time_budget=1.0)
+    assert ai.last_decision["tier"] == "llm"
+
+
+def test_plan_mode_serves_following_frames_from_plan(make_stub, make_ai):
+    stub = make_stub()
+    ai = make_ai([stub], plan_mode=True)
+    state = game_state()
+
+    ai.get_action(state)
+    assert ai.last_decision["tier"] == "llm"
+    planned = list(ai.action_plan)
+    assert 0 < len(planned) < ai.max_plan_length
+    before = prompt_requests(stub)
+
+    assert ai.get_action(state) == planned[0]
+    assert ai.last_decision["tier"] == "plan"
+    assert prompt_requests(stub) == before
+
+
+def test_hedge_wins_and_cancels_slow_primary(make_stub, make_ai):
+    slow = make_stub(latency="const:1.5")
+    fast = make_stub()
+    ai = make_ai([slow, fast])
+    primary, hedge = ai.backends
+
+    start = time.time()
+    actions = ai._llm_decide(game_state(), ai._get_state_key(game_state()), timeout=1.0)
+    elapsed = time.time() - start
+
+    assert actions and actions[0] in STUB_ACTIONS
+    # 主请求等待超时的一半后才发出对冲请求
+    assert 0.45 <= elapsed < 1.0
+    assert hedge.stats["hedged"] == 1 and hedge.stats["wins"] == 1
+    assert primary.stats["wins"] == 0
+    assert wait_for(lambda: primary.stats["cancelled"] == 1)
+    assert primary.stats["timeouts"] == primary.stats["errors"] == 0
+    assert wait_for(lambda: slow.stats["cancelled"] == 1)
+
+
+def test_hedges_are_staggered(make_stub, make_ai):
+    slows = [make_stub(latency="const:1.0"), make_stub(latency="const:1.0")]
+    fast = make_stub()
+    ai = make_ai(slows + [fast])
+    ai._hedge_delay = lambda backend, timeout: 0.2
+
+    start = time.time()
+    actions = ai._llm_decide(game_state(), ai._get_state_key(game_state()), timeout=2.0)
+    elapsed = time.time() - start
+
+    assert actions
+    # 第二个对冲请求在第一个对冲请求之后再等一个对冲延迟才发出
+    assert 0.4 <= elapsed < 1.0
+    assert ai.backends[2].stats["wins"] == 1
+    assert [backend.stats["hedged"] for backend in ai.backends] == [0, 1, 1]
+    assert wait_for(lambda: all(backend.stats["cancelled"] == 1 for backend in ai.backends[:2]))
+
+
+def test_caller_cancel_is_not_counted_as_outcome(make_stub, make_ai):
+    stub = make_stub(latency="const:1.0")
+    ai = make_ai([stub])
+    cancel_event = threading.Event()
+    threading.Timer(0.1, cancel_event.set).start()
+
+    assert ai._llm_decide(game_state(), ai._get_state_key(game_state()), 2.0, cancel_event) == []
+    assert ai.llm_outcomes == {"ok": 0, "timeout": 0, "failed": 0}
+    assert ai.latency_histogram.count() == 0
+
+
+def test_malformed_structured_output_falls_back(make_stub, make_ai):
+    stub = make_stub()
+    stub.build_response = lambda body: '{"action": "w"'
+    ai = make_ai([stub])
+
+    ai.get_action(game_state())
+    assert ai.last_decision["tier"] == "fallback"
+    assert ai.llm_outcomes["failed"] == 1
+    # 输出无法解析不算后端故障
+    assert ai.backends[0].stats["errors"] == 0
+    assert ai.backends[0].circuit_breaker.state == CircuitBreaker.CLOSED
+
+
+def test_structured_output_rejects_actions_outside_schema(make_stub, make_ai):
+    stub = make_stub()
+    ai = make_ai([stub])
+    request = ai._build_generate_request(ai.backends[0], "环境", "0")
+    assert request["format"]["properties"]["action"]["enum"] == list(DeepSeekAI.ACTION_MAP.values())
+
+    assert ai._parse_structured('{"action": "w"}') == ["w"]
+    assert ai._parse_structured('{"action": "飞行"}') == []
+    assert ai._parse_structured('["w"]') == []
+    ai.plan_mode = True
+    assert ai._parse_structured('{"actions": ["w", "飞行", "a", "s", "d", "e"]}') == ["w", "a", "s", "d"]
+
+
+def test_free_text_output_is_matched(make_stub, make_ai):
+    stub = make_stub()
+    ai = make_ai([stub], structured_output=False)
+    assert "format" not in ai._build_generate_request(ai.backends[0], "环境", "0")
+
+    assert ai.get_action(game_state()) in STUB_ACTIONS
+    assert ai.last_decision["tier"] == "llm"
+
+
+def test_prefix_context_trims_generated_tokens(make_stub, make_ai):
+    stub = make_stub()
+    ai = make_ai([stub])
+    backend = ai.backends[0]
+
+    # 替身的context = 提示词token + 生成的token，预热只生成1个token
+    assert backend.prefix_context == list(range(len(ai._prompt_prefix()) // 2))
+
+    suffix = ai._optimize_prompt(game_state())
+    request = ai._build_generate_request(backend, suffix, ai._get_state_key(game_state()))
+    assert request["context"] == backend.prefix_context and request["prompt"] == suffix
+
+    ai.get_action(game_state())
+    assert ai.prefill_stats["prompt_tokens"] == max(1, len(suffix) // 2)
+    assert ai.get_prefill_report()["prefix_reused"]
+
+
+def test_without_prefix_reuse_sends_full_prompt(make_stub, make_ai):
+    stub = make_stub()
+    ai = make_ai([stub], reuse_prefix=False)
+    backend = ai.backends[0]
+    assert backend.prefix_context is None
+
+    suffix = ai._optimize_prompt(game_state())
+    request = ai._build_generate_request(backend, suffix, ai._get_state_key(game_state()))
+    assert "context" not in request
+    assert request["prompt"] == ai._prompt_prefix() + suffix
+
+
+def test_breaker_opens_on_errors_and_skips_llm(make_stub, make_ai):
+    stub = make_stub(error_rate=1.0)
+    ai = make_ai([stub])
+    backend = ai.backends[0]
+
+    for _ in range(3):
+        ai.get_action(game_state())
+        assert ai.last_decision["tier"] == "fallback"
+    assert backend.stats["errors"] == 3
+    assert backend.circuit_breaker.state == CircuitBreaker.OPEN
+
+    before = prompt_requests(stub)
+    ai.get_action(game_state())
+    assert ai.last_decision["tier"] == "fallback"
+    assert ai.breaker_rejections == 1
+    assert prompt_requests(stub) == before
@@ -0,0 +1,62 @@
+# test_memory_budget.py
+import time
+
+import numpy as np
+
+from memory_budget import BoundedCache, MemoryBudget, deep_sizeof
+from ui_locator import UILocator
+
+
+def test_bounded_cache_evicts_least_recently_used():
+    cache = BoundedCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # a变为最近使用
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert len(cache) == 2 and cache.stats["evictions"] == 1
+
+
+def test_bounded_cache_expires_entries():
+    cache = BoundedCache(max_entries=4, ttl=0.05)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a", "missing") == "missing"
+    assert cache.stats["expired"] == 1 and len(cache) == 0
+
+
+def test_deep_sizeof_counts_shared_objects_once_and_array_data():
+    shared = "x" * 10000
+    assert deep_sizeof([shared, shared]) < 2 * len(shared)
+    array = np.zeros((100, 100, 3), dtype=np.uint8)
+    assert deep_sizeof({"frame": array[:50]}) >= array[:50].nbytes
+
+
+def test_memory_budget_measures_and_trims():
+    budget = MemoryBudget(budget_mb=0.001, interval=3600)
+    cache = BoundedCache()
+    cache.put("a", "x" * 1000)
+    try:
+        budget.register("cache", lambda: cache.entries, trim=cache.clear)
+        report = budget.measure()
+    finally:
+        budget.close()
+    assert report["components"]["cache"] > 1000
+    if report["rss"] is not None:
+        assert budget.stats["trims"] == 1 and len(cache) == 0
+
+
+def test_ui_locator_keeps_most_recent_layouts(tmp_path):
+    locator = UILocator(cache_path=str(tmp_path / "cache.json"), max_layouts=2, save_delay=0)
+    try:
+        locator.put("button", "800x600@0", (1, 1))
+        locator.put("button", "1024x768@0", (2, 2))
+        locator.put("button", "800x600@0", (3, 3))  # 更新后变为最新
+        locator.put("button", "1920x1080@0", (4, 4))
+        assert list(locator.positions["button"]) == ["800x600@0", "1920x1080@0"]
+        assert locator.get("button", "800x600@0") == (3, 3)
+        assert locator.stats["evictions"] == 1
+    finally:
+        locator.close()
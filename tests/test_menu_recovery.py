@@ -0,0 +1,72 @@
+# test_menu_recovery.py
+from menu_recovery import MenuRecovery
+
+
+class FakeAnalyzer:
+    """按顺序返回菜单检测结果，用完后一直返回最后一个"""
+
+    def __init__(self, results):
+        self.results = list(results)
+        self.calls = 0
+
+    def is_menu_open_fast(self, frame):
+        self.calls += 1
+        return self.results.pop(0) if len(self.results) > 1 else self.results[0]
+
+
+class FakeCapture:
+    tracker = None
+    game_region = {"top": 0, "left": 0, "width": 100, "height": 100}
+
+    def capture_frame(self):
+        return object()
+
+
+class FakeController:
+    def __init__(self):
+        self.actions = []
+
+    def execute_action(self, action):
+        self.actions.append(action)
+        return _Done()
+
+    def _click_back_to_game(self, region):
+        self.actions.append("click")
+
+    def start_back_to_game_exe(self):
+        self.actions.append("exe")
+        return None
+
+
+class _Done:
+    def wait(self, timeout=None):
+        return True
+
+
+def recover(menu_results):
+    controller = FakeController()
+    recovery = MenuRecovery(controller, FakeCapture(), FakeAnalyzer(menu_results), poll_interval=0.001)
+    recovery.METHODS = tuple((name, 0.02) for name, _ in MenuRecovery.METHODS)
+    assert recovery.start()
+    recovery.thread.join(2)
+    return recovery, controller
+
+
+def test_menu_already_closed_skips_esc():
+    recovery, controller = recover([False])
+    assert controller.actions == []
+    assert recovery.stats["recovered"] == 1 and recovery.stats["already_closed"] == 1
+    assert recovery.method_stats["esc"]["tries"] == 0
+
+
+def test_esc_closes_menu():
+    recovery, controller = recover([True, False])
+    assert controller.actions == ["esc"]
+    assert recovery.method_stats["esc"]["successes"] == 1
+
+
+def test_all_methods_fail():
+    recovery, controller = recover([True])
+    assert controller.actions == ["esc", "click", "exe"]
+    assert recovery.stats["failed"] == 1
+    assert not recovery.start()  # 失败冷却期内不再启动
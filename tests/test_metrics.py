@@ -0,0 +1,59 @@
+# test_metrics.py
+import random
+
+import pytest
+
+from metrics import Histogram, MetricsRegistry
+
+
+def test_bucket_upper_bound_within_relative_error():
+    histogram = Histogram("h")
+    rng = random.Random(0)
+    for micros in [0, 1, 15, 16, 31, 32, 33, 1000, 1023, 1024] + [rng.randrange(1, 10 ** 8) for _ in range(1000)]:
+        bound = histogram._upper_bound(histogram._index(micros)) * 1e6
+        assert micros < bound + 1e-6
+        assert bound - micros <= max(1, micros / 16) + 1e-6
+
+
+def test_record_matches_index():
+    histogram = Histogram("h")
+    for seconds in (0.0, 0.000003, 0.0004, 0.0123, 0.75, 3.2):
+        histogram.counts.clear()
+        histogram.record(seconds)
+        assert list(histogram.counts) == [histogram._index(int(seconds * 1e6))]
+
+
+def test_percentiles():
+    histogram = Histogram("h")
+    assert histogram.percentile(50) is None
+    for i in range(1, 101):
+        histogram.record(i / 1000)
+    assert histogram.count == 100
+    assert histogram.percentile(50) == pytest.approx(0.05, rel=0.07)
+    assert histogram.percentile(99) == pytest.approx(0.099, rel=0.07)
+    assert histogram.percentile(100) >= 0.1
+
+
+def test_cumulative_export_buckets():
+    histogram = Histogram("h")
+    for seconds in (0.0005, 0.003, 0.003, 0.2, 7.0):
+        histogram.record(seconds)
+    cumulative = dict(histogram.cumulative())
+    assert cumulative[0.001] == 1
+    assert cumulative[0.005] == 3
+    assert cumulative[0.25] == 4
+    assert cumulative[10.0] == 5
+
+
+def test_registry_reuses_metrics_and_renders_prometheus():
+    registry = MetricsRegistry(prefix="test")
+    counter = registry.counter("events_total", "事件数", {"stage": "a"})
+    assert registry.counter("events_total", labels={"stage": "a"}) is counter
+    counter.inc(2)
+    registry.histogram("latency_seconds").record(0.02)
+    registry.set_const_labels(instance="mc0")
+
+    text = registry.render_prometheus()
+    assert 'test_events_total{instance="mc0",stage="a"} 2' in text
+    assert 'test_latency_seconds_bucket{instance="mc0",le="0.025"} 1' in text
+    assert 'test_latency_seconds_count{instance="mc0"} 1' in text
@@ -0,0 +1,47 @@
+# test_orchestrator.py
+from orchestrator import AgentInstance, Orchestrator, plan_cpu_affinity
+
+
+class FakeProcess:
+    def __init__(self, exitcode):
+        self.exitcode = exitcode
+
+    def is_alive(self):
+        return False
+
+
+def supervise(exit_codes, max_restarts=2):
+    """按exit_codes依次作为每次启动的退出码运行supervise()，返回实例"""
+    orchestrator = Orchestrator([], max_restarts=max_restarts, restart_delay=0)
+    instance = AgentInstance("mc0", 1, "Minecraft", [], [], "out")
+    orchestrator.instances = [instance]
+    codes = iter(exit_codes)
+
+    def spawn(instance):
+        instance.process = FakeProcess(next(codes))
+
+    orchestrator._spawn = spawn
+    spawn(instance)
+    orchestrator.supervise(poll_interval=0)
+    return instance
+
+
+def test_runtime_error_is_restarted():
+    instance = supervise([1, 0])
+    assert instance.restarts == 1 and instance.exit_codes == [1, 0] and instance.finished
+
+
+def test_restarts_are_capped():
+    instance = supervise([1, 1, 1, 1], max_restarts=2)
+    assert instance.restarts == 2 and instance.exit_codes == [1, 1, 1]
+
+
+def test_init_and_import_errors_are_not_restarted():
+    for code in (2, 3):
+        instance = supervise([code])
+        assert instance.restarts == 0 and instance.exit_codes == [code]
+
+
+def test_plan_cpu_affinity_reserves_and_shares_cores():
+    assert plan_cpu_affinity(2, 5, reserved=1) == [[1, 2], [3, 4]]
+    assert plan_cpu_affinity(3, 2, reserved=1) == [[1], [1], [1]]
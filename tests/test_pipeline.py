@@ -0,0 +1,58 @@
+# test_pipeline.py
+import threading
+import time
+
+from pipeline import DropOldestQueue, Pipeline
+
+
+def test_put_drops_oldest_when_full():
+    queue = DropOldestQueue(maxsize=2)
+    assert queue.put(1) is None
+    assert queue.put(2) is None
+    assert queue.put(3) == 1
+    assert queue.get(0) == 2 and queue.get(0) == 3
+    assert queue.stats["dropped"] == 1 and queue.stats["max_depth"] == 2
+
+
+def test_get_times_out_and_close_wakes_waiter():
+    queue = DropOldestQueue()
+    assert queue.get(timeout=0.01) is None
+
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(queue.get(timeout=5)))
+    waiter.start()
+    queue.close()
+    waiter.join(1)
+    assert not waiter.is_alive() and results == [None]
+
+
+def test_stages_pass_items_downstream():
+    counter = iter(range(1000))
+    pipeline = Pipeline(tick_rate=100, queue_size=4)
+    pipeline.add_stage("source", lambda: next(counter))
+    output = pipeline.add_stage("double", lambda item: item * 2)
+    pipeline.start()
+    try:
+        items = [output.get(timeout=1) for _ in range(3)]
+    finally:
+        pipeline.stop()
+    assert all(item is not None and item % 2 == 0 for item in items)
+    assert items == sorted(items)
+
+
+def test_failing_stage_counts_consecutive_errors():
+    def broken(item):
+        raise ValueError("boom")
+
+    pipeline = Pipeline(tick_rate=200, queue_size=1)
+    pipeline.add_stage("source", lambda: 1)
+    pipeline.add_stage("broken", broken)
+    pipeline.start()
+    try:
+        deadline = time.time() + 2
+        while pipeline.failing_stage(5) is None and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        pipeline.stop()
+    assert pipeline.failing_stage(5) == "broken"
+    assert pipeline.stages[0].consecutive_errors == 0
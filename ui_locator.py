@@ -0,0 +1,175 @@
+# ui_locator.py
+import json
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from app_logging import get_logger
+
+logger = get_logger("ui_locator")
+
+
+class UILocator:
+    """界面元素位置缓存
+
+    同一分辨率和GUI缩放下，按钮、文字等界面元素的位置基本不变。
+    缓存按"分辨率@GUI缩放"记录每个元素上次找到的位置并持久化到文件；
+    查找时先用候选位置周围的小块区域(ROI)快速校验，校验失败才执行完整的图像搜索。
+    每个元素最多保留max_layouts个布局，窗口反复缩放时淘汰最久未更新的布局，缓存不会无限增长。
+    写文件在后台线程中进行，save_delay秒内的多次更新只写一次，截图和菜单恢复路径上不做I/O。
+    """
+
+    def __init__(self, cache_path=None, roi_radius=4, save_delay=2.0, max_layouts=8):
+        """
+        Args:
+            cache_path (str): 缓存文件路径，默认为项目目录下的ui_locator_cache.json
+            roi_radius (int): 校验区域的半径(像素)，校验区域大小为(2r+1)x(2r+1)
+            save_delay (float): 缓存更新后延迟多久写文件(秒)
+            max_layouts (int): 每个元素最多保留的布局数
+        """
+        self.cache_path = cache_path or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                     "ui_locator_cache.json")
+        self.roi_radius = roi_radius
+        self.save_delay = save_delay
+        self.max_layouts = max_layouts
+        self.lock = threading.Lock()
+        self.positions = self._load()
+        self.dirty = False
+        self.stats = {"hits": 0, "misses": 0, "verify_failures": 0, "not_found": 0, "saves": 0, "evictions": 0}
+
+        self.save_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._save_loop, name="UILocatorSave", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def layout_key(width, height, gui_scale=0):
+        return f"{width}x{height}@{gui_scale}"
+
+    def _load(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning("加载界面元素缓存失败: %s", e)
+            return {}
+
+    def _save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps(self.positions, ensure_ascii=False, indent=2)
+            self.dirty = False
+        # 先写临时文件再替换，避免写到一半时中断留下损坏的缓存
+        tmp_path = self.cache_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, self.cache_path)
+            self.stats["saves"] += 1
+        except Exception as e:
+            logger.warning("保存界面元素缓存失败: %s", e)
+
+    def _save_loop(self):
+        while not self.stop_event.is_set():
+            self.save_event.wait()
+            # 等待一小段时间，把期间的多次更新合并为一次写入
+            self.stop_event.wait(self.save_delay)
+            self.save_event.clear()
+            self._save()
+
+    def _mark_dirty(self):
+        """调用方需持有lock"""
+        self.dirty = True
+        self.save_event.set()
+
+    def close(self):
+        """停止后台线程并写出尚未保存的更新"""
+        self.stop_event.set()
+        self.save_event.set()
+        self.thread.join(timeout=2)
+        self._save()
+
+    def roi(self, frame, x, y):
+        """取(x, y)周围的小块区域，超出画面时返回None"""
+        r = self.roi_radius
+        height, width = frame.shape[:2]
+        if x - r < 0 or y - r < 0 or x + r >= width or y + r >= height:
+            return None
+        return frame[y - r:y + r + 1, x - r:x + r + 1]
+
+    def color_ratio_check(self, lower, upper, min_ratio=0.5):
+        """生成校验函数：ROI内落在HSV颜色范围[lower, upper]内的像素比例不低于min_ratio"""
+        lower = np.array(lower)
+        upper = np.array(upper)
+
+        def verify(frame, position):
+            patch = self.roi(frame, *position)
+            if patch is None:
+                return False
+            mask = cv2.inRange(cv2.cvtColor(patch, cv2.COLOR_BGR2HSV), lower, upper)
+            return cv2.countNonZero(mask) >= min_ratio * mask.size
+
+        return verify
+
+    def get(self, element, layout):
+        with self.lock:
+            entry = self.positions.get(element, {}).get(layout)
+        return (entry["x"], entry["y"]) if entry else None
+
+    def put(self, element, layout, position):
+        with self.lock:
+            entries = self.positions.setdefault(element, {})
+            entries.pop(layout, None)
+            entries[layout] = {
+                "x": int(position[0]),
+                "y": int(position[1]),
+                "time": time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+            # 字典按插入顺序排列，最前面的是最久未更新的布局
+            while len(entries) > self.max_layouts:
+                del entries[next(iter(entries))]
+                self.stats["evictions"] += 1
+            self._mark_dirty()
+
+    def locate(self, element, frame, layout, search, verify):
+        """查找界面元素，返回画面内坐标(x, y)，找不到时返回None
+
+        Args:
+            element (str): 元素名称
+            frame: 用于查找的画面
+            layout (str): layout_key()生成的分辨率/GUI缩放键
+            search: 完整搜索函数 search(frame) -> (x, y) 或 None
+            verify: 快速校验函数 verify(frame, (x, y)) -> bool
+        """
+        cached = self.get(element, layout)
+        if cached is not None:
+            if verify(frame, cached):
+                self.stats["hits"] += 1
+                return cached
+            self.stats["verify_failures"] += 1
+
+        self.stats["misses"] += 1
+        position = search(frame)
+        if position is None:
+            self.stats["not_found"] += 1
+            return None
+        self.put(element, layout, position)
+        return position
+
+    def invalidate(self, layout=None, element=None):
+        """窗口移动、缩放或GUI缩放变化后调用：清除指定元素和/或布局下的位置，都为None时清空全部缓存"""
+        with self.lock:
+            for name, entries in list(self.positions.items()):
+                if element is not None and name != element:
+                    continue
+                if layout is None:
+                    del self.positions[name]
+                else:
+                    entries.pop(layout, None)
+            self._mark_dirty()
@@ -0,0 +1,206 @@
+# window_tracker.py
+import threading
+import time
+
+import win32gui
+
+from app_logging import get_logger
+
+logger = get_logger("window_tracker")
+
+
+# 排除编辑器等标题中也可能包含minecraft的窗口
+EXCLUDE_KEYWORDS = ["trae", "editor", "code", "studio", "vscode", "pycharm"]
+
+
+def find_game_windows(title_keyword="minecraft"):
+    """枚举所有可见的Minecraft窗口，返回[(hwnd, 标题)]"""
+    windows = []
+
+    def callback(hwnd, extra):
+        if not win32gui.IsWindowVisible(hwnd):
+            return
+        title = win32gui.GetWindowText(hwnd)
+        lowered = title.lower()
+        if title_keyword in lowered and not any(k in lowered for k in EXCLUDE_KEYWORDS):
+            windows.append((hwnd, title))
+
+    win32gui.EnumWindows(callback, None)
+    return windows
+
+
+class GameWindowTracker:
+    """共享的游戏窗口跟踪器
+
+    只在启动时枚举一次窗口找到Minecraft，之后直接读取该窗口的客户区（不含标题栏和边框），
+    后台线程以很低的代价轮询窗口的移动、大小变化和焦点丢失。
+    game_region每次变化时整体替换为新的字典，读取方拿到的总是一致的区域；
+    变化时通知注册的监听者（例如界面元素缓存），让它们作废依赖旧位置的数据。
+    """
+
+    def __init__(self, title_keyword="minecraft", poll_interval=0.25, hwnd=None):
+        """
+        Args:
+            hwnd (int): 指定要跟踪的窗口（多实例运行时每个进程绑定一个窗口），None表示自动查找
+        """
+        self.title_keyword = title_keyword
+        self.poll_interval = poll_interval
+        self.target_hwnd = hwnd
+        self.hwnd = None
+        self.title = None
+        self.game_region = None  # {"top", "left", "width", "height"}，只整体替换不原地修改
+        self.focused = False
+        self.version = 0  # 每次区域变化加1
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.stats = {"moves": 0, "resizes": 0, "focus_lost": 0, "window_lost": 0}
+        self.running = False
+        self.thread = None
+
+    def add_listener(self, callback):
+        """注册变化回调 callback(event, region)，event为moved/resized/focus_lost/focus_gained/window_lost"""
+        with self.lock:
+            self.listeners.append(callback)
+
+    def _notify(self, event, region):
+        with self.lock:
+            listeners = list(self.listeners)
+        for callback in listeners:
+            try:
+                callback(event, region)
+            except Exception as e:
+                logger.warning("窗口变化回调出错: %s", e, event=event)
+
+    def find(self):
+        """查找Minecraft窗口并读取客户区，多个窗口匹配时优先选择前台窗口，否则选择面积最大的；
+        指定了窗口时只绑定该窗口"""
+        if self.target_hwnd is not None:
+            if not win32gui.IsWindow(self.target_hwnd):
+                raise Exception(f"指定的游戏窗口已不存在: {self.target_hwnd}")
+            candidates = [self.target_hwnd]
+        else:
+            candidates = [hwnd for hwnd, _ in find_game_windows(self.title_keyword)]
+        if not candidates:
+            raise Exception("未找到我的世界窗口！请检查：\n1. 游戏已启动且处于窗口化模式（非全屏）\n2. 窗口未被最小化\n3. 窗口标题中包含'Minecraft'（如启动器或游戏内标题）")
+
+        foreground = win32gui.GetForegroundWindow()
+        if foreground in candidates:
+            hwnd = foreground
+        else:
+            hwnd = max(candidates, key=lambda h: self._area(self._read_region(h)))
+        if len(candidates) > 1:
+            logger.info("找到多个Minecraft窗口，自动选择", count=len(candidates), title=win32gui.GetWindowText(hwnd))
+
+        self.hwnd = hwnd
+        self.title = win32gui.GetWindowText(hwnd)
+        self.game_region = self._read_region(hwnd)
+        self.focused = foreground == hwnd
+        self.version += 1
+        logger.info("游戏窗口定位成功", title=self.title, region=self.game_region)
+        return self.game_region
+
+    @staticmethod
+    def _area(region):
+        return region["width"] * region["height"] if region else 0
+
+    @staticmethod
+    def _read_region(hwnd):
+        """读取窗口客户区的屏幕坐标，窗口最小化或已关闭时返回None"""
+        try:
+            if not win32gui.IsWindow(hwnd) or win32gui.IsIconic(hwnd):
+                return None
+            _, _, width, height = win32gui.GetClientRect(hwnd)
+            left, top = win32gui.ClientToScreen(hwnd, (0, 0))
+        except win32gui.error:
+            return None
+        if width <= 0 or height <= 0:
+            return None
+        return {"top": top, "left": left, "width": width, "height": height}
+
+    def activate(self):
+        """把游戏窗口切到前台"""
+        if self.hwnd is None:
+            self.find()
+        try:
+            win32gui.SetForegroundWindow(self.hwnd)
+        except Exception as e:
+            logger.warning("激活窗口时出错: %s", e)
+
+    def poll(self):
+        """检查一次窗口位置、大小和焦点，有变化时更新game_region并通知监听者"""
+        if self.hwnd is None:
+            return
+        region = self._read_region(self.hwnd)
+        focused = win32gui.GetForegroundWindow() == self.hwnd
+
+        if region is None:
+            if not win32gui.IsWindow(self.hwnd):
+                # 先清除区域再清除窗口句柄，截图不会继续截取已关闭窗口所在的屏幕区域；
+                # 轮询线程在hwnd为None时重新查找窗口
+                self.stats["window_lost"] += 1
+                self.game_region = None
+                self.version += 1
+                self.hwnd = None
+                self._notify("window_lost", None)
+                return
+            # 最小化：保留最后的区域，只作为焦点丢失处理
+            focused = False
+        else:
+            old = self.game_region
+            if old is None or (region["width"], region["height"]) != (old["width"], old["height"]):
+                self.game_region = region
+                self.version += 1
+                self.stats["resizes"] += 1
+                self._notify("resized", region)
+            elif (region["left"], region["top"]) != (old["left"], old["top"]):
+                self.game_region = region
+                self.version += 1
+                self.stats["moves"] += 1
+                self._notify("moved", region)
+
+        if focused != self.focused:
+            self.focused = focused
+            if not focused:
+                self.stats["focus_lost"] += 1
+            self._notify("focus_gained" if focused else "focus_lost", self.game_region)
+
+    def _run(self):
+        while self.running:
+            try:
+                if self.hwnd is None:
+                    self.find()
+                self.poll()
+            except Exception as e:
+                logger.warning("窗口跟踪出错: %s", e)
+            time.sleep(self.poll_interval)
+
+    def start(self):
+        """启动后台轮询线程（重复调用无影响）"""
+        with self.lock:
+            if self.running:
+                return
+            if self.hwnd is None:
+                self.find()
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name="GameWindowTracker", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+
+
+_shared_tracker = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_tracker(hwnd=None):
+    """整个进程共用一个窗口跟踪器，首次调用时查找窗口（或绑定指定的hwnd）并启动轮询线程"""
+    global _shared_tracker
+    with _shared_lock:
+        if _shared_tracker is None:
+            tracker = GameWindowTracker(hwnd=hwnd)
+            tracker.start()
+            _shared_tracker = tracker
+        return _shared_tracker